@@ -0,0 +1,230 @@
+#!usr/bin/python
+"""
+Exact adjudication of unfinished Connect Four games with the endgame solver.
+The last position of every game which stopped before a win or a full board is solved
+with perfect play on a process pool: the winner (0 for a draw) and the plies until the
+end of the game. Solved positions are kept in a cache file between the runs.
+Games: a GameRecord archive, a SelfPlay JSONL or binary file or lines of 1-based moves (e.g. 4453).
+    python Adjudicate.py solve 44444433333
+    python Adjudicate.py games games.c4a --cache solved.bin --max-empty 20 --output results.jsonl
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Connect4BackEnd import BitBoard
+from ConnectAI import Agent, SolveResult, SolvedCache, Solver
+from GameRecord import RECORD_MAGIC, ARCHIVE_MAGIC, ArchiveReader, load_record
+from SelfPlay import BINARY_MAGIC, read_binary
+
+
+#############
+# CONSTANTS #
+#############
+# bigger endgames take too long to solve exactly
+MAX_EMPTY: int = 20
+
+# positions of one task of a worker
+CHUNK_SIZE: int = 64
+
+
+#########
+# INPUT #
+#########
+def read_games(path: str) -> tuple[tuple[int, int, int] | None, list[bytes]]:
+    """
+    Rows, columns and length of a line of the board of the games (None if the file does
+    not store them: JSONL and lines of moves) and the columns of the moves of every game.
+    """
+    with open(path, 'rb') as file:
+        magic: bytes = file.read(4)
+
+    if magic == ARCHIVE_MAGIC:
+        with ArchiveReader(path) as reader:
+            records: list = list(reader)
+        boards: set[tuple[int, int, int]] = {(r.row_count, r.column_count, r.connect) for r in records}
+        if len(boards) > 1:
+            raise ValueError(f'{path} mixes games of different boards')
+        return (boards.pop() if boards else None), [record.moves for record in records]
+    if magic == RECORD_MAGIC:
+        record = load_record(path)
+        return (record.row_count, record.column_count, record.connect), [record.moves]
+    if magic == BINARY_MAGIC:
+        dimensions, games = read_binary(path)
+        return dimensions, [moves for _, _, moves in games]
+
+    games: list[bytes] = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            moves = json.loads(line)['moves'] if line.startswith('{') else line
+            # a string or a list of 1-based columns
+            games.append(bytes(int(col) - 1 for col in moves))
+    return None, games
+
+
+def last_position(geometry: BitBoard, moves: bytes) -> tuple[int, int] | None:
+    """Disks of the player to move and every disk after the moves, None if the game is over."""
+    current: int = 0
+    mask: int = 0
+    for col in moves:
+        move: int = (mask + (1 << (col * geometry.column_height))) & geometry.column_mask(col)
+        if not move:
+            raise ValueError(f'column {col + 1} is full')
+        if geometry.is_winning(current | move):
+            return None
+        current, mask = current ^ mask, mask | move
+
+    if mask == geometry.board_mask:
+        return None
+    return current, mask
+
+
+################
+# ADJUDICATION #
+################
+_worker_solver: Solver | None = None
+
+
+def _init_worker(row: int, column: int, connect: int, cache_path: str | None) -> None:
+    global _worker_solver
+    geometry = BitBoard(row, column, connect)
+    _worker_solver = Solver(row, column, connect, cache=SolvedCache(geometry, cache_path))
+
+
+def _solve_chunk(positions: list[tuple[int, int]]) -> tuple[list[tuple[int, int, int]], dict[int, int]]:
+    """Solve positions in a worker, return (score, move, nodes) of each and the newly solved positions."""
+    solver: Solver = _worker_solver
+    results: list[tuple[int, int, int]] = []
+    for current, mask in positions:
+        result: SolveResult = solver.solve(current, mask)
+        results.append((result.score, result.move, result.nodes))
+
+    added: dict[int, int] = solver.cache.added
+    solver.cache.added = {}
+    return results, added
+
+
+def adjudicate(games: list[bytes], row: int = 6, column: int = 7, connect: int = 4, max_empty: int = MAX_EMPTY,
+               cache_path: str = None, workers: int = None) -> tuple[list[dict | None], dict[str, int | float]]:
+    """
+    Solve the last position of the unfinished games.
+    :return: per game None (finished) or its result, and the statistics of the run
+    """
+    geometry = BitBoard(row, column, connect)
+    cache = SolvedCache(geometry, cache_path)
+    cell_count: int = row * column
+    # cached: found in the cache of the earlier runs, duplicates: the position of an earlier game of this run
+    stats: dict[str, int | float] = {
+        'games': len(games), 'finished': 0, 'too_big': 0, 'cached': 0, 'duplicates': 0, 'solved': 0, 'nodes': 0
+    }
+
+    # the positions to solve, identical (or mirrored) positions only once
+    positions: dict[int, tuple[int, int]] = {}
+    game_keys: list[int | None] = []
+    for moves in games:
+        position: tuple[int, int] | None = last_position(geometry, moves)
+        if position is None:
+            stats['finished'] += 1
+            game_keys.append(None)
+            continue
+        if cell_count - position[1].bit_count() > max_empty:
+            stats['too_big'] += 1
+            game_keys.append(None)
+            continue
+
+        key: int = cache.canonical_key(*position)
+        game_keys.append(key)
+        if cache.get(key) is not None:
+            stats['cached'] += 1
+        elif key in positions:
+            stats['duplicates'] += 1
+        else:
+            positions[key] = position
+
+    keys: list[int] = list(positions)
+    start: float = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(row, column, connect, cache_path)) as pool:
+        chunks = [[positions[key] for key in keys[first:first + CHUNK_SIZE]] for first in range(0, len(keys), CHUNK_SIZE)]
+        for first, (results, added) in zip(range(0, len(keys), CHUNK_SIZE), pool.map(_solve_chunk, chunks)):
+            cache.update(added)
+            for key, (score, _, nodes) in zip(keys[first:first + CHUNK_SIZE], results):
+                cache.put(key, score)
+                stats['nodes'] += nodes
+    stats['solved'] = len(positions)
+    stats['seconds'] = time.perf_counter() - start
+
+    if cache_path is not None and cache.added:
+        cache.save(cache_path)
+
+    verdicts: list[dict | None] = []
+    for moves, key in zip(games, game_keys):
+        if key is None:
+            verdicts.append(None)
+            continue
+        played: int = len(moves)
+        result = SolveResult(cache.get(key), -1, played, cell_count, 0, 0.0)
+        # the player to move is 1 after an even count of moves
+        to_move: int = 1 if played % 2 == 0 else 2
+        verdicts.append({
+            'winner': 0 if result.outcome == result.DRAW else to_move if result.outcome == result.WIN else 3 - to_move,
+            'plies_to_end': result.distance
+        })
+    return verdicts, stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    solve_parser = commands.add_parser('solve', help='solve one position given by its moves')
+    solve_parser.add_argument('moves')
+
+    games_parser = commands.add_parser('games', help='adjudicate the unfinished games of a file')
+    games_parser.add_argument('path')
+    games_parser.add_argument('--max-empty', type=int, default=MAX_EMPTY, help='skip positions with more empty cells')
+    games_parser.add_argument('--cache', help='solved position cache file (created if missing)')
+    games_parser.add_argument('--output', help='write the verdicts to this JSONL file')
+    games_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    # a file with the dimensions of its board (archive, binary self-play) gives the defaults
+    for command_parser in (solve_parser, games_parser):
+        command_parser.add_argument('--rows', type=int, help='6 unless the file stores it')
+        command_parser.add_argument('--columns', type=int, help='7 unless the file stores it')
+        command_parser.add_argument('--connect', type=int, help='4 unless the file stores it')
+
+    args = parser.parse_args()
+    flags: tuple[int | None, ...] = (args.rows, args.columns, args.connect)
+
+    if args.command == 'solve':
+        row, column, connect = (flag or default for flag, default in zip(flags, (6, 7, 4)))
+        agent = Agent(row, column, connect=connect)
+        agent.play_moves(args.moves)
+        print(agent.solve())
+
+    elif args.command == 'games':
+        dimensions, games = read_games(args.path)
+        if dimensions is None:
+            dimensions = (6, 7, 4)
+        elif any(flag is not None and flag != size for flag, size in zip(flags, dimensions)):
+            parser.error(f'{args.path} holds games of a {dimensions[0]}x{dimensions[1]} board with lines of {dimensions[2]}')
+        row, column, connect = (flag or default for flag, default in zip(flags, dimensions))
+        verdicts, stats = adjudicate(games, row, column, connect, args.max_empty, args.cache, args.workers)
+
+        if args.output:
+            with open(args.output, 'w') as file:
+                for game, verdict in enumerate(verdicts):
+                    if verdict is not None:
+                        file.write(json.dumps({'game': game, **verdict}) + '\n')
+
+        print(f"{stats['games']} games: {stats['finished']} finished, {stats['too_big']} too big, "
+              f"{stats['cached']} from the cache, {stats['duplicates']} duplicates, "
+              f"{stats['solved']} solved in {stats['seconds']:.1f}s "
+              f"({stats['nodes']} nodes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!usr/bin/python
+"""
+Bulk analysis of Connect Four positions.
+Boards are stacked into one (N, rows, columns) int8 array in the layout of
+Connect4GameBoard.matrix (row 0 is the bottom, 0 is empty, 1 and 2 are the players).
+immediate_wins finds for every board at once the columns where each player completes
+a line on the next turn.
+    python BatchAnalysis.py states.npy --output wins.npy
+"""
+import argparse
+import time
+import numpy as np
+from Connect4BackEnd import Connect4GameBoard
+
+
+#############
+# CONSTANTS #
+#############
+# (row, column) steps of the four directions: vertical, horizontal, diagonal / and diagonal \
+DIRECTIONS: tuple[tuple[int, int], ...] = ((1, 0), (0, 1), (1, 1), (-1, 1))
+
+
+def stack_boards(boards: list[Connect4GameBoard]) -> np.ndarray:
+    """Collect the matrices of game boards into one (N, rows, columns) array."""
+    return np.array([board.matrix for board in boards], dtype=np.int8)
+
+
+def playable_cells(boards: np.ndarray) -> np.ndarray:
+    """The lowest empty cell of every column (where the next disk would land)."""
+    occupied: np.ndarray = boards != 0
+    # the bottom row is supported by the floor
+    supported: np.ndarray = np.ones_like(occupied)
+    supported[:, 1:, :] = occupied[:, :-1, :]
+    return ~occupied & supported
+
+
+def winning_cells(own: np.ndarray, connect: int = 4) -> np.ndarray:
+    """Cells (empty or not) which would complete a line of connect disks together with the own disks."""
+    n, rows, columns = own.shape
+    pad: int = connect - 1
+    padded: np.ndarray = np.zeros((n, rows + 2 * pad, columns + 2 * pad), dtype=bool)
+    padded[:, pad:pad + rows, pad:pad + columns] = own
+
+    def shifted(dr: int, dc: int) -> np.ndarray:
+        """Value of the cell (row + dr, col + dc) for every cell."""
+        return padded[:, pad + dr:pad + dr + rows, pad + dc:pad + dc + columns]
+
+    cells: np.ndarray = np.zeros_like(own, dtype=bool)
+    for dr, dc in DIRECTIONS:
+        # runs[i]: the i nearest cells are own disks at one side of the cell
+        forward_runs: list[np.ndarray] = [np.ones_like(own, dtype=bool)]
+        backward_runs: list[np.ndarray] = [np.ones_like(own, dtype=bool)]
+        for i in range(1, connect):
+            forward_runs.append(forward_runs[-1] & shifted(i * dr, i * dc))
+            backward_runs.append(backward_runs[-1] & shifted(-i * dr, -i * dc))
+
+        # the cell can be at any place of the line
+        for gap in range(connect):
+            cells |= backward_runs[gap] & forward_runs[connect - 1 - gap]
+
+    return cells
+
+
+def immediate_wins(boards: np.ndarray, connect: int = 4, players: tuple[int, int] = (1, 2)) -> np.ndarray:
+    """
+    Columns where the players complete a line if they play first on the next turn.
+    :param boards: (N, rows, columns) array of disks
+    :return: (N, 2, columns) bool array, [:, i, col] is True if players[i] wins by dropping into col
+    """
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+        boards = boards[np.newaxis]
+    if boards.ndim != 3:
+        raise ValueError(f'expected (N, rows, columns) boards, got shape {boards.shape}')
+
+    playable: np.ndarray = playable_cells(boards)
+
+    wins: list[np.ndarray] = []
+    for player in players:
+        cells: np.ndarray = winning_cells(boards == player, connect) & playable
+        # at most one playable cell per column
+        wins.append(cells.any(axis=1))
+
+    return np.stack(wins, axis=1)
+
+
+def to_column_bits(wins: np.ndarray) -> np.ndarray:
+    """Pack the column axis of the immediate_wins result into integers (bit i is column i)."""
+    weights: np.ndarray = np.left_shift(1, np.arange(wins.shape[-1], dtype=np.int64))
+    return (wins * weights).sum(axis=-1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='.npy file of (N, rows, columns) boards')
+    parser.add_argument('--connect', type=int, default=4)
+    parser.add_argument('--output', help='write the (N, 2, columns) result to this .npy file')
+    args = parser.parse_args()
+
+    boards: np.ndarray = np.load(args.path).astype(np.int8, copy=False)
+
+    start: float = time.perf_counter()
+    wins: np.ndarray = immediate_wins(boards, args.connect)
+    elapsed: float = time.perf_counter() - start
+
+    per_player: np.ndarray = wins.any(axis=2).sum(axis=0)
+    print(f'{len(boards)} boards in {elapsed:.3f}s ({len(boards) / max(elapsed, 1e-9):.0f} boards/s)')
+    print(f'player 1 can win on the next turn in {per_player[0]} boards, player 2 in {per_player[1]} boards')
+
+    if args.output:
+        np.save(args.output, wins)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ vertical or diagonal line of 4 tokens wins the game.
 From the description of one game grid, your program must determine in which
 column_count each player may complete a line if they play first on the next turn.
 """
+import sys
 from enum import Enum
 
 
@@ -33,20 +34,141 @@ class FieldMark(Enum):
     PLAYER_2 = 2
 
 
+class BitBoard:
+    """
+    Compact position of a game board: one integer per player, one bit per cell.
+    The bits are stored column by column from the bottom up and every column owns an
+    extra guard bit on its top which is always empty, so lines can not wrap around.
+    """
+
+    def __init__(self, row=6, column=7, connect=4) -> None:
+        # dimensions
+        self.row_count: int = row
+        self.column_count: int = column
+        # length of a winning line
+        self.connect: int = connect
+        # bits of one column (including the guard bit)
+        self.column_height: int = row + 1
+
+        # shifts of the four directions: vertical, horizontal, diagonal / and diagonal \
+        h: int = self.column_height
+        self.directions: tuple[int, ...] = (1, h, h + 1, h - 1)
+
+        # lowest cell of each column and every playable cell
+        self.bottom_mask: int = sum(1 << (c * h) for c in range(column))
+        self.board_mask: int = self.bottom_mask * ((1 << row) - 1)
+
+        self.reset()
+
+    def reset(self) -> None:
+        # disks of the first and the second player
+        self.boards: list[int] = [0, 0]
+        # count of disks in each column (the index of the lowest free row)
+        self.heights: list[int] = [0] * self.column_count
+
+    def load(self, boards: tuple[int, int]) -> None:
+        """Take over the bitboards of the players."""
+        self.boards = list(boards)
+        mask: int = self.mask
+        self.heights = [
+            ((mask & self.column_mask(col)) >> (col * self.column_height)).bit_length()
+            for col in range(self.column_count)
+        ]
+
+    @property
+    def mask(self) -> int:
+        """Every occupied cell."""
+        return self.boards[0] | self.boards[1]
+
+    def bit(self, row: int, col: int) -> int:
+        return 1 << (col * self.column_height + row)
+
+    def set_cell(self, row: int, col: int, index: int) -> None:
+        """Put a disk of the player (0 or 1) into a cell, index -1 clears the cell."""
+        bit: int = self.bit(row, col)
+        self.boards[0] &= ~bit
+        self.boards[1] &= ~bit
+
+        if index >= 0:
+            self.boards[index] |= bit
+            if row >= self.heights[col]:
+                self.heights[col] = row + 1
+        elif row < self.heights[col]:
+            self.heights[col] = row
+
+    def free_row(self, col: int) -> int:
+        """Index of the lowest free row or -1 if the column is full."""
+        height: int = self.heights[col]
+        return height if height < self.row_count else -1
+
+    def column_mask(self, col: int) -> int:
+        """Every playable cell of a column."""
+        return ((1 << self.row_count) - 1) << (col * self.column_height)
+
+    def mirror(self, bits: int) -> int:
+        """Reflect a bitboard (or a key) to the vertical axis of the board."""
+        column_bits: int = (1 << self.column_height) - 1
+        last: int = self.column_count - 1
+        mirrored: int = 0
+        for col in range(self.column_count):
+            mirrored |= ((bits >> (col * self.column_height)) & column_bits) << ((last - col) * self.column_height)
+        return mirrored
+
+    def winning_cells(self, bits: int, mask: int) -> int:
+        """Empty cells which would complete a line for the owner of the bits."""
+        cells: int = 0
+        for shift in self.directions:
+            # runs[i]: there are disks on the i nearest cells at one side of the empty cell
+            left_runs: list[int] = [-1]
+            right_runs: list[int] = [-1]
+            for i in range(1, self.connect):
+                left_runs.append(left_runs[-1] & (bits << (i * shift)))
+                right_runs.append(right_runs[-1] & (bits >> (i * shift)))
+
+            # the empty cell can be at any place of the line
+            for gap in range(self.connect):
+                cells |= left_runs[gap] & right_runs[self.connect - 1 - gap]
+        return cells & (self.board_mask ^ mask)
+
+    def is_winning(self, bits: int) -> bool:
+        """Shift and mask: does the bitboard contain a line in any direction (O(log connect) shifts)."""
+        for shift in self.directions:
+            # a bit of runs is set if the next length cells (in this direction) are all set
+            runs: int = bits
+            length: int = 1
+            while 2 * length <= self.connect:
+                runs &= runs >> (length * shift)
+                length *= 2
+            # two overlapping runs cover the rest
+            if length < self.connect:
+                runs &= runs >> ((self.connect - length) * shift)
+            if runs:
+                return True
+        return False
+
+
 class Connect4GameBoard:
     # CONSTANTS
     EMPTY_FIELD = 0
     PLAYER_ONE = 1
     PLAYER_TWO = 2
 
-    def __init__(self, row=6, column=7) -> None:
+    def __init__(self, row=6, column=7, connect=4) -> None:
         # dimensions
         self.row_count: int = row
         self.column_count: int = column
+        # length of a winning line
+        self.connect: int = connect
 
         self.disks_played: int = 0
         self.disks_limit: int = row * column
 
+        # fast representation of the board (kept in sync with the matrix)
+        self.bitboard: BitBoard = BitBoard(row, column, connect)
+
+        # undo stack of the dropped disks (row, col)
+        self.history: list[tuple[int, int]] = []
+
         # this is the structure of the game board
         self._init_matrix()
 
@@ -55,84 +177,102 @@ class Connect4GameBoard:
 
     def reset(self) -> None:
         self._init_matrix()
+        self.bitboard.reset()
+        self.history.clear()
+        self.disks_played = 0
+
+    def player_index(self, disk) -> int:
+        """Map a disk to its bitboard (0 or 1), -1 stands for the empty field."""
+        if disk == self.EMPTY_FIELD:
+            return -1
+        return 0 if disk == self.PLAYER_ONE else 1
 
     def place_disk(self, col: int, row: int, disk: int) -> None:
+        # keep track of the played disks
+        if self.matrix[row][col] == self.EMPTY_FIELD:
+            if disk != self.EMPTY_FIELD:
+                self.disks_played += 1
+        elif disk == self.EMPTY_FIELD:
+            self.disks_played -= 1
+
         self.matrix[row][col] = disk
+        self.bitboard.set_cell(row, col, self.player_index(disk))
 
     def search_row(self, col: int) -> int:
         """
         Find the index of the lowest free row (if there is one).
         :param col: index of the column
         :type col: int
-        :return: the index of the first free row or None
+        :return: the index of the first free row or -1
         """
 
         # now the user can give float like this (2.0)
         col = int(col)
 
-        for i, row in enumerate(self.matrix):
-            if row[col] == self.EMPTY_FIELD:
-                return i
-        else:
-            return -1
+        return self.bitboard.free_row(col)
+
+    def load_position(self, boards: tuple[int, int], history: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """Show a position given by the bitboards of the players and the moves leading to it, return the changed cells."""
+        old_first, old_second = self.bitboard.boards
+        first, second = boards
+        # only the cells which differ from the shown position are written
+        changed: int = (old_first ^ first) | (old_second ^ second)
+        self.bitboard.load(boards)
+
+        height: int = self.bitboard.column_height
+        cells: list[tuple[int, int]] = []
+        while changed:
+            bit: int = changed & -changed
+            changed ^= bit
+            col, row = divmod(bit.bit_length() - 1, height)
+            if first & bit:
+                self.matrix[row][col] = self.PLAYER_ONE
+            elif second & bit:
+                self.matrix[row][col] = self.PLAYER_TWO
+            else:
+                self.matrix[row][col] = self.EMPTY_FIELD
+            cells.append((row, col))
+
+        self.history = history
+        self.disks_played = len(history)
+        return cells
+
+    def push(self, col: int, disk: int) -> int:
+        """Drop a disk into a column and remember the move, return the row or -1 if the column is full."""
+        row: int = self.search_row(col)
+        if row != -1:
+            self.place_disk(col, row, disk)
+            self.history.append((row, col))
+        return row
+
+    def pop(self) -> tuple[int, int]:
+        """Take back the last dropped disk and return its row and column."""
+        row, col = self.history.pop()
+        self.place_disk(col, row, self.EMPTY_FIELD)
+        return row, col
+
+    def winning_columns(self, player) -> list[int]:
+        """Columns where the player would complete a line by dropping the next disk."""
+        bitboard: BitBoard = self.bitboard
+        mask: int = bitboard.mask
+        cells: int = bitboard.winning_cells(bitboard.boards[self.player_index(player)], mask)
+        # only the lowest free cell of a column can be played
+        cells &= mask + bitboard.bottom_mask
+        return [col for col in range(self.column_count) if cells & bitboard.column_mask(col)]
 
     def check_for_winning(self, row: int, col: int, player) -> bool:  # this is zero-based
-        """Calculate the minimal free space around a disk/coordination and check winning."""
-        border_x: int = self.column_count - 1
-        border_y: int = self.row_count - 1
-
-        # horizontal
-        sub_x = min(3, col)
-        add_x = min(3, border_x - col)
-        # vertical
-        sub_y = min(3, row)
-        add_y = min(3, border_y - row)
-
-        def check_direction(start_x: int, end_x: int, start_y: int, end_y: int, dx: int, dy: int) -> bool:
-            """attention end_x: last index of x (range + 1) end_y: last index of y (range + 1)"""
-
-            # pointers
-            x: int = start_x
-            y: int = start_y
-            # count consecutive disks
-            matches: int = 0
-
-            while x <= end_x and y <= end_y:
-                if self.matrix[y][x] == player:
-                    matches += 1
-                    if matches == 4:
-                        return True
-                elif matches > 0:
-                    matches = 0
-
-                # increment pointers
-                x += dx
-                y += dy
-
+        """Check whether the player has a line of connect disks (after dropping a disk to row, col)."""
+        index: int = self.player_index(player)
+        if index < 0:
             return False
 
-        # horizontal
-        horizontal: bool = check_direction(col - sub_x, col + add_x, row, row, 1, 0)
-        # vertical
-        vertical: bool = check_direction(col, col, row - sub_y, row + add_y, 0, 1)
-        # diagonals go from left to right
-        # diagonal /
-        lb: int = min(sub_x, sub_y)
-        rt: int = min(add_x, add_y)
-        diagonal_lb_rt: bool = check_direction(col - lb, col + rt, row - lb, col + rt, 1, 1)
-        # diagonal \
-        lt: int = min(sub_x, add_y)
-        rb: int = min(add_x, sub_y)
-        # end_y is border_y + 1 because y is decreasing. This won't cause any error since  x and y are synchronized.
-        diagonal_lt_rb: bool = check_direction(col - lt, col + rb, row + lt, border_y + 1, 1, -1)
-
-        return max(horizontal, vertical, diagonal_lb_rt, diagonal_lt_rb)
+        return self.bitboard.is_winning(self.bitboard.boards[index])
 
 
 class Connect4Game(Connect4GameBoard):
 
-    def __init__(self, player1=None, player2=None):
-        super(Connect4Game, self).__init__()
+    def __init__(self, player1=None, player2=None, row=6, column=7, connect=4):
+        super(Connect4Game, self).__init__(row, column, connect)
         if player1 is not None:
             self.PLAYER_ONE = player1
         if player2 is not None:
@@ -140,10 +280,10 @@ class Connect4Game(Connect4GameBoard):
 
     def print_matrix(self) -> None:
         """Just the print the matrix human readable."""
-        print('#' * 13)
+        print('#' * (2 * self.column_count - 1))
         for sor in self.matrix[::-1]:
             print(' '.join(map(str, sor)))
-        print('#' * 13)
+        print('#' * (2 * self.column_count - 1))
 
     def play_game(self):
         print('The game has begun!!!')
@@ -153,7 +293,7 @@ class Connect4Game(Connect4GameBoard):
         for actual_player in player_switcher(self.PLAYER_ONE, self.PLAYER_TWO):
 
             # the game board is full
-            if self.disks_played > self.disks_limit:
+            if self.disks_played >= self.disks_limit:
                 result_of_the_game = 'draw'
                 break
 
@@ -161,18 +301,14 @@ class Connect4Game(Connect4GameBoard):
             self.print_matrix()
             print('It is the turn of player -', actual_player)
 
-            # get a valid column
-            column: int = int(input('pleas enter the number: ')) - 1
-            # get the row
-            for i, row in enumerate(self.matrix):
-                if row[column] == self.EMPTY_FIELD:
-                    row = i
+            # get a valid column (which is not full)
+            while True:
+                column: int = force_within_range(1, self.column_count, 'pleas enter the number: ') - 1
+                # place/drop a disk from the actual player
+                row: int = self.push(column, actual_player)
+                if row != -1:
                     break
-            else:
-                row = 0
-
-            # place/drop a disk from the actual player
-            self.matrix[row][column] = actual_player
+                print('This column is full...try again!')
 
             # check winning
             if self.check_for_winning(row, column, actual_player):
@@ -182,9 +318,31 @@ class Connect4Game(Connect4GameBoard):
         self.print_matrix()
         print('the result is:', result_of_the_game)
 
+    def replay(self, record) -> None:
+        """Step through a recorded game (see GameRecord) with n(ext), p(revious), a ply number or q(uit)."""
+        self.reset()
+        ply: int = 0
+        while True:
+            record.load_into(self, ply)
+            self.print_matrix()
+            print(f'ply {ply}/{len(record)}')
+
+            command: str = input('n/p/<ply>/q: ').strip()
+            if command == 'q':
+                break
+            elif command == 'p':
+                ply = max(0, ply - 1)
+            elif command.isdigit():
+                ply = min(int(command), len(record))
+            else:
+                ply = min(ply + 1, len(record))
+
 
 def main():
-    game = Connect4Game()
+    # optional rows, columns and length of the line e.g. python Connect4BackEnd.py 9 10 5
+    dimensions: list[int] = [int(arg) for arg in sys.argv[1:4]]
+    row, column, connect = dimensions + [6, 7, 4][len(dimensions):]
+    game = Connect4Game(row=row, column=column, connect=connect)
     game.play_game()
 
 
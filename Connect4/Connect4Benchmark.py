@@ -0,0 +1,289 @@
+#!usr/bin/python
+"""
+Benchmarks of the Connect Four engine.
+The backend command checks the win detection against a brute force oracle on random
+positions and times the board operations; with a baseline file it fails (exit code 1)
+on wrong results or on operations which became slower than the tolerance.
+    python Connect4Benchmark.py backend --json backend.json --baseline backend.json
+    python Connect4Benchmark.py parallel --depth 9 --workers 1 2 4 --json parallel.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from Connect4BackEnd import Connect4GameBoard
+from ConnectAI import Agent, ParallelAgent
+
+try:
+    import numpy as np
+    from BatchAnalysis import immediate_wins
+except ImportError:
+    # the batch analysis is checked only if numpy is installed
+    np = None
+
+
+# opening positions (1-based columns) searched by the benchmarks
+POSITIONS: list[str] = ['', '4', '44', '4453', '443322', '4455']
+
+# rows, columns, length of a line of the correctness checks
+BOARD_SIZES: list[tuple[int, int, int]] = [(6, 7, 4), (4, 4, 3), (5, 9, 4), (9, 10, 5), (15, 15, 5), (7, 7, 7)]
+
+# a benchmark may be this much slower than the baseline
+TOLERANCE: float = 0.25
+
+
+###########
+# BACKEND #
+###########
+def brute_force_win(matrix: list[list], player, connect: int) -> bool:
+    """Oracle: try every line of every cell."""
+    rows: int = len(matrix)
+    columns: int = len(matrix[0])
+    for row in range(rows):
+        for col in range(columns):
+            for dy, dx in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                end_y: int = row + (connect - 1) * dy
+                end_x: int = col + (connect - 1) * dx
+                if not (0 <= end_y < rows and end_x < columns):
+                    continue
+                if all(matrix[row + i * dy][col + i * dx] == player for i in range(connect)):
+                    return True
+    return False
+
+
+def random_boards(rng: random.Random, count: int, row: int, column: int, connect: int) -> list[Connect4GameBoard]:
+    """Random unfinished positions (the random games stop before any line is completed)."""
+    boards: list[Connect4GameBoard] = []
+    for _ in range(count):
+        board = Connect4GameBoard(row, column, connect)
+        length: int = rng.randint(0, row * column - 1)
+        player: int = board.PLAYER_ONE
+        while board.disks_played < length:
+            col: int = rng.choice([c for c in range(column) if board.search_row(c) != -1])
+            row_index: int = board.push(col, player)
+            if board.check_for_winning(row_index, col, player):
+                board.pop()
+                break
+            player = board.PLAYER_TWO if player == board.PLAYER_ONE else board.PLAYER_ONE
+        boards.append(board)
+    return boards
+
+
+def check_backend(games: int, seed: int) -> list[str]:
+    """Compare the board operations with the oracle, return the description of the failures."""
+    rng = random.Random(seed)
+    failures: list[str] = []
+
+    for row, column, connect in BOARD_SIZES:
+        size: str = f'{row}x{column} connect {connect}'
+        boards: list[Connect4GameBoard] = random_boards(rng, games, row, column, connect)
+
+        for board in boards:
+            for player in (board.PLAYER_ONE, board.PLAYER_TWO):
+                expected_columns: list[int] = []
+                for col in range(column):
+                    # the lowest free row agrees with the matrix
+                    free_row: int = next((r for r in range(row) if board.matrix[r][col] == board.EMPTY_FIELD), -1)
+                    if board.search_row(col) != free_row:
+                        failures.append(f'{size}: search_row({col}) {board.search_row(col)} != {free_row}')
+                    if free_row == -1:
+                        continue
+
+                    # every possible next move against the oracle
+                    board.push(col, player)
+                    expected: bool = brute_force_win(board.matrix, player, connect)
+                    if board.check_for_winning(free_row, col, player) != expected:
+                        failures.append(f'{size}: check_for_winning {board.history} expected {expected}')
+                    if expected:
+                        expected_columns.append(col)
+                    board.pop()
+
+                if board.winning_columns(player) != expected_columns:
+                    failures.append(f'{size}: winning_columns {board.history} expected {expected_columns}')
+
+            if len(failures) > 20:
+                return failures
+
+        # the batch analysis of the same boards
+        if np is not None:
+            wins = immediate_wins(np.array([board.matrix for board in boards], dtype=np.int8), connect)
+            for board, board_wins in zip(boards, wins):
+                for index, player in enumerate((board.PLAYER_ONE, board.PLAYER_TWO)):
+                    if list(np.flatnonzero(board_wins[index])) != board.winning_columns(player):
+                        failures.append(f'{size}: immediate_wins {board.history} player {player}')
+
+    return failures
+
+
+def time_per_call(function, calls: list[tuple], repeat: int = 5) -> float:
+    """Best of the repeats: nanoseconds of one call."""
+    best: float = float('inf')
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        for args in calls:
+            function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best / len(calls) * 1e9
+
+
+def bench_backend(seed: int, positions: int = 200) -> dict[str, float]:
+    """Nanoseconds per call of the board operations on random 6x7 positions."""
+    rng = random.Random(seed)
+    boards: list[Connect4GameBoard] = random_boards(rng, positions, 6, 7, 4)
+
+    search_row_calls: list[tuple] = []
+    win_calls: list[tuple] = []
+    place_calls: list[tuple] = []
+    push_calls: list[tuple] = []
+    for board in boards:
+        for col in range(board.column_count):
+            search_row_calls.append((board, col))
+            row: int = board.search_row(col)
+            if row != -1:
+                # the cell is filled then emptied again
+                place_calls.append((board, col, row))
+                push_calls.append((board, col))
+        if board.history:
+            row, col = board.history[-1]
+            win_calls.append((board, row, col, board.matrix[row][col]))
+
+    def place_and_clear(board: Connect4GameBoard, col: int, row: int) -> None:
+        board.place_disk(col, row, board.PLAYER_ONE)
+        board.place_disk(col, row, board.EMPTY_FIELD)
+
+    def push_and_pop(board: Connect4GameBoard, col: int) -> None:
+        board.push(col, board.PLAYER_ONE)
+        board.pop()
+
+    results: dict[str, float] = {
+        'search_row': time_per_call(lambda board, col: board.search_row(col), search_row_calls),
+        'check_for_winning': time_per_call(
+            lambda board, row, col, player: board.check_for_winning(row, col, player), win_calls
+        ),
+        'place_disk': time_per_call(place_and_clear, place_calls) / 2,
+        'push_pop': time_per_call(push_and_pop, push_calls),
+        'winning_columns': time_per_call(lambda board: board.winning_columns(board.PLAYER_ONE), [(b,) for b in boards]),
+    }
+
+    if np is not None:
+        stack = np.array([board.matrix for board in boards] * 50, dtype=np.int8)
+        results['immediate_wins_per_board'] = time_per_call(immediate_wins, [(stack,)], repeat=3) / len(stack)
+
+    return results
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], tolerance: float) -> list[str]:
+    """Benchmarks which became slower than the baseline allows."""
+    return [
+        f'{name}: {value:.0f}ns > {baseline[name]:.0f}ns * {1 + tolerance:.2f}'
+        for name, value in results.items()
+        if name in baseline and value > baseline[name] * (1 + tolerance)
+    ]
+
+
+def timed_search(agent: Agent, moves: str) -> tuple[float, int, int]:
+    """Search a position from scratch, return the elapsed time, the nodes and the best move."""
+    agent.reset()
+    agent.play_moves(moves)
+    start: float = time.perf_counter()
+    result = agent.search()
+    return time.perf_counter() - start, result.nodes, result.move
+
+
+def bench_parallel(depth: int, worker_counts: list[int]) -> list[dict]:
+    """
+    Fixed depth search of the positions with a sequential agent and with process pools.
+    Every position is searched with empty transposition tables on both sides.
+    """
+    rows: list[dict] = []
+
+    sequential = Agent(time_limit=None, max_depth=depth)
+    elapsed: float = 0.0
+    nodes: int = 0
+    for moves in POSITIONS:
+        sequential.clear_tables()
+        t, n, _ = timed_search(sequential, moves)
+        elapsed += t
+        nodes += n
+    rows.append({'mode': 'sequential', 'workers': 1, 'seconds': elapsed, 'nodes': nodes, 'speedup': 1.0})
+    baseline: float = elapsed
+
+    for workers in worker_counts:
+        with ParallelAgent(time_limit=None, max_depth=depth, workers=workers) as agent:
+            # start the processes before the clock runs
+            agent.search(max_depth=1)
+
+            elapsed = 0.0
+            nodes = 0
+            for moves in POSITIONS:
+                agent.clear_tables()
+                t, n, _ = timed_search(agent, moves)
+                elapsed += t
+                nodes += n
+        rows.append({'mode': 'root split', 'workers': workers, 'seconds': elapsed, 'nodes': nodes,
+                     'speedup': baseline / elapsed})
+
+    return rows
+
+
+def print_rows(rows: list[dict]) -> None:
+    for row in rows:
+        print(f"{row['mode']:>12} workers {row['workers']:>3} time {row['seconds']:8.3f}s "
+              f"nodes {row['nodes']:>10} nps {row['nodes'] / row['seconds']:10.0f} speedup {row['speedup']:5.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backend = commands.add_parser('backend', help='correctness and speed of the board operations')
+    backend.add_argument('--games', type=int, default=300, help='random positions of each board size')
+    backend.add_argument('--seed', type=int, default=0)
+    backend.add_argument('--json', help='write the results to this file')
+    backend.add_argument('--baseline', help='results of an earlier run (JSON)')
+    backend.add_argument('--tolerance', type=float, default=TOLERANCE)
+
+    parallel = commands.add_parser('parallel', help='speedup of the root splitting search')
+    parallel.add_argument('--depth', type=int, default=9)
+    parallel.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parallel.add_argument('--json', help='write the results to this file')
+
+    args = parser.parse_args()
+
+    if args.command == 'backend':
+        failures: list[str] = check_backend(args.games, args.seed)
+        for failure in failures:
+            print('FAIL', failure)
+        print(f'correctness: {len(failures)} failures')
+
+        results: dict[str, float] = bench_backend(args.seed)
+        for name, value in results.items():
+            print(f'{name:>25} {value:10.0f} ns')
+
+        # read the baseline before the results may overwrite it
+        regressions: list[str] = []
+        if args.baseline:
+            with open(args.baseline) as file:
+                regressions = compare(results, json.load(file)['benchmarks'], args.tolerance)
+            for regression in regressions:
+                print('SLOWER', regression)
+
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump({'failures': failures, 'regressions': regressions, 'benchmarks': results}, file, indent=2)
+
+        if failures or regressions:
+            sys.exit(1)
+
+    elif args.command == 'parallel':
+        rows: list[dict] = bench_parallel(args.depth, args.workers)
+        print_rows(rows)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(rows, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,10 +10,13 @@
 # IMPORTS #
 ###########
 import sys
+import argparse
 import pygame
 from pygame import Rect, Surface, Color
 from pygame.font import Font
 from Connect4BackEnd import Connect4GameBoard, player_switcher
+from ConnectAI import Agent
+from GameRecord import GameRecord, load_record
 
 
 #############
@@ -26,17 +29,20 @@ BLUE = Color(0, 0, 150)
 YELLOW = Color(150, 150, 0)
 GREEN = Color(0, 150, 0)
 
-# dimensions of the board
+# dimensions of the board (defaults)
 ROW = 6
 COLUMN = 7
+CONNECT = 4
+
+# frame limit of the main loop
+FPS = 60
 
 # dimensions of the tiles
 TILE_SIZE = 100
 TILE_PAD = 12
 
-# dimensions of the screen
-SCREEN_WIDTH = COLUMN * TILE_SIZE
-SCREEN_HEIGHT = ROW * TILE_SIZE
+# big boards get smaller tiles (the screen is the tiles of the board)
+MAX_SCREEN_SIZE = 900
 
 
 #######################
@@ -66,19 +72,61 @@ class GameBoardUI(Connect4GameBoard):
         2: TILE_YELLOW
     }
 
-    def __init__(self, surface_rect: Rect, dimensions: tuple[int, int], tile_size: int) -> None:
+    def __init__(self, surface_rect: Rect, dimensions: tuple[int, int], tile_size: int, connect: int = CONNECT) -> None:
 
         # init the inherited part of the class
-        super(GameBoardUI, self).__init__(*dimensions)
+        super(GameBoardUI, self).__init__(*dimensions, connect)
+
+        # scaled tiles for the smaller tile size
+        if tile_size != TILE_SIZE:
+            self.TILEMAP = {
+                tile_id: pygame.transform.smoothscale(tile, (tile_size, tile_size))
+                for tile_id, tile in self.TILEMAP.items()
+            }
 
         self.image: Surface = pygame.Surface((surface_rect.width, surface_rect.height))
         self.rect: Rect = surface_rect
 
         self.tile_size: int = tile_size
 
+        # (row, col) of the tiles changed since the last drawing
+        self.dirty_tiles: set[tuple[int, int]] = set()
+        self.mark_all_dirty()
+
+    def mark_all_dirty(self) -> None:
+        self.dirty_tiles.update((row, col) for row in range(self.row_count) for col in range(self.column_count))
+
+    def reset(self) -> None:
+        super(GameBoardUI, self).reset()
+        self.mark_all_dirty()
+
+    def place_disk(self, col: int, row: int, disk: int) -> None:
+        super(GameBoardUI, self).place_disk(col, row, disk)
+        self.dirty_tiles.add((row, col))
+
+    def load_position(self, boards: tuple[int, int], history: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        cells: list[tuple[int, int]] = super(GameBoardUI, self).load_position(boards, history)
+        self.dirty_tiles.update(cells)
+        return cells
+
+    def tile_pos(self, row: int, col: int) -> tuple[int, int]:
+        """Position of a tile on the local image surface (row 0 is the bottom)."""
+        return col * self.tile_size, self.rect.height - (row + 1) * self.tile_size
+
     def draw(self, surface: pygame.Surface) -> None:
         surface.blit(self.image, self.rect)
 
+    def draw_dirty_tiles(self, surface: pygame.Surface) -> list[Rect]:
+        """Draw only the changed tiles to the local image and to the surface, return the updated rects."""
+        rects: list[Rect] = []
+        for row, col in self.dirty_tiles:
+            tile: Surface = self.TILEMAP[self.matrix[row][col]]
+            pos: tuple[int, int] = self.tile_pos(row, col)
+            self.image.blit(tile, pos)
+            rects.append(surface.blit(tile, (self.rect.x + pos[0], self.rect.y + pos[1])))
+        self.dirty_tiles.clear()
+        return rects
+
     def draw_all_tiles(self) -> None:
         """Draw all tiles to local image surface."""
         y: int = self.rect.bottom - self.tile_size
@@ -103,16 +151,23 @@ class GameOver:
         self.image: Surface = self.my_font.render('Default Text', True, self.default_color)
         # location of the text
         self.rect: Rect = self.image.get_rect(topleft=pos)
+        # location of the text on the screen (the area to update after a change)
+        self.drawn_rect: Rect = self.rect.copy()
 
     def set_text(self, text: str, color=None):
         # optional parameter
         if color is None:
             color = self.default_color
-        # re-render text to image surface
+        # re-render text to image surface (the size depends on the text)
         self.image = self.my_font.render(text, True, color)
+        self.rect = self.image.get_rect(topleft=self.rect.topleft)
 
-    def draw(self, surface: pygame.Surface):
+    def draw(self, surface: pygame.Surface) -> Rect:
+        """Blit the text, return the area to update (the earlier text too)."""
         surface.blit(self.image, self.rect)
+        dirty_rect: Rect = self.rect.union(self.drawn_rect)
+        self.drawn_rect = self.rect.copy()
+        return dirty_rect
 
 
 #############################
@@ -120,92 +175,161 @@ class GameOver:
 #############################
 class MainWindow:
 
-    def __init__(self):
+    def __init__(
+            self,
+            ai_player: int = None,
+            ai_time_limit: float = 1.0,
+            rows: int = ROW,
+            columns: int = COLUMN,
+            connect: int = CONNECT,
+            record: GameRecord = None
+    ):
         # init pygame
         pygame.init()
 
+        # replay of a recorded game (stepped by the arrow keys)
+        self.record: GameRecord = record
+        self.replay_ply: int = 0
+        if record is not None:
+            rows, columns, connect = record.row_count, record.column_count, record.connect
+
+        # dimensions of the tiles and the screen
+        self.tile_size: int = min(TILE_SIZE, MAX_SCREEN_SIZE // max(rows, columns))
+        screen_width: int = columns * self.tile_size
+        screen_height: int = rows * self.tile_size
+
         # for switching between two players
         self.actual_p = player_switcher(1, 2)
+        self.player: int = next(self.actual_p)
+
+        # optional computer opponent (it follows the game move by move)
+        self.ai_player: int = ai_player
+        self.agent: Agent = Agent(rows, columns, first=ai_player == 1, time_limit=ai_time_limit, connect=connect) if ai_player else None
 
         # init game over text
         # hardcoded
-        self.game_over_screen = GameOver((TILE_SIZE + TILE_SIZE // 5, TILE_SIZE), GREEN, 80)
+        self.game_over_screen = GameOver((self.tile_size + self.tile_size // 5, self.tile_size), GREEN, 80)
 
         # init display screen
         pygame.display.set_caption('Four in a row :)')
         flags: int = 0
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), flags)
+        self.screen = pygame.display.set_mode((screen_width, screen_height), flags)
 
         # "static" part of the game
-        self.game_board = GameBoardUI(Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT), (6, 7), TILE_SIZE)
+        self.game_board = GameBoardUI(
+            Rect(0, 0, screen_width, screen_height), (rows, columns), self.tile_size, connect
+        )
 
     def game_over(self, winner_player):
         self.game_over_screen.set_text(f"Player {winner_player} has won!")
 
+    def reset(self) -> None:
+        self.game_board.reset()
+        self.actual_p = player_switcher(1, 2)
+        self.player = next(self.actual_p)
+        if self.agent is not None:
+            self.agent.reset()
+
+    def play(self, column: int) -> tuple[bool, bool]:
+        """Drop a disk of the actual player, return if the move was valid and if it has won."""
+        free_row: int = self.game_board.push(column, self.player)
+
+        # the column is full (the move is invalid)
+        if free_row == -1:
+            return False, False
+
+        # keep the agent up to date
+        if self.agent is not None:
+            self.agent.update_boards(free_row, column)
+
+        # check if it was a winning move
+        win: bool = self.game_board.check_for_winning(free_row, column, self.player)
+        if win:
+            self.game_over(self.player)
+
+        # switch player
+        self.player = next(self.actual_p)
+        return True, win
+
+    def step_replay(self, key: int) -> None:
+        """Move in the recorded game: left/right one ply, page up/down 10 plies, home/end."""
+        steps: dict[int, int] = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1, pygame.K_PAGEDOWN: -10, pygame.K_PAGEUP: 10}
+        if key == pygame.K_HOME:
+            ply: int = 0
+        elif key == pygame.K_END:
+            ply = len(self.record)
+        elif key in steps:
+            ply = min(max(self.replay_ply + steps[key], 0), len(self.record))
+        else:
+            return
+
+        self.replay_ply = ply
+        self.record.load_into(self.game_board, ply)
+        pygame.display.set_caption(f'Four in a row :) - replay {ply}/{len(self.record)}')
+
+    def computer_to_move(self, game_over: bool) -> bool:
+        """The computer moves after the last move of the human is on the screen."""
+        return (not game_over and self.player == self.ai_player and not self.game_board.dirty_tiles
+                and self.game_board.disks_played < self.game_board.disks_limit)
+
     def main_loop(self):
         done: bool = False
         game_over: bool = False
-        do_render: bool = True
+        # limits the frame rate
+        clock = pygame.time.Clock()
         while not done:
-            # clear event queue
-            for event in pygame.event.get():
+            # sleep until an event arrives (the computer moves without input)
+            if self.computer_to_move(game_over) or self.game_board.dirty_tiles:
+                events: list = pygame.event.get()
+            else:
+                events = [pygame.event.wait()] + pygame.event.get()
+
+            for event in events:
                 # exit by pressing the red button
                 if event.type == pygame.QUIT:
                     done = True
+                # the window has to be drawn again
+                elif event.type == pygame.VIDEOEXPOSE:
+                    self.game_board.mark_all_dirty()
                 # exit by pressing escape key
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
                         done = True
-                    if event.key == pygame.K_r:
-                        self.game_board.reset()
-                        do_render = True
+                    if self.record is not None:
+                        self.step_replay(event.key)
+                    elif event.key == pygame.K_r:
+                        self.reset()
                         game_over = False
 
-                elif not game_over and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                elif (not game_over and self.record is None
+                      and event.type == pygame.MOUSEBUTTONDOWN and event.button == 1):
+                    # it is the turn of the computer
+                    if self.player == self.ai_player:
+                        continue
+
                     # get the x value of the cursor
                     mouse_pos_x = event.pos[0]
                     # determine which column the cursor is in
-                    column = mouse_pos_x // TILE_SIZE
-
-                    # find the first free slot/row
-                    free_row = self.game_board.search_row(column)
-
-                    # there is a free row (the move is valid)
-                    if free_row != -1:
-                        # turn on render for this frame
-                        do_render = True
-
-                        # switch player
-                        player = next(self.actual_p)
-
-                        # place the disk
-                        self.game_board.matrix[free_row][column] = player
-
-                        # check if it was a winning move
-                        win = self.game_board.check_for_winning(free_row, column, player)
+                    column = mouse_pos_x // self.tile_size
 
-                        # if it was "execute" game over process
-                        if win:
-                            self.game_over(player)
-                            game_over = True
+                    # drop the disk to the first free slot/row
+                    valid, game_over = self.play(column)
 
-            # clear the screen with rgb black
-            self.screen.fill((0, 0, 0))
+            if self.computer_to_move(game_over):
+                valid, game_over = self.play(self.agent.best_move())
 
-            # redraw the game board
-            self.game_board.draw_all_tiles()
+            # blit only the changed tiles
+            dirty_rects: list[Rect] = self.game_board.draw_dirty_tiles(self.screen)
 
-            # blit to display
-            self.game_board.draw(self.screen)
+            # the game over text stays above the tiles
+            if game_over and dirty_rects:
+                dirty_rects.append(self.game_over_screen.draw(self.screen))
 
-            # blit game over text
-            if game_over:
-                self.game_over_screen.draw(self.screen)
+            # update the changed part of the screen
+            if dirty_rects:
+                pygame.display.update(dirty_rects)
 
-            # update the whole screen
-            if do_render:
-                do_render = False
-                pygame.display.update()
+            clock.tick(FPS)
 
         pygame.quit()
 
@@ -214,7 +338,20 @@ class MainWindow:
 # MAIN #
 ########
 def main() -> None:
-    game = MainWindow()
+    parser = argparse.ArgumentParser(description='Four in a row')
+    # the computer can be the opponent e.g. python Connect4FrontEnd.py --ai 2
+    parser.add_argument('--ai', type=int, choices=(1, 2), help='the player of the computer')
+    parser.add_argument('--ai-time', type=float, default=1.0, help='thinking time of the computer (seconds)')
+    parser.add_argument('--rows', type=int, default=ROW)
+    parser.add_argument('--columns', type=int, default=COLUMN)
+    parser.add_argument('--connect', type=int, default=CONNECT, help='length of a winning line')
+    # step through a recorded game with the arrow keys
+    parser.add_argument('--replay', help='game record or archive file')
+    parser.add_argument('--game', type=int, default=0, help='index of the game in the archive')
+    args = parser.parse_args()
+
+    record: GameRecord = load_record(args.replay, args.game) if args.replay else None
+    game = MainWindow(args.ai, args.ai_time, args.rows, args.columns, args.connect, record)
     game.main_loop()
     sys.exit()
 
@@ -0,0 +1,288 @@
+#!usr/bin/python
+"""
+Connect Four server for many concurrent games against the engine.
+Every connection plays one game at a time with a line protocol (columns are 1-based):
+    NEW [1|2]   start a game, the client is player 1 (default) or 2   -> OK (then MOVE c if the engine starts)
+    PLAY c      drop a disk of the client                             -> MOVE c [WIN|DRAW] | WIN | DRAW | ERR reason
+    QUIT        close the connection                                  -> BYE
+The engine searches on a process pool, so the event loop never blocks.
+    python Connect4Server.py serve --port 4444
+    python Connect4Server.py serve --unix /tmp/connect4.sock
+    python Connect4Server.py load --port 4444 --games 2000 --concurrency 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Connect4BackEnd import Connect4GameBoard
+from ConnectAI import search_position
+
+
+#############
+# CONSTANTS #
+#############
+HOST: str = '127.0.0.1'
+PORT: int = 4444
+
+# thinking time of the engine (seconds)
+SEARCH_TIME: float = 0.05
+
+
+class GameSession:
+    """One game of a connection: the board and the player of the client."""
+
+    def __init__(self, row: int, column: int, connect: int, client_player: int) -> None:
+        self.board: Connect4GameBoard = Connect4GameBoard(row, column, connect)
+        self.client_player: int = client_player
+        self.engine_player: int = self.board.PLAYER_TWO if client_player == self.board.PLAYER_ONE else self.board.PLAYER_ONE
+        self.over: bool = False
+
+    @property
+    def player_to_move(self) -> int:
+        return self.board.PLAYER_ONE if self.board.disks_played % 2 == 0 else self.board.PLAYER_TWO
+
+    def play(self, col: int) -> str | None:
+        """Drop a disk of the player to move, return WIN, DRAW or None if the game goes on."""
+        player: int = self.player_to_move
+        row: int = self.board.push(col, player)
+        if self.board.check_for_winning(row, col, player):
+            self.over = True
+            return 'WIN'
+        if self.board.disks_played == self.board.disks_limit:
+            self.over = True
+            return 'DRAW'
+        return None
+
+    def position(self) -> tuple[int, int]:
+        """Disks of the player to move and every disk."""
+        bitboard = self.board.bitboard
+        return bitboard.boards[self.board.player_index(self.player_to_move)], bitboard.mask
+
+
+class Connect4Server:
+
+    def __init__(self, row: int = 6, column: int = 7, connect: int = 4,
+                 search_time: float = SEARCH_TIME, workers: int = None) -> None:
+        self.row: int = row
+        self.column: int = column
+        self.connect: int = connect
+        self.search_time: float = search_time
+
+        # the searches run here instead of the event loop
+        self.pool: ProcessPoolExecutor = ProcessPoolExecutor(workers or os.cpu_count() or 1)
+
+        # statistics
+        self.sessions: int = 0
+        self.searches: int = 0
+
+    async def engine_move(self, session: GameSession) -> str:
+        """Let the engine move, return the reply line."""
+        loop = asyncio.get_running_loop()
+        current, mask = session.position()
+        result = await loop.run_in_executor(
+            self.pool, search_position, current, mask, self.row, self.column, self.connect, self.search_time
+        )
+        self.searches += 1
+
+        outcome: str | None = session.play(result.move)
+        return f'MOVE {result.move + 1}' + (f' {outcome}' if outcome else '')
+
+    async def handle_command(self, session: GameSession | None, words: list[str]) -> tuple[GameSession | None, str]:
+        """Execute one command, return the (new) session and the reply."""
+        command: str = words[0].upper() if words else ''
+
+        if command == 'NEW':
+            client_player: int = int(words[1]) if len(words) > 1 and words[1] in ('1', '2') else 1
+            session = GameSession(self.row, self.column, self.connect, client_player)
+            self.sessions += 1
+            if client_player == session.board.PLAYER_TWO:
+                return session, 'OK\n' + await self.engine_move(session)
+            return session, 'OK'
+
+        if command == 'PLAY':
+            if session is None or session.over:
+                return session, 'ERR no game'
+            # only ASCII digits (isdigit accepts e.g. '²', which int refuses)
+            try:
+                col: int = int(words[1]) - 1 if len(words) > 1 and words[1].isascii() and words[1].isdecimal() else -1
+            except ValueError:
+                col = -1
+            if not 0 <= col < self.column:
+                return session, 'ERR invalid column'
+            if session.board.search_row(col) == -1:
+                return session, 'ERR full column'
+
+            outcome: str | None = session.play(col)
+            if outcome is not None:
+                return session, outcome
+            return session, await self.engine_move(session)
+
+        return session, 'ERR unknown command'
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session: GameSession | None = None
+        try:
+            while line := await reader.readline():
+                words: list[str] = line.decode().split()
+                if words and words[0].upper() == 'QUIT':
+                    writer.write(b'BYE\n')
+                    break
+
+                session, reply = await self.handle_command(session, words)
+                writer.write(reply.encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = HOST, port: int = PORT, unix_path: str = None) -> None:
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, backlog=4096)
+
+        async with server:
+            print('serving on', unix_path or f'{host}:{port}')
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+##################
+# LOAD GENERATOR #
+##################
+async def open_connection(host: str, port: int, unix_path: str | None):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def play_client_game(host: str, port: int, unix_path: str | None, row: int, column: int, rng: random.Random,
+                           move_latencies: list[float], new_latencies: list[float]) -> bool:
+    """
+    Play one random game against the server and record the latency of every PLAY and NEW
+    request separately, return False if the server dropped the connection.
+    """
+    reader, writer = await open_connection(host, port, unix_path)
+
+    async def request(line: str, latencies: list[float], replies: int = 1) -> list[str] | None:
+        """Send a line and wait for the words of the last of its replies (None if the connection was closed)."""
+        start: float = time.perf_counter()
+        writer.write(line.encode() + b'\n')
+        await writer.drain()
+        words: list[str] = []
+        for _ in range(replies):
+            words = (await reader.readline()).decode().split()
+            if not words:
+                return None
+        latencies.append(time.perf_counter() - start)
+        return words
+
+    try:
+        # disks of every column (the client follows the game itself)
+        heights: list[int] = [0] * column
+
+        # as player 2 the engine moves right after OK
+        client_player: int = rng.choice((1, 2))
+        words: list[str] | None = await request(f'NEW {client_player}', new_latencies, client_player)
+        if words is None:
+            return False
+        if client_player == 2:
+            heights[int(words[1]) - 1] += 1
+
+        while True:
+            col: int = rng.choice([c for c in range(column) if heights[c] < row])
+            words = await request(f'PLAY {col + 1}', move_latencies)
+            if words is None:
+                return False
+            heights[col] += 1
+            # the game is over (or the server refused the move)
+            if words[0] != 'MOVE' or len(words) > 2:
+                break
+            heights[int(words[1]) - 1] += 1
+
+        writer.write(b'QUIT\n')
+        await writer.drain()
+        return True
+    except ConnectionError:
+        return False
+    finally:
+        writer.close()
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    ordered: list[float] = sorted(values)
+    return ordered[min(len(ordered) - 1, int(ratio * len(ordered)))]
+
+
+async def generate_load(host: str, port: int, unix_path: str | None, games: int,
+                        concurrency: int, row: int, column: int, seed: int) -> None:
+    """Play games with many concurrent clients and report the latency of the moves (and of the new games)."""
+    rng = random.Random(seed)
+    move_latencies: list[float] = []
+    new_latencies: list[float] = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited_game() -> bool:
+        async with limit:
+            return await play_client_game(host, port, unix_path, row, column, rng, move_latencies, new_latencies)
+
+    start: float = time.perf_counter()
+    finished: list[bool] = await asyncio.gather(*(limited_game() for _ in range(games)))
+    elapsed: float = time.perf_counter() - start
+
+    requests: int = len(move_latencies) + len(new_latencies)
+    print(f'{games} games, {requests} requests in {elapsed:.1f}s '
+          f'({games / elapsed:.1f} games/s, {requests / elapsed:.0f} requests/s)')
+    if not all(finished):
+        print(f'{finished.count(False)} clients dropped by the server')
+    for name, latencies in (('PLAY', move_latencies), ('NEW', new_latencies)):
+        if latencies:
+            print(f'{name:>4} latency p50 {percentile(latencies, 0.5) * 1e3:.1f}ms '
+                  f'p99 {percentile(latencies, 0.99) * 1e3:.1f}ms max {max(latencies) * 1e3:.1f}ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='host games')
+    serve_parser.add_argument('--rows', type=int, default=6)
+    serve_parser.add_argument('--columns', type=int, default=7)
+    serve_parser.add_argument('--connect', type=int, default=4)
+    serve_parser.add_argument('--time', type=float, default=SEARCH_TIME, help='thinking time of the engine (seconds)')
+    serve_parser.add_argument('--workers', type=int, default=None)
+
+    load_parser = commands.add_parser('load', help='play random games against a server')
+    load_parser.add_argument('--games', type=int, default=1000)
+    load_parser.add_argument('--concurrency', type=int, default=200)
+    load_parser.add_argument('--rows', type=int, default=6)
+    load_parser.add_argument('--columns', type=int, default=7)
+    load_parser.add_argument('--seed', type=int, default=0)
+
+    for command_parser in (serve_parser, load_parser):
+        command_parser.add_argument('--host', default=HOST)
+        command_parser.add_argument('--port', type=int, default=PORT)
+        command_parser.add_argument('--unix', help='path of a unix socket instead of TCP')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = Connect4Server(args.rows, args.columns, args.connect, args.time, args.workers)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+
+    elif args.command == 'load':
+        asyncio.run(generate_load(args.host, args.port, args.unix, args.games, args.concurrency, args.rows, args.columns, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,188 @@
 #!usr/bin/python
+"""
+Search engine for Connect Four.
+The agent keeps the position as bitboards (see Connect4BackEnd.BitBoard) and searches it
+with iterative deepening negamax and alpha-beta pruning. The search can be limited
+by time, by visited nodes or by depth. ParallelAgent splits the root moves between processes.
+Solver plays endgames perfectly: the exact outcome and the distance to the end of the game.
+"""
+import os
+import struct
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from Connect4BackEnd import BitBoard
+
+
+#############
+# CONSTANTS #
+#############
+# a won position is worth more than any heuristic evaluation
+WIN_SCORE: int = 1_000_000
+INFINITY: int = WIN_SCORE + 1
+
+# weights of the heuristic evaluation
+THREAT_WEIGHT: int = 16
+CENTER_WEIGHT: int = 3
+
+# the budget is checked after every 64th node: about a millisecond of search, a short
+# time limit (e.g. the 50 ms of the server) is not overrun by more than that
+CHECK_INTERVAL: int = 63
+
+# default memory of the transposition table
+TABLE_BYTES: int = 16 * 1024 * 1024
+
+# keys of bigger boards are folded into 64 bits by this prime
+KEY_BITS: int = 64
+KEY_MASK: int = (1 << KEY_BITS) - 1
+KEY_PRIME: int = (1 << KEY_BITS) - 59
+FIBONACCI_MULTIPLIER: int = 0x9E3779B97F4A7C15
+
+# the solver shares exact scores between runs only for positions with this many empty cells
+CACHE_MIN_EMPTY: int = 12
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget is exhausted."""
+    pass
+
+
+class SearchResult:
+    def __init__(self, move: int, score: int, depth: int, nodes: int, elapsed: float, pv: list[int]) -> None:
+        # best column and its value from the view of the player to move
+        self.move: int = move
+        self.score: int = score
+
+        # last completed iteration
+        self.depth: int = depth
+
+        # statistics
+        self.nodes: int = nodes
+        self.elapsed: float = elapsed
+
+        # principal variation (columns)
+        self.pv: list[int] = pv
+
+    @property
+    def nps(self) -> float:
+        """Nodes per second."""
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        pv: str = ' '.join(str(col + 1) for col in self.pv)
+        return (f'depth {self.depth} score {self.score} nodes {self.nodes} '
+                f'time {self.elapsed:.3f}s nps {self.nps:.0f} pv {pv}')
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of searched positions.
+    Every bucket has two slots: the first one keeps the deepest search (depth-preferred),
+    the second one is always replaced. Keys and packed entries live in two flat arrays,
+    so the memory of the table never grows beyond its limit.
+    """
+    # bound types
+    EXACT: int = 0
+    LOWER: int = 1
+    UPPER: int = 2
+
+    # 8 bytes key + 8 bytes packed entry
+    SLOT_SIZE: int = 16
+    SLOTS_PER_BUCKET: int = 2
+
+    # depth and move + 1 have 8 bits each in an entry
+    MAX_DEPTH: int = 0xFF
+    MAX_COLUMNS: int = 0xFF
+
+    def __init__(self, max_bytes: int = TABLE_BYTES, columns: int = 7) -> None:
+        # the move of a wider board would overflow into the depth
+        if columns > self.MAX_COLUMNS:
+            raise ValueError(f'the table stores moves of at most {self.MAX_COLUMNS} columns, got {columns}')
+        self.bucket_count: int = max(1, max_bytes // (self.SLOT_SIZE * self.SLOTS_PER_BUCKET))
+        slot_count: int = self.bucket_count * self.SLOTS_PER_BUCKET
+
+        # 0 marks an empty slot (a valid key is never 0)
+        self.keys: array = array('Q', bytes(8 * slot_count))
+        # score << 18 | depth << 10 | (move + 1) << 2 | bound
+        self.entries: array = array('q', bytes(8 * slot_count))
+
+        self.reset_counters()
+
+    @property
+    def memory(self) -> int:
+        """Bytes allocated by the slots."""
+        return self.keys.itemsize * len(self.keys) + self.entries.itemsize * len(self.entries)
+
+    def reset_counters(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        # probes of a bucket which was occupied by other positions
+        self.collisions: int = 0
+        self.stores: int = 0
+        # stores which evicted another position
+        self.overwrites: int = 0
+
+    def clear(self) -> None:
+        self.keys = array('Q', bytes(self.keys.itemsize * len(self.keys)))
+        self.entries = array('q', bytes(self.entries.itemsize * len(self.entries)))
+        self.reset_counters()
+
+    def _first_slot(self, key: int) -> int:
+        """Fibonacci hashing spreads the structured bitboard keys over the buckets."""
+        return (((key * FIBONACCI_MULTIPLIER) & KEY_MASK) * self.bucket_count >> KEY_BITS) * self.SLOTS_PER_BUCKET
+
+    def probe(self, key: int) -> tuple[int, int, int, int] | None:
+        """Return score, depth, bound and best move (-1 if unknown) of a position."""
+        slot: int = self._first_slot(key)
+        keys: array = self.keys
+
+        if keys[slot] != key:
+            slot += 1
+            if keys[slot] != key:
+                self.misses += 1
+                if keys[slot] or keys[slot - 1]:
+                    self.collisions += 1
+                return None
+
+        self.hits += 1
+        entry: int = self.entries[slot]
+        return entry >> 18, (entry >> 10) & 0xFF, entry & 0x3, ((entry >> 2) & 0xFF) - 1
+
+    def store(self, key: int, depth: int, score: int, bound: int, move: int) -> None:
+        slot: int = self._first_slot(key)
+        keys: array = self.keys
+        entries: array = self.entries
+
+        # deeper searches are stored as the deepest the entry can hold (a lower bound of their depth)
+        depth = min(depth, self.MAX_DEPTH)
+
+        # deeper (or equally deep) searches go to the depth-preferred slot
+        if keys[slot] != key and (entries[slot] >> 10) & 0xFF > depth:
+            slot += 1
+
+        if keys[slot] and keys[slot] != key:
+            self.overwrites += 1
+        self.stores += 1
+
+        keys[slot] = key
+        entries[slot] = (score << 18) | (depth << 10) | ((move + 1) << 2) | bound
+
+    def usage(self) -> float:
+        """Ratio of the occupied slots."""
+        return sum(1 for key in self.keys if key) / len(self.keys)
+
+    def stats(self) -> dict[str, int | float]:
+        probes: int = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'hit_rate': self.hits / probes if probes else 0.0,
+            'memory': self.memory
+        }
 
 
 class Agent:
@@ -6,8 +190,873 @@ class Agent:
     opponent: int
     all: int
 
-    def __init__(self) -> None:
-        pass
+    def __init__(
+            self,
+            row: int = 6,
+            column: int = 7,
+            first: bool = True,
+            time_limit: float = 1.0,
+            node_limit: int = None,
+            max_depth: int = None,
+            table_bytes: int = TABLE_BYTES,
+            book=None,
+            connect: int = 4
+    ) -> None:
+        # geometry of the bitboards
+        self.geometry: BitBoard = BitBoard(row, column, connect)
+        self.cell_count: int = row * column
+
+        # does the agent drop the first disk
+        self.first: bool = first
+
+        # default budget of a search
+        self.time_limit: float = time_limit
+        self.node_limit: int = node_limit
+        self.max_depth: int = max_depth
+
+        # center first move ordering
+        center: float = (column - 1) / 2
+        self.move_order: list[int] = sorted(range(column), key=lambda c: abs(c - center))
+
+        # bonus of the disks in the center column(s)
+        self.center_mask: int = 0
+        for col in range(column):
+            if abs(col - center) < 1:
+                self.center_mask |= self.geometry.column_mask(col)
+
+        # masks of the columns
+        g: BitBoard = self.geometry
+        self._column_masks: list[int] = [g.column_mask(col) for col in range(column)]
+        self._bottom_masks: list[int] = [1 << (col * g.column_height) for col in range(column)]
+        self._top_masks: list[int] = [1 << (row - 1 + col * g.column_height) for col in range(column)]
+
+        # searched positions (shared between the searches)
+        self.table: TranspositionTable = TranspositionTable(table_bytes, column)
+        # bitboard keys fit into the table if the board has at most 63 bits
+        self.exact_keys: bool = column * g.column_height < KEY_BITS
+
+        # known openings (an OpeningBook), consulted before searching
+        if book is not None and (book.row_count, book.column_count, book.connect) != (row, column, connect):
+            raise ValueError(f'the book belongs to a {book.row_count}x{book.column_count} board '
+                             f'with lines of {book.connect}')
+        self.book = book
+
+        # called with the SearchResult of every completed iteration
+        self.on_iteration = None
+
+        # exact endgame search (created at the first solve)
+        self.solver: Solver | None = None
+
+        self.reset()
+
+    def reset(self) -> None:
+        self.myself = 0
+        self.opponent = 0
+        self.all = 0
+        self.moves_played: int = 0
+
+    @property
+    def my_turn(self) -> bool:
+        return (self.moves_played % 2 == 0) == self.first
+
+    def free_row(self, col: int) -> int:
+        """Index of the lowest free row or -1 if the column is full."""
+        height: int = ((self.all & self.geometry.column_mask(col)) >> (col * self.geometry.column_height)).bit_length()
+        return height if height < self.geometry.row_count else -1
 
     def update_boards(self, row: int, col: int) -> None:
-        pass
+        """Register a disk dropped by the player to move."""
+        bit: int = self.geometry.bit(row, col)
+        if self.my_turn:
+            self.myself |= bit
+        else:
+            self.opponent |= bit
+        self.all |= bit
+        self.moves_played += 1
+
+    def play_moves(self, moves: str) -> None:
+        """Register a whole game given by 1-based columns (e.g. 4453)."""
+        for char in moves:
+            col: int = int(char) - 1
+            self.update_boards(self.free_row(col), col)
+
+    def undo_boards(self, row: int, col: int) -> None:
+        """Take back the last registered disk."""
+        bit: int = ~self.geometry.bit(row, col)
+        self.moves_played -= 1
+        if self.my_turn:
+            self.myself &= bit
+        else:
+            self.opponent &= bit
+        self.all &= bit
+
+    def set_position(self, current: int, mask: int) -> None:
+        """Take over a position given by the disks of the player to move and every disk."""
+        self.moves_played = mask.bit_count()
+        self.first = self.moves_played % 2 == 0
+        self.myself = current
+        self.opponent = current ^ mask
+        self.all = mask
+
+    def position(self) -> tuple[int, int]:
+        """Disks of the player to move and every disk."""
+        return self.myself if self.my_turn else self.opponent, self.all
+
+    ##########
+    # SEARCH #
+    ##########
+    def _can_play(self, mask: int, col: int) -> bool:
+        return not mask & self._top_masks[col]
+
+    def evaluate(self, current: int, mask: int, my_threats: int) -> int:
+        """Heuristic value of a quiet position from the view of the player to move."""
+        other: int = current ^ mask
+        other_threats: int = self.geometry.winning_cells(other, mask)
+
+        score: int = THREAT_WEIGHT * (my_threats.bit_count() - other_threats.bit_count())
+        score += CENTER_WEIGHT * ((current & self.center_mask).bit_count() - (other & self.center_mask).bit_count())
+        return score
+
+    def key(self, current: int, mask: int) -> int:
+        """Unique (never zero) key of a position, folded into 64 bits on big boards."""
+        key: int = current + mask + self.geometry.bottom_mask
+        return key if self.exact_keys else key % KEY_PRIME or 1
+
+    def _to_table(self, score: int, ply: int) -> int:
+        """Win scores are stored relative to the position instead of the root."""
+        if score > WIN_SCORE - self.cell_count:
+            return score + ply
+        if score < self.cell_count - WIN_SCORE:
+            return score - ply
+        return score
+
+    def _from_table(self, score: int, ply: int) -> int:
+        if score > WIN_SCORE - self.cell_count:
+            return score - ply
+        if score < self.cell_count - WIN_SCORE:
+            return score + ply
+        return score
+
+    def _winning_column(self, cells: int) -> int:
+        for col in self.move_order:
+            if cells & self._column_masks[col]:
+                return col
+        return -1
+
+    def _negamax(self, current: int, mask: int, moves: int, depth: int, alpha: int, beta: int, ply: int) -> int:
+        self.nodes += 1
+        if not self.nodes & CHECK_INTERVAL:
+            self._check_budget()
+
+        pv_table: list[list[int]] = self._pv_table
+
+        # win in one move
+        my_threats: int = self.geometry.winning_cells(current, mask)
+        playable_wins: int = my_threats & (mask + self.geometry.bottom_mask)
+        if playable_wins:
+            pv_table[ply] = [self._winning_column(playable_wins)]
+            return WIN_SCORE - ply - 1
+
+        # the board is full
+        if moves == self.cell_count:
+            pv_table[ply] = []
+            return 0
+
+        if depth == 0:
+            pv_table[ply] = []
+            return self.evaluate(current, mask, my_threats)
+
+        # look up earlier searches of the position
+        table: TranspositionTable = self.table
+        key: int = self.key(current, mask)
+        entry: tuple[int, int, int, int] | None = table.probe(key)
+        table_move: int = -1
+        if entry is not None:
+            score, entry_depth, bound, table_move = entry
+            if entry_depth >= depth:
+                score = self._from_table(score, ply)
+                if bound == table.EXACT:
+                    pv_table[ply] = [table_move]
+                    return score
+                if bound == table.LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    pv_table[ply] = [table_move]
+                    return score
+
+        original_alpha: int = alpha
+        best: int = -INFINITY
+        best_move: int = -1
+        for col in self._ordered_moves(ply, table_move):
+            if not self._can_play(mask, col):
+                continue
+
+            # the opponent becomes the player to move
+            score: int = -self._negamax(
+                current ^ mask,
+                mask | (mask + self._bottom_masks[col]),
+                moves + 1,
+                depth - 1,
+                -beta,
+                -alpha,
+                ply + 1
+            )
+
+            if score > best:
+                best = score
+                best_move = col
+                pv_table[ply] = [col] + pv_table[ply + 1]
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best <= original_alpha:
+            bound = table.UPPER
+        elif best >= beta:
+            bound = table.LOWER
+        else:
+            bound = table.EXACT
+        table.store(key, depth, self._to_table(best, ply), bound, best_move)
+
+        return best
+
+    def _ordered_moves(self, ply: int, table_move: int) -> list[int]:
+        """Center first, but the best move of the table and the previous principal variation go before all."""
+        first: list[int] = []
+        if table_move >= 0:
+            first.append(table_move)
+        if ply < len(self._last_pv) and self._last_pv[ply] != table_move:
+            first.append(self._last_pv[ply])
+        if not first:
+            return self.move_order
+        return first + [col for col in self.move_order if col not in first]
+
+    def _probe_book(self, current: int, mask: int, start: float, max_depth: int | None) -> SearchResult | None:
+        """The move of the book, unless the search is given a greater depth than the book was searched to."""
+        if self.book is None:
+            return None
+        entry: tuple[int, int, int] | None = self.book.probe(current, mask)
+        if entry is None:
+            return None
+        move, score, depth = entry
+        # a decided score is exact at any depth
+        if max_depth is not None and max_depth > depth and abs(score) < WIN_SCORE - self.cell_count:
+            return None
+        return SearchResult(move, score, depth, 0, time.perf_counter() - start, [move])
+
+    def _start_budget(self, time_limit: float | None, node_limit: int | None) -> float:
+        """Reset the statistics and set the limits of a search, return the start time."""
+        start: float = time.perf_counter()
+        self._deadline: float = start + time_limit if time_limit is not None else None
+        self._node_budget: int = node_limit
+        self.nodes: int = 0
+        self.table.reset_counters()
+        return start
+
+    def legal_moves(self, mask: int) -> list[int]:
+        return [col for col in self.move_order if self._can_play(mask, col)]
+
+    def search_move(
+            self,
+            current: int,
+            mask: int,
+            moves: int,
+            col: int,
+            depth: int,
+            pv: list[int],
+            alpha: int = -INFINITY
+    ) -> tuple[int, list[int]]:
+        """
+        Fixed depth search of one root move (the budget has to be started), return its score and line.
+        Scores not above alpha are only upper bounds.
+        """
+        self._pv_table = [[] for _ in range(depth + 2)]
+        self._last_pv = pv
+
+        # the root move wins immediately
+        move: int = (mask + self._bottom_masks[col]) & self._column_masks[col]
+        if self.geometry.is_winning(current | move):
+            return WIN_SCORE - 1, [col]
+
+        score: int = -self._negamax(current ^ mask, mask | move, moves + 1, depth - 1, -INFINITY, -alpha, 1)
+        return score, [col] + self._pv_table[1]
+
+    def _check_budget(self) -> None:
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise SearchAborted
+        if self._node_budget is not None and self.nodes >= self._node_budget:
+            raise SearchAborted
+
+    def search(self, time_limit: float = None, node_limit: int = None, max_depth: int = None) -> SearchResult:
+        """Iterative deepening search from the view of the player to move."""
+        time_limit = self.time_limit if time_limit is None else time_limit
+        node_limit = self.node_limit if node_limit is None else node_limit
+        max_depth = self.max_depth if max_depth is None else max_depth
+
+        # known opening (a search of a given depth goes deeper than the book)
+        start: float = self._start_budget(time_limit, node_limit)
+        current, mask = self.position()
+        book_result: SearchResult | None = self._probe_book(current, mask, start, max_depth)
+        if book_result is not None:
+            return book_result
+
+        empty_cells: int = self.cell_count - self.moves_played
+        if max_depth is None or max_depth > empty_cells:
+            max_depth = empty_cells
+
+        self._last_pv: list[int] = []
+
+        # fallback if not even the first iteration can be finished
+        legal: list[int] = self.legal_moves(mask)
+        result: SearchResult = SearchResult(legal[0] if legal else -1, 0, 0, 0, 0.0, [])
+
+        for depth in range(1, max_depth + 1):
+            self._pv_table: list[list[int]] = [[] for _ in range(depth + 2)]
+            try:
+                score: int = self._negamax(current, mask, self.moves_played, depth, -INFINITY, INFINITY, 0)
+            except SearchAborted:
+                break
+
+            self._last_pv = self._pv_table[0]
+            result = SearchResult(self._last_pv[0], score, depth, self.nodes, time.perf_counter() - start, self._last_pv)
+            if self.on_iteration is not None:
+                self.on_iteration(result)
+
+            # the game is decided, deeper iterations would find the same
+            if abs(score) >= WIN_SCORE - self.cell_count:
+                break
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def best_move(self) -> int:
+        return self.search().move
+
+    def clear_tables(self) -> None:
+        """Forget the searched positions (e.g. to time searches from scratch)."""
+        self.table.clear()
+
+    def solve(self) -> 'SolveResult':
+        """Perfect play from the view of the player to move (meant for positions with few empty cells)."""
+        if self.solver is None:
+            g: BitBoard = self.geometry
+            self.solver = Solver(g.row_count, g.column_count, g.connect, self.table.memory)
+        return self.solver.solve(*self.position())
+
+
+###################
+# PARALLEL SEARCH #
+###################
+# every worker process owns one agent (and its transposition table) between the searches
+_worker_agent: Agent | None = None
+# the table of a worker is cleared when the generation of its ParallelAgent changes
+_worker_generation: int = 0
+
+
+def _init_worker(row: int, column: int, connect: int, table_bytes: int) -> None:
+    global _worker_agent
+    _worker_agent = Agent(row, column, connect=connect, table_bytes=table_bytes)
+
+
+def _search_root_move(
+        current: int,
+        mask: int,
+        moves: int,
+        col: int,
+        depth: int,
+        pv: list[int],
+        alpha: int,
+        deadline: float | None,
+        node_limit: int | None,
+        generation: int = 0
+) -> tuple[int, list[int], int] | None:
+    """Search one root move in a worker process, None means the budget ran out."""
+    global _worker_generation
+    agent: Agent = _worker_agent
+    if generation != _worker_generation:
+        agent.table.clear()
+        _worker_generation = generation
+    # the deadline is wall clock time, it is comparable between processes
+    time_limit: float = max(0.0, deadline - time.time()) if deadline is not None else None
+    agent._start_budget(time_limit, node_limit)
+
+    try:
+        score, line = agent.search_move(current, mask, moves, col, depth, pv, alpha)
+    except SearchAborted:
+        return None
+    return score, line, agent.nodes
+
+
+# agents of the processes searching single positions (by board dimensions)
+_position_agents: dict[tuple[int, int, int], Agent] = {}
+
+
+def search_position(
+        current: int,
+        mask: int,
+        row: int = 6,
+        column: int = 7,
+        connect: int = 4,
+        time_limit: float | None = None,
+        max_depth: int | None = None
+) -> SearchResult:
+    """
+    Search a position given by the disks of the player to move and every disk.
+    Meant to run in the workers of a process pool, the agent (and its table) of the
+    board dimensions stays in the process for the next call.
+    """
+    dimensions: tuple[int, int, int] = (row, column, connect)
+    agent: Agent | None = _position_agents.get(dimensions)
+    if agent is None:
+        agent = _position_agents[dimensions] = Agent(row, column, connect=connect)
+
+    agent.set_position(current, mask)
+    return agent.search(time_limit=time_limit, max_depth=max_depth)
+
+
+class ParallelAgent(Agent):
+    """
+    Root splitting search: every iteration of the iterative deepening searches the expected
+    best root move first, then distributes the other root moves between worker processes
+    with its score as alpha (threads would be serialized by the GIL).
+    """
+
+    def __init__(self, *args, workers: int = None, **kwargs) -> None:
+        super(ParallelAgent, self).__init__(*args, **kwargs)
+        self.workers: int = workers or os.cpu_count() or 1
+        self._pool: ProcessPoolExecutor | None = None
+        # incremented by clear_tables, the workers clear their tables at their next task
+        self._generation: int = 0
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        # the workers start only once (at the first search)
+        if self._pool is None:
+            g: BitBoard = self.geometry
+            self._pool = ProcessPoolExecutor(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(g.row_count, g.column_count, g.connect, self.table.memory)
+            )
+        return self._pool
+
+    def clear_tables(self) -> None:
+        super(ParallelAgent, self).clear_tables()
+        self._generation += 1
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def search(self, time_limit: float = None, node_limit: int = None, max_depth: int = None) -> SearchResult:
+        time_limit = self.time_limit if time_limit is None else time_limit
+        node_limit = self.node_limit if node_limit is None else node_limit
+        max_depth = self.max_depth if max_depth is None else max_depth
+
+        # known opening (a search of a given depth goes deeper than the book)
+        start: float = self._start_budget(time_limit, node_limit)
+        deadline: float = time.time() + time_limit if time_limit is not None else None
+        current, mask = self.position()
+        book_result: SearchResult | None = self._probe_book(current, mask, start, max_depth)
+        if book_result is not None:
+            return book_result
+
+        empty_cells: int = self.cell_count - self.moves_played
+        if max_depth is None or max_depth > empty_cells:
+            max_depth = empty_cells
+
+        legal: list[int] = self.legal_moves(mask)
+        result: SearchResult = SearchResult(legal[0] if legal else -1, 0, 0, 0, 0.0, [])
+        pv: list[int] = []
+
+        for depth in range(1, max_depth + 1):
+            # the node budget is shared by the root moves
+            move_budget: int = (node_limit - self.nodes) // len(legal) if node_limit is not None else None
+            if move_budget is not None and move_budget <= 0:
+                break
+
+            def submit(col: int, alpha: int):
+                return self.pool.submit(
+                    _search_root_move,
+                    current, mask, self.moves_played, col, depth,
+                    pv if pv and pv[0] == col else [],
+                    alpha, deadline, move_budget, self._generation
+                )
+
+            # the expected best move sets the bound of the others
+            outcomes = [submit(legal[0], -INFINITY).result()]
+            if outcomes[0] is not None:
+                futures = [submit(col, outcomes[0][0]) for col in legal[1:]]
+                outcomes += [future.result() for future in futures]
+
+            self.nodes += sum(outcome[2] for outcome in outcomes if outcome is not None)
+            if None in outcomes:
+                break
+
+            # the first (most central) of the best moves
+            score, pv, _ = max(outcomes, key=lambda outcome: outcome[0])
+            result = SearchResult(pv[0], score, depth, self.nodes, time.perf_counter() - start, pv)
+            if self.on_iteration is not None:
+                self.on_iteration(result)
+
+            # the game is decided, deeper iterations would find the same
+            if abs(score) >= WIN_SCORE - self.cell_count:
+                break
+
+            # the best move goes first next time
+            legal.remove(pv[0])
+            legal.insert(0, pv[0])
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+
+##################
+# ENDGAME SOLVER #
+##################
+class CacheError(Exception):
+    """The file is not a solved position cache of this board."""
+    pass
+
+
+class SolveResult:
+    # outcomes from the view of the player to move
+    LOSS: int = -1
+    DRAW: int = 0
+    WIN: int = 1
+
+    def __init__(self, score: int, move: int, moves_played: int, cell_count: int, nodes: int, elapsed: float) -> None:
+        # exact score (see Solver) and a best column
+        self.score: int = score
+        self.move: int = move
+
+        # win, draw or loss and the plies until the end of the game with perfect play
+        self.outcome: int = (score > 0) - (score < 0)
+        if score == 0:
+            self.distance: int = cell_count - moves_played
+        else:
+            self.distance = cell_count + 1 - abs(score) - moves_played
+
+        # statistics
+        self.nodes: int = nodes
+        self.elapsed: float = elapsed
+
+    def __str__(self):
+        outcome: str = {self.WIN: 'win', self.DRAW: 'draw', self.LOSS: 'loss'}[self.outcome]
+        return (f'{outcome} in {self.distance} plies move {self.move + 1} score {self.score} '
+                f'nodes {self.nodes} time {self.elapsed:.3f}s')
+
+
+class SolvedCache:
+    """
+    Exact scores of solved positions by their canonical key (the smaller key of the position
+    and its mirror image). The file is a small header and the records sorted by key.
+    """
+    MAGIC: bytes = b'C4SC'
+    VERSION: int = 1
+
+    # magic, version, rows, columns, length of a line, count of records
+    HEADER: struct.Struct = struct.Struct('<4sBBBBI')
+    SCORE: struct.Struct = struct.Struct('<h')
+
+    def __init__(self, geometry: BitBoard, path: str = None) -> None:
+        self.geometry: BitBoard = geometry
+        self.key_bytes: int = (geometry.column_count * geometry.column_height + 7) // 8
+
+        self.scores: dict[int, int] = {}
+        # positions solved since the last load
+        self.added: dict[int, int] = {}
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def canonical_key(self, current: int, mask: int) -> int:
+        key: int = current + mask + self.geometry.bottom_mask
+        return min(key, self.geometry.mirror(key))
+
+    def get(self, key: int) -> int | None:
+        return self.scores.get(key)
+
+    def put(self, key: int, score: int) -> None:
+        if key not in self.scores:
+            self.scores[key] = score
+            self.added[key] = score
+
+    def update(self, scores: dict[int, int]) -> None:
+        for key, score in scores.items():
+            self.put(key, score)
+
+    def load(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            data: bytes = file.read()
+
+        if len(data) < self.HEADER.size:
+            raise CacheError(f'{path} is too short')
+        magic, version, row, column, connect, count = self.HEADER.unpack_from(data, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise CacheError(f'{path} is not a solved position cache')
+        g: BitBoard = self.geometry
+        if (row, column, connect) != (g.row_count, g.column_count, g.connect):
+            raise CacheError(f'{path} belongs to a {row}x{column} board with lines of {connect}')
+
+        record_size: int = self.key_bytes + self.SCORE.size
+        if len(data) != self.HEADER.size + count * record_size:
+            raise CacheError(f'{path} is truncated')
+
+        for start in range(self.HEADER.size, len(data), record_size):
+            key: int = int.from_bytes(data[start:start + self.key_bytes], 'little')
+            self.scores[key] = self.SCORE.unpack_from(data, start + self.key_bytes)[0]
+        self.added = {}
+
+    def save(self, path: str) -> None:
+        g: BitBoard = self.geometry
+        # write a new file and swap it in, a crash does not destroy the old cache
+        temporary: str = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, g.row_count, g.column_count, g.connect, len(self.scores)))
+            for key in sorted(self.scores):
+                file.write(key.to_bytes(self.key_bytes, 'little') + self.SCORE.pack(self.scores[key]))
+        os.replace(temporary, path)
+        self.added = {}
+
+
+class Solver:
+    """
+    Perfect play of positions with few empty cells.
+    The score of a position is exact from the view of the player to move: a win with the
+    disk of the p-th ply of the game is worth cells + 1 - p, a loss is the negative of the
+    winner's score and a draw is 0. So the winner prefers fast wins and the loser the
+    longest defence. Only non-losing moves are searched: a threat of the opponent has to be
+    blocked and the cell below a threat of the opponent is never played.
+    """
+
+    def __init__(self, row: int = 6, column: int = 7, connect: int = 4, table_bytes: int = TABLE_BYTES,
+                 cache: SolvedCache = None, cache_min_empty: int = CACHE_MIN_EMPTY) -> None:
+        self.geometry: BitBoard = BitBoard(row, column, connect)
+        self.cell_count: int = row * column
+
+        g: BitBoard = self.geometry
+        center: float = (column - 1) / 2
+        self.move_order: list[int] = sorted(range(column), key=lambda c: abs(c - center))
+        self._column_masks: list[int] = [g.column_mask(col) for col in range(column)]
+
+        # bounds of the searched positions (the scores do not depend on the root)
+        self.table: TranspositionTable = TranspositionTable(table_bytes, column)
+        self.exact_keys: bool = column * g.column_height < KEY_BITS
+
+        # exact scores between runs, looked up in positions with at least cache_min_empty empty cells
+        self.cache: SolvedCache = cache if cache is not None else SolvedCache(g)
+        self.cache_min_empty: int = cache_min_empty
+
+        self.nodes: int = 0
+
+    def key(self, current: int, mask: int) -> int:
+        key: int = current + mask + self.geometry.bottom_mask
+        return key if self.exact_keys else key % KEY_PRIME or 1
+
+    def _non_losing_moves(self, current: int, mask: int) -> int:
+        """Cells the player to move can play without losing on the next turn (0 if none)."""
+        g: BitBoard = self.geometry
+        possible: int = (mask + g.bottom_mask) & g.board_mask
+        other_threats: int = g.winning_cells(current ^ mask, mask)
+
+        forced: int = possible & other_threats
+        if forced:
+            # two threats can not be blocked
+            if forced & (forced - 1):
+                return 0
+            possible = forced
+
+        # the opponent would win on top of the disk
+        return possible & ~(other_threats >> 1)
+
+    def _ordered_moves(self, current: int, mask: int, moves: int) -> list[tuple[int, int]]:
+        """(column, move bit) of the non-losing moves, the most new threats first, then center first."""
+        g: BitBoard = self.geometry
+        candidates: list[tuple[int, int, int]] = []
+        for col in self.move_order:
+            move: int = moves & self._column_masks[col]
+            if move:
+                threats: int = g.winning_cells(current | move, mask | move).bit_count()
+                candidates.append((-threats, col, move))
+        # sort is stable, the center order breaks the ties
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [(col, move) for _, col, move in candidates]
+
+    def _solve(self, current: int, mask: int, moves: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        g: BitBoard = self.geometry
+        cells: int = self.cell_count
+
+        # win with the next disk
+        if g.winning_cells(current, mask) & (mask + g.bottom_mask):
+            return cells - moves
+
+        # the last disk can not win for the opponent
+        if moves >= cells - 1:
+            return 0
+
+        non_losing: int = self._non_losing_moves(current, mask)
+        if not non_losing:
+            return moves + 1 - cells
+
+        # the opponent wins 4 plies later at the soonest, the player 3 plies later
+        low: int = min(moves + 3 - cells, 0)
+        high: int = max(cells - moves - 2, 0)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        # solved between earlier runs
+        empty_cells: int = cells - moves
+        cache_key: int = 0
+        if empty_cells >= self.cache_min_empty:
+            cache_key = self.cache.canonical_key(current, mask)
+            score: int | None = self.cache.get(cache_key)
+            if score is not None:
+                return score
+
+        table: TranspositionTable = self.table
+        key: int = self.key(current, mask)
+        entry: tuple[int, int, int, int] | None = table.probe(key)
+        if entry is not None:
+            score, _, bound, _ = entry
+            if bound == table.EXACT:
+                return score
+            if bound == table.LOWER:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+
+        original_alpha: int = alpha
+        best: int = -INFINITY
+        best_move: int = -1
+        for col, move in self._ordered_moves(current, mask, non_losing):
+            score: int = -self._solve(current ^ mask, mask | move, moves + 1, -beta, -alpha)
+            if score > best:
+                best = score
+                best_move = col
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best <= original_alpha:
+            bound = table.UPPER
+        elif best >= beta:
+            bound = table.LOWER
+        else:
+            bound = table.EXACT
+            if cache_key:
+                self.cache.put(cache_key, best)
+        table.store(key, empty_cells, best, bound, best_move)
+
+        return best
+
+    def score(self, current: int, mask: int) -> int:
+        """Exact score of a position, narrowed down by null window searches."""
+        moves: int = mask.bit_count()
+        low: int = moves - self.cell_count
+        high: int = self.cell_count - moves
+
+        while low < high:
+            # the middle, but closer to zero first (most endgames are decided late or drawn)
+            middle: int = low + (high - low) // 2
+            if middle <= 0 and low // 2 < middle:
+                middle = low // 2
+            elif middle >= 0 and high // 2 > middle:
+                middle = high // 2
+
+            score: int = self._solve(current, mask, moves, middle, middle + 1)
+            if score <= middle:
+                high = score
+            else:
+                low = score
+        return low
+
+    def solve(self, current: int, mask: int) -> SolveResult:
+        """Exact outcome, distance to the end and a best move of a position given by the disks of the player to move and every disk."""
+        start: float = time.perf_counter()
+        self.nodes = 0
+        self.table.reset_counters()
+
+        g: BitBoard = self.geometry
+        moves: int = mask.bit_count()
+        if g.is_winning(current ^ mask) or moves == self.cell_count:
+            raise ValueError('the game is already over')
+
+        score: int = self.score(current, mask)
+
+        # the first move which keeps the score
+        possible: int = (mask + g.bottom_mask) & g.board_mask
+        wins: int = g.winning_cells(current, mask) & possible
+        best_move: int = -1
+        if wins:
+            best_move = next(col for col in self.move_order if wins & self._column_masks[col])
+        else:
+            candidates: int = self._non_losing_moves(current, mask) or possible
+            for col, move in self._ordered_moves(current, mask, candidates):
+                child_mask: int = mask | move
+                if child_mask.bit_count() == self.cell_count:
+                    child_score: int = 0
+                else:
+                    child_score = -self._solve(current ^ mask, child_mask, moves + 1, -score, -score + 1)
+                if child_score >= score:
+                    best_move = col
+                    break
+
+        if self.cell_count - moves >= self.cache_min_empty:
+            self.cache.put(self.cache.canonical_key(current, mask), score)
+        return SolveResult(score, best_move, moves, self.cell_count, self.nodes, time.perf_counter() - start)
+
+
+# solvers of the processes adjudicating positions (by board dimensions)
+_position_solvers: dict[tuple[int, int, int], Solver] = {}
+
+
+def solve_position(current: int, mask: int, row: int = 6, column: int = 7, connect: int = 4) -> SolveResult:
+    """Solve a position in a worker of a process pool, the solver of the board dimensions stays in the process."""
+    dimensions: tuple[int, int, int] = (row, column, connect)
+    solver: Solver | None = _position_solvers.get(dimensions)
+    if solver is None:
+        solver = _position_solvers[dimensions] = Solver(row, column, connect)
+    return solver.solve(current, mask)
+
+
+def main() -> None:
+    """Analyse a position given by its moves (1-based columns, e.g. 4453)."""
+    moves: str = sys.argv[1] if len(sys.argv) > 1 else ''
+    time_limit: float = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    agent = Agent(time_limit=time_limit)
+    agent.play_moves(moves)
+
+    agent.on_iteration = print
+    print(agent.search())
+    print('table', agent.table.stats())
+
+
+if __name__ == '__main__':
+    main()
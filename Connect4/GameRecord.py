@@ -0,0 +1,300 @@
+#!usr/bin/python
+"""
+Compact game records of Connect Four.
+A record is a small header, one byte per move and a keyframe (the two bitboards) after
+every interval moves. Any ply is rebuilt from the nearest keyframe with at most
+interval - 1 moves, so seeking costs the same at the start and at the end of a game.
+An archive stores many records one after the other with an offset index at its end,
+it is read through mmap.
+    python GameRecord.py show games.c4a 12
+"""
+import argparse
+import mmap
+import struct
+from Connect4BackEnd import BitBoard, Connect4Game, Connect4GameBoard
+
+
+#############
+# CONSTANTS #
+#############
+RECORD_MAGIC: bytes = b'C4GR'
+ARCHIVE_MAGIC: bytes = b'C4GA'
+VERSION: int = 1
+
+# a keyframe after every 32nd move by default: a 6x7 game is about a third bigger than its
+# moves and a seek replays at most 31 moves (the interval is stored in the header, 1..255)
+KEYFRAME_INTERVAL: int = 32
+
+# winner of the game (1 or 2), 0 is a draw
+UNFINISHED: int = 255
+
+# magic, version, rows, columns, length of a line, keyframe interval, result, count of moves
+RECORD_HEADER: struct.Struct = struct.Struct('<4sBBBBBBH')
+# magic, version
+ARCHIVE_HEADER: struct.Struct = struct.Struct('<4sB')
+# offset of the index, count of records
+ARCHIVE_FOOTER: struct.Struct = struct.Struct('<QI')
+OFFSET: struct.Struct = struct.Struct('<Q')
+
+
+class RecordError(Exception):
+    """The data is not a valid game record or archive."""
+    pass
+
+
+class GameRecord:
+
+    def __init__(
+            self,
+            row: int,
+            column: int,
+            connect: int,
+            moves: bytes,
+            result: int = UNFINISHED,
+            interval: int = KEYFRAME_INTERVAL,
+            keyframes: list[tuple[int, int]] = None
+    ) -> None:
+        # dimensions of the board
+        self.row_count: int = row
+        self.column_count: int = column
+        self.connect: int = connect
+
+        # column of every move
+        self.moves: bytes = bytes(moves)
+        self.result: int = result
+
+        # bitboards of the players after every interval moves
+        if not 1 <= interval <= 255:
+            raise RecordError('the keyframe interval has to be in 1..255')
+        self.interval: int = interval
+        self.geometry: BitBoard = BitBoard(row, column, connect)
+        self.keyframes: list[tuple[int, int]] = keyframes if keyframes is not None else self._build_keyframes()
+
+        # row of every move (computed on demand)
+        self._rows: list[int] | None = None
+
+    @classmethod
+    def from_board(cls, board: Connect4GameBoard, result: int = UNFINISHED, interval: int = KEYFRAME_INTERVAL):
+        """Record the moves on the undo stack of a board."""
+        moves: bytes = bytes(col for _, col in board.history)
+        return cls(board.row_count, board.column_count, board.connect, moves, result, interval)
+
+    def __len__(self) -> int:
+        return len(self.moves)
+
+    @property
+    def board_bytes(self) -> int:
+        """Size of one bitboard in a keyframe."""
+        return (self.column_count * self.geometry.column_height + 7) // 8
+
+    def _build_keyframes(self) -> list[tuple[int, int]]:
+        bitboard = BitBoard(self.row_count, self.column_count, self.connect)
+        keyframes: list[tuple[int, int]] = []
+        for ply, col in enumerate(self.moves, start=1):
+            bitboard.set_cell(bitboard.heights[col], col, (ply - 1) % 2)
+            if ply % self.interval == 0:
+                keyframes.append((bitboard.boards[0], bitboard.boards[1]))
+        return keyframes
+
+    @property
+    def rows(self) -> list[int]:
+        """Row of every move."""
+        if self._rows is None:
+            heights: list[int] = [0] * self.column_count
+            self._rows = []
+            for col in self.moves:
+                self._rows.append(heights[col])
+                heights[col] += 1
+        return self._rows
+
+    ###########
+    # SEEKING #
+    ###########
+    def position_at(self, ply: int) -> tuple[int, int]:
+        """Bitboards of the players after ply moves."""
+        if not 0 <= ply <= len(self.moves):
+            raise IndexError(f'ply {ply} is out of the game (0..{len(self.moves)})')
+
+        keyframe: int = ply // self.interval
+        boards: list[int] = list(self.keyframes[keyframe - 1]) if keyframe else [0, 0]
+        for index in range(keyframe * self.interval, ply):
+            boards[index % 2] |= self.geometry.bit(self.rows[index], self.moves[index])
+        return boards[0], boards[1]
+
+    def load_into(self, board: Connect4GameBoard, ply: int) -> None:
+        """Show the position after ply moves on a board (which shows this game or is empty)."""
+        current: int = len(board.history)
+        players: tuple = (board.PLAYER_ONE, board.PLAYER_TWO)
+
+        # a few steps from the actual position
+        if abs(ply - current) < self.interval:
+            while current > ply:
+                board.pop()
+                current -= 1
+            while current < ply:
+                board.push(self.moves[current], players[current % 2])
+                current += 1
+            return
+
+        # the bitboards from the nearest keyframe, the history and the cells only where they change
+        history: list[tuple[int, int]] = board.history
+        if ply < current:
+            del history[ply:]
+        else:
+            history.extend(zip(self.rows[current:ply], self.moves[current:ply]))
+        board.load_position(self.position_at(ply), history)
+
+    ###############
+    # SERIALIZING #
+    ###############
+    def encode(self) -> bytes:
+        header: bytes = RECORD_HEADER.pack(
+            RECORD_MAGIC, VERSION, self.row_count, self.column_count, self.connect,
+            self.interval, self.result, len(self.moves)
+        )
+        size: int = self.board_bytes
+        keyframes: bytes = b''.join(
+            first.to_bytes(size, 'little') + second.to_bytes(size, 'little') for first, second in self.keyframes
+        )
+        return header + self.moves + keyframes
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview):
+        if len(data) < RECORD_HEADER.size:
+            raise RecordError('the record is too short')
+        magic, version, row, column, connect, interval, result, count = RECORD_HEADER.unpack_from(data, 0)
+        if magic != RECORD_MAGIC or version != VERSION:
+            raise RecordError('the data is not a game record')
+        if interval < 1:
+            raise RecordError('the keyframe interval has to be positive')
+
+        start: int = RECORD_HEADER.size
+        moves: bytes = bytes(data[start:start + count])
+        start += count
+
+        size: int = (column * (row + 1) + 7) // 8
+        keyframes: list[tuple[int, int]] = []
+        for _ in range(count // interval):
+            keyframes.append((
+                int.from_bytes(data[start:start + size], 'little'),
+                int.from_bytes(data[start + size:start + 2 * size], 'little')
+            ))
+            start += 2 * size
+
+        if start != len(data):
+            raise RecordError('the size of the record is wrong')
+        return cls(row, column, connect, moves, result, interval, keyframes)
+
+
+###########
+# ARCHIVE #
+###########
+class ArchiveWriter:
+    """Append records to an archive file, the index is written by close."""
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, 'wb')
+        self.file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, VERSION))
+        self.offsets: list[int] = []
+
+    def add(self, record: GameRecord) -> None:
+        self.offsets.append(self.file.tell())
+        self.file.write(record.encode())
+
+    def close(self) -> None:
+        # the end of the last record closes the index
+        index_offset: int = self.file.tell()
+        for offset in self.offsets + [index_offset]:
+            self.file.write(OFFSET.pack(offset))
+        self.file.write(ARCHIVE_FOOTER.pack(index_offset, len(self.offsets)))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class ArchiveReader:
+    """Random access to the records of an archive."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as file:
+            self.data: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < ARCHIVE_HEADER.size + ARCHIVE_FOOTER.size:
+            raise RecordError(f'{path} is too short')
+        magic, version = ARCHIVE_HEADER.unpack_from(self.data, 0)
+        if magic != ARCHIVE_MAGIC or version != VERSION:
+            raise RecordError(f'{path} is not a game archive')
+
+        self.index_offset, self.count = ARCHIVE_FOOTER.unpack_from(self.data, len(self.data) - ARCHIVE_FOOTER.size)
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> GameRecord:
+        if not 0 <= index < self.count:
+            raise IndexError(f'record {index} is out of the archive (0..{self.count - 1})')
+        start, end = struct.unpack_from('<2Q', self.data, self.index_offset + index * OFFSET.size)
+        return GameRecord.decode(memoryview(self.data)[start:end])
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+
+def load_record(path: str, index: int = 0) -> GameRecord:
+    """One record of an archive (or a single record file)."""
+    with open(path, 'rb') as file:
+        magic: bytes = file.read(4)
+    if magic == RECORD_MAGIC:
+        with open(path, 'rb') as file:
+            return GameRecord.decode(file.read())
+
+    reader = ArchiveReader(path)
+    record: GameRecord = reader[index]
+    reader.close()
+    return record
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    show_parser = commands.add_parser('show', help='step through a game in the terminal')
+    show_parser.add_argument('path')
+    show_parser.add_argument('index', type=int, nargs='?', default=0)
+
+    info_parser = commands.add_parser('info', help='count the games and the results of an archive')
+    info_parser.add_argument('path')
+
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        record: GameRecord = load_record(args.path, args.index)
+        game = Connect4Game(row=record.row_count, column=record.column_count, connect=record.connect)
+        game.replay(record)
+
+    elif args.command == 'info':
+        with ArchiveReader(args.path) as reader:
+            results: dict[int, int] = {}
+            moves: int = 0
+            for record in reader:
+                results[record.result] = results.get(record.result, 0) + 1
+                moves += len(record)
+        print(f'{len(reader)} games, {moves} moves, results {dict(sorted(results.items()))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+#!usr/bin/python
+"""
+Opening book of Connect Four.
+The build command searches every position up to N plies with the engine and writes the
+results into a sorted binary file. The book is read through mmap with binary search, so
+it is shared by all processes which open the same file and nothing is loaded up front.
+The openings of a full board are far too deep for the solver, so the records hold the
+scores of depth-limited searches (--depth, heuristic unless the game is decided) and
+their depth: an Agent searching to a greater depth ignores the book.
+    python OpeningBook.py build book.bin --plies 6 --depth 12 --workers 4
+    python OpeningBook.py probe book.bin 4453
+"""
+import argparse
+import mmap
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Connect4BackEnd import BitBoard
+from ConnectAI import Agent
+
+
+#############
+# CONSTANTS #
+#############
+MAGIC: bytes = b'C4OB'
+VERSION: int = 2
+
+# magic, version, rows, columns, length of a line, plies, search depth, count of records
+HEADER: struct.Struct = struct.Struct('<4sHBBBBBI')
+# key, score, best move, depth
+RECORD: struct.Struct = struct.Struct('<QiBB')
+KEY: struct.Struct = struct.Struct('<Q')
+
+
+class BookError(Exception):
+    """The file is not an opening book of this board."""
+    pass
+
+
+def canonical_key(geometry: BitBoard, current: int, mask: int) -> tuple[int, bool]:
+    """The smaller key of the position and its mirror image, and whether it was the mirror image."""
+    key: int = current + mask + geometry.bottom_mask
+    mirrored: int = geometry.mirror(key)
+    return (mirrored, True) if mirrored < key else (key, False)
+
+
+def enumerate_positions(geometry: BitBoard, plies: int) -> list[tuple[int, int]]:
+    """Every unfinished position (current, mask) up to plies disks, one of each mirror pair."""
+    level: dict[int, tuple[int, int]] = {canonical_key(geometry, 0, 0)[0]: (0, 0)}
+    positions: list[tuple[int, int]] = list(level.values())
+
+    for _ in range(plies):
+        next_level: dict[int, tuple[int, int]] = {}
+        for current, mask in level.values():
+            for col in range(geometry.column_count):
+                move: int = (mask + (1 << (col * geometry.column_height))) & geometry.column_mask(col)
+                # full column or the game is over
+                if not move or geometry.is_winning(current | move):
+                    continue
+
+                # the opponent becomes the player to move
+                child: tuple[int, int] = (current ^ mask, mask | move)
+                next_level.setdefault(canonical_key(geometry, *child)[0], child)
+
+        level = next_level
+        positions.extend(level.values())
+
+    return positions
+
+
+##############
+# GENERATION #
+##############
+_worker_agent: Agent | None = None
+
+
+def _init_worker(row: int, column: int, connect: int, depth: int, time_limit: float | None) -> None:
+    global _worker_agent
+    _worker_agent = Agent(row, column, time_limit=time_limit, max_depth=depth, connect=connect)
+
+
+def _search_position(position: tuple[int, int]) -> tuple[int, int, int, int]:
+    """Search one position, return its canonical key, score, best move (of the canonical position) and depth."""
+    agent: Agent = _worker_agent
+    current, mask = position
+    agent.set_position(current, mask)
+    result = agent.search()
+
+    key, mirrored = canonical_key(agent.geometry, current, mask)
+    move: int = agent.geometry.column_count - 1 - result.move if mirrored else result.move
+    return key, result.score, move, result.depth
+
+
+def build(path: str, row: int, column: int, connect: int, plies: int, depth: int,
+          time_limit: float | None, workers: int) -> int:
+    """Search and write every position up to plies disks, return the count of records."""
+    geometry = BitBoard(row, column, connect)
+    if column * geometry.column_height >= 64:
+        raise BookError('the keys of this board do not fit into 64 bits')
+
+    positions: list[tuple[int, int]] = enumerate_positions(geometry, plies)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(row, column, connect, depth, time_limit)) as pool:
+        records: list[tuple[int, int, int, int]] = list(pool.map(_search_position, positions, chunksize=64))
+
+    # sorted by key for the binary search
+    records.sort()
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, row, column, connect, plies, depth, len(records)))
+        for key, score, move, searched_depth in records:
+            file.write(RECORD.pack(key, score, move, searched_depth))
+
+    return len(records)
+
+
+##########
+# LOOKUP #
+##########
+class OpeningBook:
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+
+        with open(path, 'rb') as file:
+            # zero-copy view of the file (shared by the processes through the page cache)
+            self.data: mmap.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise BookError(f'{path} is too short')
+        magic, version, row, column, connect, plies, depth, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise BookError(f'{path} is not an opening book')
+        if len(self.data) != HEADER.size + count * RECORD.size:
+            raise BookError(f'{path} is truncated')
+
+        self.row_count: int = row
+        self.column_count: int = column
+        self.connect: int = connect
+        self.plies: int = plies
+        self.depth: int = depth
+        self.count: int = count
+
+        self.geometry: BitBoard = BitBoard(row, column, connect)
+
+    def close(self) -> None:
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _find(self, key: int) -> int:
+        """Binary search of a key, return the index of its record or -1."""
+        low: int = 0
+        high: int = self.count
+        while low < high:
+            middle: int = (low + high) // 2
+            middle_key: int = KEY.unpack_from(self.data, HEADER.size + middle * RECORD.size)[0]
+            if middle_key < key:
+                low = middle + 1
+            elif middle_key > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def probe(self, current: int, mask: int) -> tuple[int, int, int] | None:
+        """Return the best move, the score and the depth of the search of a position (or None)."""
+        if mask.bit_count() > self.plies:
+            return None
+
+        key, mirrored = canonical_key(self.geometry, current, mask)
+        index: int = self._find(key)
+        if index == -1:
+            return None
+
+        _, score, move, depth = RECORD.unpack_from(self.data, HEADER.size + index * RECORD.size)
+        if mirrored:
+            move = self.column_count - 1 - move
+        return move, score, depth
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help='search the openings and write the book')
+    build_parser.add_argument('path')
+    build_parser.add_argument('--plies', type=int, default=4)
+    build_parser.add_argument('--depth', type=int, default=12)
+    build_parser.add_argument('--time', type=float, default=None, help='time limit of one position (seconds)')
+    build_parser.add_argument('--rows', type=int, default=6)
+    build_parser.add_argument('--columns', type=int, default=7)
+    build_parser.add_argument('--connect', type=int, default=4)
+    build_parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    probe_parser = commands.add_parser('probe', help='look up a position given by its moves (e.g. 4453)')
+    probe_parser.add_argument('path')
+    probe_parser.add_argument('moves', nargs='?', default='')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start: float = time.perf_counter()
+        count: int = build(args.path, args.rows, args.columns, args.connect, args.plies, args.depth, args.time, args.workers)
+        print(f'{count} positions written to {args.path} in {time.perf_counter() - start:.1f}s')
+
+    elif args.command == 'probe':
+        with OpeningBook(args.path) as book:
+            agent = Agent(book.row_count, book.column_count, connect=book.connect)
+            agent.play_moves(args.moves)
+
+            start: float = time.perf_counter()
+            entry: tuple[int, int, int] | None = book.probe(*agent.position())
+            elapsed: float = time.perf_counter() - start
+
+        if entry is None:
+            print(f'not in the book ({elapsed * 1e6:.1f}us)')
+        else:
+            move, score, depth = entry
+            print(f'move {move + 1} score {score} depth {depth} ({elapsed * 1e6:.1f}us)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+#!usr/bin/python
+"""
+Headless self-play of Connect Four.
+Two policies play each other on worker processes (no display, no input) and the games
+are streamed into a game record file, one JSON object per line (the moves as a list of
+1-based columns), compact binary records or a seekable archive of GameRecords (--archive).
+Binary file: header '<4sBBBB' (magic, version, rows, columns, length of a line), then per
+game '<BBH' (result, starting policy 0 or 1, count of moves) and one byte per move.
+Policies: random, agent:DEPTH or agent:DEPTH:SECONDS (e.g. agent:6).
+    python SelfPlay.py random agent:4 --games 10000 --output games.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from Connect4BackEnd import Connect4GameBoard
+from ConnectAI import Agent
+from GameRecord import KEYFRAME_INTERVAL, ArchiveWriter, GameRecord
+
+
+#############
+# CONSTANTS #
+#############
+# the agents of self-play share the memory of the machine with many processes
+SELF_PLAY_TABLE_BYTES: int = 4 * 1024 * 1024
+
+# games of one task of a worker
+CHUNK_SIZE: int = 250
+
+# chunks submitted to the pool per worker (the rest waits, so the memory does not grow with the games)
+CHUNKS_PER_WORKER: int = 2
+
+# results of a game
+DRAW: int = 0
+
+# binary file: magic, version, rows, columns, length of a line
+BINARY_MAGIC: bytes = b'C4SP'
+BINARY_VERSION: int = 1
+BINARY_FILE_HEADER: struct.Struct = struct.Struct('<4sBBBB')
+# binary record: result, starting policy (0 or 1), count of moves (then one byte per move)
+BINARY_HEADER: struct.Struct = struct.Struct('<BBH')
+
+
+############
+# POLICIES #
+############
+class RandomPolicy:
+    def __init__(self, rng: random.Random) -> None:
+        self.rng: random.Random = rng
+
+    def reset(self, first: bool) -> None:
+        pass
+
+    def update(self, row: int, col: int) -> None:
+        pass
+
+    def choose(self, board: Connect4GameBoard) -> int:
+        return self.rng.choice([col for col in range(board.column_count) if board.search_row(col) != -1])
+
+
+class AgentPolicy:
+    def __init__(self, row: int, column: int, connect: int, depth: int, time_limit: float | None) -> None:
+        self.agent: Agent = Agent(
+            row, column, time_limit=time_limit, max_depth=depth, table_bytes=SELF_PLAY_TABLE_BYTES, connect=connect
+        )
+
+    def reset(self, first: bool) -> None:
+        self.agent.reset()
+        self.agent.first = first
+
+    def update(self, row: int, col: int) -> None:
+        self.agent.update_boards(row, col)
+
+    def choose(self, board: Connect4GameBoard) -> int:
+        return self.agent.search().move
+
+
+def make_policy(spec: str, row: int, column: int, connect: int, rng: random.Random):
+    """Create a policy from its command line name."""
+    name, *params = spec.split(':')
+    if name == 'random':
+        return RandomPolicy(rng)
+    if name == 'agent':
+        depth: int = int(params[0]) if params else 4
+        time_limit: float | None = float(params[1]) if len(params) > 1 else None
+        return AgentPolicy(row, column, connect, depth, time_limit)
+    raise ValueError(f'unknown policy: {spec}')
+
+
+#############
+# SELF-PLAY #
+#############
+def play_game(board: Connect4GameBoard, policies: tuple, rng: random.Random, random_plies: int) -> tuple[bytes, int]:
+    """Play one game, return the columns of the moves and the winner (1, 2 or DRAW)."""
+    board.reset()
+    for index, policy in enumerate(policies):
+        policy.reset(first=index == 0)
+
+    players: tuple[int, int] = (board.PLAYER_ONE, board.PLAYER_TWO)
+    moves: bytearray = bytearray()
+    while board.disks_played < board.disks_limit:
+        turn: int = len(moves) % 2
+
+        # random openings make the games of deterministic policies different
+        if len(moves) < random_plies:
+            col: int = rng.choice([c for c in range(board.column_count) if board.search_row(c) != -1])
+        else:
+            col = policies[turn].choose(board)
+
+        row: int = board.push(col, players[turn])
+        moves.append(col)
+        for policy in policies:
+            policy.update(row, col)
+
+        if board.check_for_winning(row, col, players[turn]):
+            return bytes(moves), players[turn]
+
+    return bytes(moves), DRAW
+
+
+def play_chunk(specs: tuple[str, str], first_game: int, count: int, seed: int,
+               row: int, column: int, connect: int, random_plies: int, swap: bool) -> list[tuple[int, bool, bytes, int]]:
+    """Play a chunk of games in a worker, return (game index, swapped, moves, result) for each."""
+    # a string seed is hashed (sha512): the chunks of different seeds share no games
+    rng = random.Random(f'{seed}:{first_game}')
+    board = Connect4GameBoard(row, column, connect)
+    policies: list = [make_policy(spec, row, column, connect, rng) for spec in specs]
+
+    games: list[tuple[int, bool, bytes, int]] = []
+    for game in range(first_game, first_game + count):
+        # the policies take turns in starting the game
+        swapped: bool = swap and game % 2 == 1
+        order: tuple = (policies[1], policies[0]) if swapped else (policies[0], policies[1])
+        moves, result = play_game(board, order, rng, random_plies)
+        games.append((game, swapped, moves, result))
+    return games
+
+
+##########
+# OUTPUT #
+##########
+class RecordWriter:
+    """Stream games into a JSONL or a binary game record file."""
+
+    def __init__(self, path: str | None, specs: tuple[str, str], binary: bool,
+                 dimensions: tuple[int, int, int], archive: bool = False,
+                 keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+        self.specs: tuple[str, str] = specs
+        self.binary: bool = binary
+
+        # rows, columns and length of a line
+        self.dimensions: tuple[int, int, int] = dimensions
+        self.archive: bool = archive
+        self.keyframe_interval: int = keyframe_interval
+        if archive:
+            self.file = ArchiveWriter(path) if path else None
+        else:
+            self.file = open(path, 'wb' if binary else 'w') if path else None
+            if self.file is not None and binary:
+                self.file.write(BINARY_FILE_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, *dimensions))
+
+    def write(self, game: int, swapped: bool, moves: bytes, result: int) -> None:
+        if self.file is None:
+            return
+        if self.archive:
+            self.file.add(GameRecord(*self.dimensions, moves, result, self.keyframe_interval))
+        elif self.binary:
+            self.file.write(BINARY_HEADER.pack(result, swapped, len(moves)))
+            self.file.write(moves)
+        else:
+            player1, player2 = reversed(self.specs) if swapped else self.specs
+            record: dict = {
+                'game': game,
+                'player1': player1,
+                'player2': player2,
+                # 1-based columns (the notation of the other tools) on every board
+                'moves': [col + 1 for col in moves],
+                'result': result
+            }
+            self.file.write(json.dumps(record) + '\n')
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+
+def read_binary(path: str) -> tuple[tuple[int, int, int], list[tuple[int, bool, bytes]]]:
+    """Rows, columns and length of a line of a binary game record file, and (result, swapped, moves) of its games."""
+    with open(path, 'rb') as file:
+        data: bytes = file.read()
+    if len(data) < BINARY_FILE_HEADER.size:
+        raise ValueError(f'{path} is too short')
+    magic, version, *dimensions = BINARY_FILE_HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError(f'{path} is not a binary self-play file')
+
+    games: list[tuple[int, bool, bytes]] = []
+    offset: int = BINARY_FILE_HEADER.size
+    while offset < len(data):
+        if offset + BINARY_HEADER.size > len(data):
+            raise ValueError(f'{path} is truncated')
+        result, swapped, count = BINARY_HEADER.unpack_from(data, offset)
+        offset += BINARY_HEADER.size
+        if offset + count > len(data):
+            raise ValueError(f'{path} is truncated')
+        games.append((result, bool(swapped), data[offset:offset + count]))
+        offset += count
+    return (dimensions[0], dimensions[1], dimensions[2]), games
+
+
+def run(specs: tuple[str, str], games: int, workers: int, seed: int, row: int, column: int, connect: int,
+        random_plies: int, swap: bool, output: str | None, binary: bool,
+        archive: bool = False, keyframe_interval: int = KEYFRAME_INTERVAL) -> dict[str, int | float]:
+    """Play the games on a process pool and stream them to the output, return the statistics."""
+    # wins of the first and the second policy (not color)
+    stats: dict[str, int | float] = {'games': 0, 'wins_1': 0, 'wins_2': 0, 'draws': 0}
+    writer = RecordWriter(output, specs, binary, (row, column, connect), archive, keyframe_interval)
+
+    start: float = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        chunks = iter(range(0, games, CHUNK_SIZE))
+        pending: set[Future] = set()
+        while True:
+            # keep a bounded window of chunks in the pool, a finished one is dropped once it is written
+            for first in chunks:
+                pending.add(pool.submit(play_chunk, specs, first, min(CHUNK_SIZE, games - first), seed,
+                                        row, column, connect, random_plies, swap))
+                if len(pending) >= workers * CHUNKS_PER_WORKER:
+                    break
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for game, swapped, moves, result in (game for future in done for game in future.result()):
+                writer.write(game, swapped, moves, result)
+
+                stats['games'] += 1
+                if result == DRAW:
+                    stats['draws'] += 1
+                else:
+                    # the winner color back to the policy
+                    stats['wins_1' if (result == 1) != swapped else 'wins_2'] += 1
+
+            elapsed: float = time.perf_counter() - start
+            print(f"\r{stats['games']}/{games} games {stats['games'] / elapsed:.0f} games/s", end='', file=sys.stderr)
+
+    print(file=sys.stderr)
+    writer.close()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['games_per_second'] = stats['games'] / stats['seconds']
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('policy1')
+    parser.add_argument('policy2')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--columns', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=4, help='length of a winning line')
+    parser.add_argument('--random-plies', type=int, default=2, help='random moves at the start of every game')
+    parser.add_argument('--no-swap', action='store_true', help='policy1 always starts')
+    parser.add_argument('--output', help='game record file (.jsonl, or binary with --binary)')
+    parser.add_argument('--binary', action='store_true')
+    parser.add_argument('--archive', action='store_true', help='write a seekable GameRecord archive')
+    parser.add_argument('--keyframe-interval', type=int, default=KEYFRAME_INTERVAL, help='moves between the keyframes of the archive')
+    args = parser.parse_args()
+
+    specs: tuple[str, str] = (args.policy1, args.policy2)
+    stats = run(specs, args.games, args.workers, args.seed, args.rows, args.columns, args.connect,
+                args.random_plies, not args.no_swap, args.output, args.binary, args.archive, args.keyframe_interval)
+
+    games: int = max(stats['games'], 1)
+    print(f"{games} games in {stats['seconds']:.1f}s ({stats['games_per_second']:.1f} games/s)")
+    print(f"{args.policy1} won {stats['wins_1']} ({stats['wins_1'] / games:.1%}), "
+          f"{args.policy2} won {stats['wins_2']} ({stats['wins_2'] / games:.1%}), "
+          f"draws {stats['draws']} ({stats['draws'] / games:.1%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!usr/bin/python3
+"""
+Vectorized collision detection and resolution of a ParticleArrays.
+The broad-phases return the candidate pairs as two index arrays (first < second is not
+guaranteed), resolve_collisions computes the time of impact and the elastic response of
+all overlapping pairs at once with the formulas of ParticleGroup.resolve_collision.
+"""
+import numpy as np
+from dynamic_particles import AABBTree
+
+
+def expand_ranges(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Every (owner, value) with starts[owner] <= value < stops[owner]."""
+    counts: np.ndarray = np.maximum(stops - starts, 0)
+    total: int = int(counts.sum())
+    owners: np.ndarray = np.repeat(np.arange(len(starts)), counts)
+    # position of each value inside the range of its owner
+    offsets: np.ndarray = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, np.repeat(starts, counts) + offsets
+
+
+################
+# BROAD-PHASES #
+################
+def sweep_pairs(pos: np.ndarray, radius: np.ndarray, order: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs of particles whose x-intervals overlap (sort by the left ends, then search the right ends)."""
+    left: np.ndarray = pos[:, 0] - radius
+    if order is None:
+        order = np.argsort(left, kind='stable')
+    sorted_left: np.ndarray = left[order]
+    right: np.ndarray = (pos[:, 0] + radius)[order]
+
+    # the partners start after the particle and end where the left ends pass its right end
+    starts: np.ndarray = np.arange(1, len(order) + 1)
+    stops: np.ndarray = np.searchsorted(sorted_left, right, side='right')
+    owners, others = expand_ranges(starts, stops)
+    return order[owners], order[others]
+
+
+class SweepOrder:
+    """
+    sweep_pairs with the order of the previous step: the particles move only a little, the
+    stable sort (timsort) of the nearly sorted left ends is close to O(n).
+    """
+
+    def __init__(self) -> None:
+        self.order: np.ndarray | None = None
+
+    def __call__(self, pos: np.ndarray, radius: np.ndarray, cell_size: float = None) -> tuple[np.ndarray, np.ndarray]:
+        left: np.ndarray = pos[:, 0] - radius
+        # particles were added
+        if self.order is None or len(self.order) != len(left):
+            self.order = np.argsort(left, kind='stable')
+        else:
+            self.order = self.order[np.argsort(left[self.order], kind='stable')]
+        return sweep_pairs(pos, radius, self.order)
+
+
+def grid_pairs(pos: np.ndarray, radius: np.ndarray, cell_size: float = None) -> tuple[np.ndarray, np.ndarray]:
+    """Pairs of particles in the same or in adjacent cells of a uniform grid (see ParticleGroup.spatial_hash)."""
+    count: int = len(pos)
+    if count == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    # colliding particles have to be in adjacent cells
+    cell_size = max(cell_size or 0.0, 2 * float(radius.max()))
+
+    cells: np.ndarray = np.floor(pos / cell_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    # a free column on both sides, so the neighbours never wrap into the next row
+    width: int = int(cells[:, 0].max()) + 3
+    keys: np.ndarray = (cells[:, 1] + 1) * width + cells[:, 0] + 1
+
+    order: np.ndarray = np.argsort(keys, kind='stable')
+    sorted_keys: np.ndarray = keys[order]
+
+    # pairs within the cell
+    owner_list: list[np.ndarray] = []
+    other_list: list[np.ndarray] = []
+    owners, others = expand_ranges(np.arange(1, count + 1), np.searchsorted(sorted_keys, sorted_keys, side='right'))
+    owner_list.append(owners)
+    other_list.append(others)
+
+    # half of the neighbours, so every pair of cells is visited once
+    for dx, dy in ((1, 0), (1, 1), (0, 1), (-1, 1)):
+        neighbour_keys: np.ndarray = sorted_keys + dx + dy * width
+        owners, others = expand_ranges(
+            np.searchsorted(sorted_keys, neighbour_keys, side='left'),
+            np.searchsorted(sorted_keys, neighbour_keys, side='right')
+        )
+        owner_list.append(owners)
+        other_list.append(others)
+
+    return order[np.concatenate(owner_list)], order[np.concatenate(other_list)]
+
+
+class TreePairs:
+    """The AABBTree of ParticleGroup.aabb_tree on the arrays (the tree itself is not vectorized)."""
+
+    def __init__(self) -> None:
+        self.tree: AABBTree | None = None
+
+    def __call__(self, pos: np.ndarray, radius: np.ndarray, cell_size: float = None) -> tuple[np.ndarray, np.ndarray]:
+        circles: list[list[float]] = np.column_stack((pos, radius)).tolist()
+        # particles were added
+        if self.tree is None or len(self.tree.leaves) != len(circles):
+            self.tree = AABBTree(circles)
+        else:
+            self.tree.update(circles)
+
+        pairs: np.ndarray = np.array(sorted(self.tree.pairs), dtype=np.intp).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1]
+
+
+# the vectorized counterparts of ParticleGroup.BROAD_PHASES (factories of pair finders)
+BROAD_PHASES: dict = {
+    'sweep_and_prune': lambda: lambda pos, radius, cell_size: sweep_pairs(pos, radius),
+    'spatial_hash': lambda: grid_pairs,
+    'incremental_sweep': SweepOrder,
+    'aabb_tree': TreePairs
+}
+
+
+def pair_finder(broad_phase: str):
+    """Callable (pos, radius, cell_size) -> candidate pairs, stateful broad-phases keep their state in it."""
+    return BROAD_PHASES[broad_phase]()
+
+
+def overlapping(pos: np.ndarray, radius: np.ndarray, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Narrow-phase: which candidate pairs collide (see ParticleGroup.is_collision)."""
+    distance: np.ndarray = pos[first] - pos[second]
+    total_radius: np.ndarray = radius[first] + radius[second]
+    return np.einsum('ij,ij->i', distance, distance) <= total_radius * total_radius
+
+
+def connected_components(first: np.ndarray, second: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Particles of the pairs and the component label of each (the smallest position of the
+    component in the particle array), by label propagation with pointer jumping.
+    """
+    particles, inverse = np.unique(np.concatenate((first, second)), return_inverse=True)
+    local_first, local_second = inverse[:len(first)], inverse[len(first):]
+
+    labels: np.ndarray = np.arange(len(particles))
+    while True:
+        lowest: np.ndarray = np.minimum(labels[local_first], labels[local_second])
+        new_labels: np.ndarray = labels.copy()
+        np.minimum.at(new_labels, local_first, lowest)
+        np.minimum.at(new_labels, local_second, lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return particles, labels
+        labels = new_labels
+
+
+##############
+# RESOLUTION #
+##############
+def time_of_impact(distance: np.ndarray, velocity: np.ndarray, total_radius: np.ndarray) -> np.ndarray:
+    """
+    Root of ||distance - t * velocity|| = total_radius for every pair, chosen like
+    ParticleGroup.resolve_collision (0 if there is none).
+    """
+    a: np.ndarray = np.einsum('ij,ij->i', velocity, velocity)
+    b: np.ndarray = 2 * np.einsum('ij,ij->i', distance, velocity)
+    c: np.ndarray = np.einsum('ij,ij->i', distance, distance) - total_radius * total_radius
+
+    bb4ac: np.ndarray = b * b - 4 * a * c
+    solvable: np.ndarray = (a != 0) & (bb4ac >= 0)
+    sqrt_part: np.ndarray = np.sqrt(np.where(solvable, bb4ac, 0))
+    two_a: np.ndarray = 2 * np.where(solvable, a, 1)
+    x1: np.ndarray = (-b + sqrt_part) / two_a
+    x2: np.ndarray = (-b - sqrt_part) / two_a
+    return np.where(solvable, np.where(x1 > 0, x1, x2), 0)
+
+
+def resolve_collisions(arrays, first: np.ndarray, second: np.ndarray, resolved_pairs: list = None) -> int:
+    """
+    Resolve the colliding candidate pairs of a ParticleArrays, return the count of resolved pairs
+    (and append the (first, second) arrays of the pairs of every round to resolved_pairs).
+    A particle takes part in one collision per round: in every round each particle picks its
+    pair with the earliest impact (the largest time of impact, then the lowest indices) and
+    the pairs picked by both particles are resolved together. The other pairs are tested
+    again with the new positions and velocities in the next round, each pair is resolved
+    at most once per step. So the result does not depend on the order of the candidates.
+    """
+    pos: np.ndarray = arrays.pos
+    vel: np.ndarray = arrays.vel_buffer
+    radius: np.ndarray = arrays.radius
+    mass: np.ndarray = arrays.mass
+
+    # the colliding pairs, the smaller index first, sorted and unique (broad-phases may repeat pairs)
+    colliding: np.ndarray = overlapping(pos, radius, first, second) & (first != second)
+    first, second = first[colliding], second[colliding]
+    keys: np.ndarray = np.unique(np.minimum(first, second).astype(np.int64) * len(pos) + np.maximum(first, second))
+    first, second = keys // len(pos), keys % len(pos)
+
+    resolved: int = 0
+    while len(first):
+        # the positions of the pairs of the previous round have changed
+        if resolved:
+            colliding = overlapping(pos, radius, first, second)
+            first, second = first[colliding], second[colliding]
+            if not len(first):
+                break
+
+        vel_a: np.ndarray = vel[first]
+        vel_b: np.ndarray = vel[second]
+        delta_t: np.ndarray = time_of_impact(pos[first] - pos[second], vel_b - vel_a, radius[first] + radius[second])
+
+        # rank of the pairs: the earliest impact first, ties by the indices (the pairs are sorted)
+        rank: np.ndarray = np.empty(len(first), dtype=np.intp)
+        rank[np.argsort(-delta_t, kind='stable')] = np.arange(len(first))
+        best: np.ndarray = np.full(len(pos), len(first), dtype=np.intp)
+        np.minimum.at(best, first, rank)
+        np.minimum.at(best, second, rank)
+        chosen: np.ndarray = (best[first] == rank) & (best[second] == rank)
+
+        a, b, t = first[chosen], second[chosen], delta_t[chosen][:, np.newaxis]
+        vel_a, vel_b = vel_a[chosen], vel_b[chosen]
+
+        # reset position where they were at the time of impact
+        distance_ab: np.ndarray = (pos[a] - vel_a * t) - (pos[b] - vel_b * t)
+        distance_squared: np.ndarray = np.einsum('ij,ij->i', distance_ab, distance_ab)
+        # concentric particles have no normal, they keep their velocities
+        valid: np.ndarray = distance_squared > 0
+        factor: np.ndarray = np.where(
+            valid, np.einsum('ij,ij->i', vel_a - vel_b, distance_ab) / np.where(valid, distance_squared, 1), 0
+        )[:, np.newaxis]
+
+        # https://en.wikipedia.org/wiki/Elastic_collision#Two-dimensional_collision_with_two_moving_objects
+        total_mass: np.ndarray = (mass[a] + mass[b])[:, np.newaxis]
+        new_vel_a: np.ndarray = vel_a - (2 * mass[b][:, np.newaxis] / total_mass) * factor * distance_ab
+        new_vel_b: np.ndarray = vel_b + (2 * mass[a][:, np.newaxis] / total_mass) * factor * distance_ab
+
+        # go forward in time with new velocities to roll back from time of impact
+        vel[a] = new_vel_a
+        vel[b] = new_vel_b
+        pos[a] += new_vel_a * t
+        pos[b] += new_vel_b * t
+
+        resolved += len(a)
+        if resolved_pairs is not None:
+            resolved_pairs.append((a, b))
+        first, second = first[~chosen], second[~chosen]
+
+    return resolved
@@ -1,7 +1,6 @@
 #!usr/bin/python3
 import random
 from random import randint
-from operator import attrgetter
 import math
 import pygame
 from pygame import Vector2, Color, Surface
@@ -160,11 +159,336 @@ class Particle:
         return f'Particle<pos=({self.pos.x}, {self.pos.y}), radius={self.radius}>'
 
 
+class SweepAndPrune:
+    """
+    Persistent sweep and prune on both axes: the ends of the intervals of the particles
+    stay sorted between the steps and are re-sorted by insertion sort, which is nearly
+    O(n) because the particles move only a little per step. Every swap of a start and an
+    end updates the overlapping pairs of the axis, the pairs overlapping on both axes
+    are the candidates of the narrow-phase.
+    """
+
+    def __init__(self, particles: list[Particle]) -> None:
+        # pairs are indices of this list
+        self.particles: list[Particle] = list(particles)
+
+        # [value, is end, particle index] of the interval ends of the x and y axes
+        self.endpoints: list[list[list]] = [
+            [[0.0, is_end, index] for index in range(len(self.particles)) for is_end in (0, 1)] for _ in range(2)
+        ]
+        # overlapping pairs of each axis and of both axes
+        self.overlaps: list[set[tuple[int, int]]] = [set(), set()]
+        self.pairs: set[tuple[int, int]] = set()
+
+        for axis in range(2):
+            self._update_values(axis)
+            # starts before ends at equal values: touching intervals overlap
+            self.endpoints[axis].sort()
+            self._sweep(axis)
+        self.pairs = self.overlaps[0] & self.overlaps[1]
+
+    def _update_values(self, axis: int) -> None:
+        particles: list[Particle] = self.particles
+        for endpoint in self.endpoints[axis]:
+            particle: Particle = particles[endpoint[2]]
+            endpoint[0] = particle.pos[axis] + particle.radius if endpoint[1] else particle.pos[axis] - particle.radius
+
+    def _sweep(self, axis: int) -> None:
+        """Collect the overlapping pairs of a sorted axis from scratch."""
+        active: set[int] = set()
+        overlaps: set[tuple[int, int]] = self.overlaps[axis]
+        for _, is_end, index in self.endpoints[axis]:
+            if is_end:
+                active.discard(index)
+            else:
+                for other in active:
+                    overlaps.add((other, index) if other < index else (index, other))
+                active.add(index)
+
+    def update(self) -> None:
+        """Follow the moved particles."""
+        pairs: set[tuple[int, int]] = self.pairs
+        for axis in range(2):
+            self._update_values(axis)
+            endpoints: list[list] = self.endpoints[axis]
+            overlaps: set[tuple[int, int]] = self.overlaps[axis]
+            other_overlaps: set[tuple[int, int]] = self.overlaps[1 - axis]
+
+            # insertion sort
+            for i in range(1, len(endpoints)):
+                endpoint: list = endpoints[i]
+                value, is_end, index = endpoint
+                j: int = i
+                while j > 0:
+                    previous: list = endpoints[j - 1]
+                    if previous[0] < value or (previous[0] == value and previous[1] <= is_end):
+                        break
+
+                    # a start and an end change places
+                    if previous[1] != is_end:
+                        other: int = previous[2]
+                        pair: tuple[int, int] = (other, index) if other < index else (index, other)
+                        if is_end:
+                            overlaps.discard(pair)
+                            pairs.discard(pair)
+                        else:
+                            overlaps.add(pair)
+                            if pair in other_overlaps:
+                                pairs.add(pair)
+
+                    endpoints[j] = previous
+                    j -= 1
+                endpoints[j] = endpoint
+
+
+class AABBNode:
+    """Node of an AABBTree: a leaf holds one item (particle index), an internal node has two children."""
+    __slots__ = ('x0', 'y0', 'x1', 'y1', 'parent', 'left', 'right', 'item', 'height')
+
+    def __init__(self, item: int = -1) -> None:
+        # the (loose) box
+        self.x0: float = 0.0
+        self.y0: float = 0.0
+        self.x1: float = 0.0
+        self.y1: float = 0.0
+        self.parent: AABBNode | None = None
+        self.left: AABBNode | None = None
+        self.right: AABBNode | None = None
+        self.item: int = item
+        # 0 for the leaves
+        self.height: int = 0
+
+    @property
+    def is_leaf(self) -> bool:
+        return self.left is None
+
+    def perimeter(self) -> float:
+        return 2 * (self.x1 - self.x0 + self.y1 - self.y0)
+
+    def fit(self) -> None:
+        """Box and height of the children."""
+        # conditional expressions, min and max calls are slow in the hot loop
+        left: AABBNode = self.left
+        right: AABBNode = self.right
+        self.x0 = left.x0 if left.x0 < right.x0 else right.x0
+        self.y0 = left.y0 if left.y0 < right.y0 else right.y0
+        self.x1 = left.x1 if left.x1 > right.x1 else right.x1
+        self.y1 = left.y1 if left.y1 > right.y1 else right.y1
+        self.height = 1 + (left.height if left.height > right.height else right.height)
+
+
+class AABBTree:
+    """
+    Dynamic AABB tree (bounding volume hierarchy) of circles, like the dynamic tree of Box2D.
+    The leaves have loose boxes: the box of the circle enlarged by a margin proportional to
+    the radius. A leaf is removed and inserted again only when its circle leaves the loose
+    box, the ancestors are refitted and rebalanced by rotations on the way up. The pairs of
+    overlapping loose boxes are kept between the steps, only the pairs of the reinserted
+    leaves are searched again. Big and small circles share the tree, the cost of a query
+    does not depend on the biggest radius (unlike the cells of the grid or the sweep).
+    """
+
+    def __init__(self, circles: list[tuple[float, float, float]], margin: float = 0.5, min_margin: float = 4.0) -> None:
+        # loose box: margin * radius (at least min_margin) on every side
+        self.margin: float = margin
+        self.min_margin: float = min_margin
+
+        self.root: AABBNode | None = None
+        self.leaves: list[AABBNode] = [AABBNode(item) for item in range(len(circles))]
+        # overlapping pairs of loose boxes (smaller index first) and the partners of every item
+        self.pairs: set[tuple[int, int]] = set()
+        self.partners: list[set[int]] = [set() for _ in circles]
+
+        for leaf, circle in zip(self.leaves, circles):
+            self._loosen(leaf, *circle)
+            self._insert(leaf)
+        for item in range(len(circles)):
+            self._find_pairs(item)
+
+    def _loosen(self, leaf: AABBNode, x: float, y: float, radius: float) -> None:
+        extent: float = radius + max(self.min_margin, self.margin * radius)
+        leaf.x0, leaf.y0, leaf.x1, leaf.y1 = x - extent, y - extent, x + extent, y + extent
+
+    def _insert(self, leaf: AABBNode) -> None:
+        if self.root is None:
+            self.root = leaf
+            leaf.parent = None
+            return
+
+        def combined_perimeter(node: AABBNode) -> float:
+            return 2 * ((node.x1 if node.x1 > x1 else x1) - (node.x0 if node.x0 < x0 else x0)
+                        + (node.y1 if node.y1 > y1 else y1) - (node.y0 if node.y0 < y0 else y0))
+
+        # descend to the cheapest sibling (surface area heuristic with the perimeters)
+        x0, y0, x1, y1 = leaf.x0, leaf.y0, leaf.x1, leaf.y1
+        node: AABBNode = self.root
+        while node.left is not None:
+            combined: float = combined_perimeter(node)
+            # a new parent here, or the growth of this node and a sibling below it
+            cost: float = 2 * combined
+            inheritance: float = 2 * (combined - node.perimeter())
+
+            left: AABBNode = node.left
+            right: AABBNode = node.right
+            left_cost: float = inheritance + combined_perimeter(left) - (0 if left.left is None else left.perimeter())
+            right_cost: float = inheritance + combined_perimeter(right) - (0 if right.left is None else right.perimeter())
+
+            if cost < left_cost and cost < right_cost:
+                break
+            node = left if left_cost < right_cost else right
+
+        # a new parent of the sibling and the leaf
+        sibling: AABBNode = node
+        parent: AABBNode = AABBNode()
+        parent.parent = sibling.parent
+        parent.left = sibling
+        parent.right = leaf
+        if sibling.parent is None:
+            self.root = parent
+        elif sibling.parent.left is sibling:
+            sibling.parent.left = parent
+        else:
+            sibling.parent.right = parent
+        sibling.parent = parent
+        leaf.parent = parent
+        self._refit(parent)
+
+    def _remove(self, leaf: AABBNode) -> None:
+        if leaf is self.root:
+            self.root = None
+            return
+
+        # the sibling takes the place of the parent
+        parent: AABBNode = leaf.parent
+        grandparent: AABBNode | None = parent.parent
+        sibling: AABBNode = parent.right if parent.left is leaf else parent.left
+        sibling.parent = grandparent
+        if grandparent is None:
+            self.root = sibling
+        else:
+            if grandparent.left is parent:
+                grandparent.left = sibling
+            else:
+                grandparent.right = sibling
+            self._refit(grandparent)
+        leaf.parent = None
+
+    def _refit(self, node: AABBNode | None) -> None:
+        """Rebalance and refit the node and its ancestors."""
+        while node is not None:
+            node = self._balance(node)
+            node.fit()
+            node = node.parent
+
+    def _replace_child(self, old: AABBNode, new: AABBNode) -> None:
+        """Put new in the place of old (under the parent of old)."""
+        new.parent = old.parent
+        if new.parent is None:
+            self.root = new
+        elif new.parent.left is old:
+            new.parent.left = new
+        else:
+            new.parent.right = new
+        old.parent = new
+
+    def _balance(self, a: AABBNode) -> AABBNode:
+        """Rotate the higher child of a up if the heights differ by more than 1, return the node in the place of a."""
+        if a.is_leaf or a.height < 2:
+            return a
+
+        b: AABBNode = a.left
+        c: AABBNode = a.right
+        balance: int = c.height - b.height
+        if -1 <= balance <= 1:
+            return a
+
+        # the higher child goes up, a keeps its other child and the lower grandchild
+        if balance > 1:
+            up, kept = c, b
+        else:
+            up, kept = b, c
+        self._replace_child(a, up)
+        high, low = (up.left, up.right) if up.left.height > up.right.height else (up.right, up.left)
+        up.left, up.right = a, high
+        a.left, a.right = kept, low
+        low.parent = a
+        a.fit()
+        up.fit()
+        return up
+
+    def query(self, x0: float, y0: float, x1: float, y1: float) -> list[int]:
+        """Items whose loose boxes overlap the box."""
+        items: list[int] = []
+        stack: list[AABBNode] = [self.root] if self.root is not None else []
+        while stack:
+            node: AABBNode = stack.pop()
+            if node.x1 < x0 or node.x0 > x1 or node.y1 < y0 or node.y0 > y1:
+                continue
+            if node.left is None:
+                items.append(node.item)
+            else:
+                stack.append(node.left)
+                stack.append(node.right)
+        return items
+
+    def _find_pairs(self, item: int) -> None:
+        leaf: AABBNode = self.leaves[item]
+        partners: set[int] = self.partners[item]
+        for other in self.query(leaf.x0, leaf.y0, leaf.x1, leaf.y1):
+            if other != item:
+                self.pairs.add((other, item) if other < item else (item, other))
+                partners.add(other)
+                self.partners[other].add(item)
+
+    def update(self, circles: list[tuple[float, float, float]]) -> None:
+        """Follow the moved circles (the same items as at the construction)."""
+        moved: list[int] = []
+        for leaf, (x, y, radius) in zip(self.leaves, circles):
+            # still inside its loose box
+            if leaf.x0 <= x - radius and x + radius <= leaf.x1 and leaf.y0 <= y - radius and y + radius <= leaf.y1:
+                continue
+            self._remove(leaf)
+            self._loosen(leaf, x, y, radius)
+            self._insert(leaf)
+            moved.append(leaf.item)
+
+        # the pairs of the other leaves did not change
+        for item in moved:
+            for other in self.partners[item]:
+                self.partners[other].discard(item)
+                self.pairs.discard((other, item) if other < item else (item, other))
+            self.partners[item].clear()
+        for item in moved:
+            self._find_pairs(item)
+
+
 class ParticleGroup:
+    # algorithms of the broad-phase collision detection (methods of the group)
+    BROAD_PHASES: tuple[str, ...] = ('sweep_and_prune', 'spatial_hash', 'incremental_sweep', 'aabb_tree')
 
-    def __init__(self) -> None:
+    def __init__(self, broad_phase: str = 'sweep_and_prune', cell_size: float = None) -> None:
         self.particle_list: list[Particle] = []
 
+        if broad_phase not in self.BROAD_PHASES:
+            raise ValueError(f'unknown broad-phase: {broad_phase} (choose from {", ".join(self.BROAD_PHASES)})')
+        self.broad_phase: str = broad_phase
+
+        # edge of the cells of the spatial hash (at least the biggest diameter)
+        self.cell_size: float = cell_size
+
+        # sorted interval ends of the incremental sweep (built at its first step)
+        self._sweep: SweepAndPrune | None = None
+        # bounding volume hierarchy of the aabb tree (built at its first step)
+        self._tree: AABBTree | None = None
+
+        # statistics of the last update: narrow-phase tests and resolved collisions
+        self.pairs_tested: int = 0
+        self.pairs_resolved: int = 0
+
+        # recorder of the steps (see trajectory.TrajectoryRecorder) and the collided pairs of the step for it
+        self.recorder = None
+        self._collided: list[tuple[Particle, Particle]] = []
+
     @property
     def is_empty(self) -> bool:
         """Return if the ParticleGroup is empty."""
@@ -226,8 +550,15 @@ class ParticleGroup:
         a.pos_buffer += a.vel_buffer * delta_t
         b.pos_buffer += b.vel_buffer * delta_t
 
+    def kinetic_energy(self) -> float:
+        """Total kinetic energy (with the velocities after the collisions)."""
+        return sum(0.5 * particle.mass * particle.vel_buffer.magnitude_squared() for particle in self.particle_list)
+
     def update(self, dt: float) -> None:
         """Update all particle in the group."""
+        self.pairs_tested = 0
+        self.pairs_resolved = 0
+
         # update position and velocity
         for particle in self.particle_list:
             particle.update(dt)
@@ -235,7 +566,14 @@ class ParticleGroup:
             particle.handle_walls()
 
         # # optimized collision detection (less collision check)
-        self.sweep_and_prune()
+        getattr(self, self.broad_phase)()
+        self._record(dt)
+
+    def _record(self, dt: float) -> None:
+        """Hand the step to the recorder (if there is one)."""
+        if self.recorder is not None:
+            self.recorder.record_objects(dt, self.particle_list, self._collided)
+            self._collided = []
 
     def draw(self, screen: Surface, draw_vectors: bool = True) -> None:
         """Draw all particle onto a surface."""
@@ -247,29 +585,121 @@ class ParticleGroup:
         if self.is_empty:
             return
 
-        self.particle_list.sort(key=attrgetter('pos.x'))
+        # by the left edges: a particle overlaps the group if it starts before the rightmost edge of
+        # the group (not only the edge of its predecessor, a big particle may reach past small ones)
+        self.particle_list.sort(key=lambda p: p.pos.x - p.radius)
 
         groups: list[list[Particle]] = []
-        last_one: Particle = self.particle_list[0]
-        groups.append([last_one])
+        first: Particle = self.particle_list[0]
+        groups.append([first])
+        right: float = first.pos.x + first.radius
         for particle in self.particle_list[1:]:
-            if last_one.pos.x + last_one.radius >= particle.pos.x - particle.radius:
+            if right >= particle.pos.x - particle.radius:
                 groups[-1].append(particle)
+                right = max(right, particle.pos.x + particle.radius)
             else:
                 groups.append([particle])
-
-            last_one = particle
+                right = particle.pos.x + particle.radius
 
         for group in groups:
             self._bruteforce_collisions(group)
 
+    def incremental_sweep(self) -> None:
+        """Sweep and prune with the sorted order and the overlapping pairs of the previous step."""
+        # nothing to do
+        if self.is_empty:
+            return
+
+        # particles were added
+        if self._sweep is None or len(self._sweep.particles) != len(self.particle_list):
+            self._sweep = SweepAndPrune(self.particle_list)
+        else:
+            self._sweep.update()
+
+        particles: list[Particle] = self._sweep.particles
+        self.pairs_tested += len(self._sweep.pairs)
+        for i, j in sorted(self._sweep.pairs):
+            a: Particle = particles[i]
+            b: Particle = particles[j]
+            if self.is_collision(a, b):
+                self.resolve_collision(a, b)
+                self.pairs_resolved += 1
+                if self.recorder is not None:
+                    self._collided.append((a, b))
+
+    def aabb_tree(self) -> None:
+        """Dynamic AABB tree broad-phase for mixed radii (the loose boxes and their pairs are kept between the steps)."""
+        # nothing to do
+        if self.is_empty:
+            return
+
+        circles: list[tuple[float, float, float]] = [(p.pos.x, p.pos.y, p.radius) for p in self.particle_list]
+        # particles were added
+        if self._tree is None or len(self._tree.leaves) != len(circles):
+            self._tree = AABBTree(circles)
+        else:
+            self._tree.update(circles)
+
+        particles: list[Particle] = self.particle_list
+        self.pairs_tested += len(self._tree.pairs)
+        for i, j in sorted(self._tree.pairs):
+            a: Particle = particles[i]
+            b: Particle = particles[j]
+            if self.is_collision(a, b):
+                self.resolve_collision(a, b)
+                self.pairs_resolved += 1
+                if self.recorder is not None:
+                    self._collided.append((a, b))
+
+    def spatial_hash(self) -> None:
+        """
+        Uniform grid broad-phase: particles are binned by the cell of their center and only
+        the particles of neighbouring cells are tested. With cells not smaller than the
+        biggest diameter, colliding particles are always in the same or in adjacent cells.
+        """
+        # nothing to do
+        if self.is_empty:
+            return
+
+        # colliding particles have to be in adjacent cells
+        cell_size: float = max(self.cell_size or 0.0, 2 * max(particle.radius for particle in self.particle_list))
+
+        cells: dict[tuple[int, int], list[Particle]] = {}
+        for particle in self.particle_list:
+            cell: tuple[int, int] = (int(particle.pos.x // cell_size), int(particle.pos.y // cell_size))
+            cells.setdefault(cell, []).append(particle)
+
+        for (x, y), plist in cells.items():
+            # pairs within the cell
+            self._bruteforce_collisions(plist)
+
+            # half of the neighbours, so every pair of cells is visited once
+            for dx, dy in ((1, 0), (1, 1), (0, 1), (-1, 1)):
+                neighbours: list[Particle] | None = cells.get((x + dx, y + dy))
+                if neighbours is not None:
+                    self._bipartite_collisions(plist, neighbours)
+
+    def _bipartite_collisions(self, plist_a: list[Particle], plist_b: list[Particle]) -> None:
+        self.pairs_tested += len(plist_a) * len(plist_b)
+        for a in plist_a:
+            for b in plist_b:
+                if self.is_collision(a, b):
+                    self.resolve_collision(a, b)
+                    self.pairs_resolved += 1
+                    if self.recorder is not None:
+                        self._collided.append((a, b))
+
     def _bruteforce_collisions(self, plist: list[Particle]) -> None:
+        self.pairs_tested += len(plist) * (len(plist) - 1) // 2
         for i, a in enumerate(plist[:-1]):
             for b in plist[i + 1:]:
                 # check for collision
                 if self.is_collision(a, b):
                     # solve collision
                     self.resolve_collision(a, b)
+                    self.pairs_resolved += 1
+                    if self.recorder is not None:
+                        self._collided.append((a, b))
 
 
 def main() -> None:
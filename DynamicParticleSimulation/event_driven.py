@@ -0,0 +1,306 @@
+#!usr/bin/python3
+"""
+Event-driven (exact time) simulation of the particles.
+Instead of fixed steps and the repair of the overlaps, the time of every future event is
+predicted: two particles touching, a particle reaching a wall or the center of a particle
+leaving its cell. The events wait in a priority queue and the simulation jumps from event
+to event. The cells (at least the biggest diameter) limit the predictions to the
+particles of the neighbouring cells. An event stores the collision counters of its
+particles at the prediction: a particle whose velocity has changed since then makes
+the event stale, it is dropped when it comes up (lazy invalidation).
+The particles move on straight lines between the events, so acceleration is not supported.
+"""
+import heapq
+import itertools
+import math
+from pygame import Vector2
+from dynamic_particles import SCREEN_WIDTH, SCREEN_HEIGHT, Particle, ParticleGroup, PhysicsError
+
+
+#############
+# CONSTANTS #
+#############
+# kinds of the events
+PAIR: int = 0
+WALL: int = 1
+CELL: int = 2
+
+# the neighbouring cells (the own cell too)
+NEIGHBOURS: tuple[tuple[int, int], ...] = tuple(itertools.product((-1, 0, 1), repeat=2))
+
+
+class EventDrivenGroup(ParticleGroup):
+    """
+    ParticleGroup simulated from event to event, update(dt) processes the events of the
+    next dt. The state lives in float lists, the particles are written back after every
+    update (and read again only when particles are added).
+    """
+
+    def __init__(self, cell_size: float = None, width: float = SCREEN_WIDTH, height: float = SCREEN_HEIGHT) -> None:
+        super(EventDrivenGroup, self).__init__('spatial_hash', cell_size)
+        self.width: float = width
+        self.height: float = height
+
+        # simulation time and the count of the processed events
+        self.time: float = 0.0
+        self.events_processed: int = 0
+
+        # position at its own time, velocity, radius and mass of every particle
+        self._x: list[float] = []
+        self._y: list[float] = []
+        self._t: list[float] = []
+        self._vx: list[float] = []
+        self._vy: list[float] = []
+        self._radius: list[float] = []
+        self._mass: list[float] = []
+        # collisions of the particles (the invalidation counters)
+        self._counts: list[int] = []
+
+        # particles of the cells and the cell of every particle
+        self._size: float = 0.0
+        self._cells: dict[tuple[int, int], set[int]] = {}
+        self._cell_of: list[tuple[int, int]] = []
+
+        # (time, sequence, kind, a, b, count of a, count of b), the sequence breaks the ties
+        self._events: list[tuple[float, int, int, int, int, int, int]] = []
+        self._sequence = itertools.count()
+
+    def add(self, p: Particle) -> None:
+        if isinstance(p, Particle):
+            if p.acc != Vector2():
+                raise PhysicsError('the event-driven simulation needs particles without acceleration')
+            self.particle_list.append(p)
+
+    def kinetic_energy(self) -> float:
+        if len(self._counts) != len(self.particle_list):
+            return super(EventDrivenGroup, self).kinetic_energy()
+        return sum(0.5 * m * (vx * vx + vy * vy) for m, vx, vy in zip(self._mass, self._vx, self._vy))
+
+    ###############
+    # PREDICTIONS #
+    ###############
+    def _schedule(self, time: float, kind: int, a: int, b: int = -1) -> None:
+        heapq.heappush(
+            self._events,
+            (time, next(self._sequence), kind, a, b, self._counts[a], self._counts[b] if b >= 0 else 0)
+        )
+
+    def _predict_pair(self, a: int, b: int) -> None:
+        """Schedule the touching of two particles (if they approach each other)."""
+        self.pairs_tested += 1
+        now: float = self.time
+        dx: float = (self._x[b] + self._vx[b] * (now - self._t[b])) - (self._x[a] + self._vx[a] * (now - self._t[a]))
+        dy: float = (self._y[b] + self._vy[b] * (now - self._t[b])) - (self._y[a] + self._vy[a] * (now - self._t[a]))
+        dvx: float = self._vx[b] - self._vx[a]
+        dvy: float = self._vy[b] - self._vy[a]
+
+        dvdr: float = dx * dvx + dy * dvy
+        # moving apart
+        if dvdr >= 0:
+            return
+        total_radius: float = self._radius[a] + self._radius[b]
+        drdr: float = dx * dx + dy * dy - total_radius * total_radius
+        # already overlapping (e.g. placed so): collide now
+        if drdr <= 0:
+            self._schedule(now, PAIR, a, b)
+            return
+
+        dvdv: float = dvx * dvx + dvy * dvy
+        discriminant: float = dvdr * dvdr - dvdv * drdr
+        # they pass each other
+        if discriminant < 0:
+            return
+        # the earlier root of ||d + t * dv|| = total_radius (numerically stable form)
+        self._schedule(now + drdr / (-dvdr + math.sqrt(discriminant)), PAIR, a, b)
+
+    def _gaps(self, a: int, low: tuple[float, float], high: tuple[float, float]) -> tuple[float, float]:
+        """Time until a particle (center) reaches the low or high bound of the x and y axes (inf if it stands)."""
+        now: float = self.time
+        gaps: list[float] = []
+        for position, velocity, axis in (
+                (self._x[a] + self._vx[a] * (now - self._t[a]), self._vx[a], 0),
+                (self._y[a] + self._vy[a] * (now - self._t[a]), self._vy[a], 1)
+        ):
+            if velocity > 0:
+                gaps.append((high[axis] - position) / velocity)
+            elif velocity < 0:
+                gaps.append((low[axis] - position) / velocity)
+            else:
+                gaps.append(math.inf)
+        return gaps[0], gaps[1]
+
+    def _wall_gaps(self, a: int) -> tuple[float, float]:
+        radius: float = self._radius[a]
+        return self._gaps(a, (radius, radius), (self.width - radius, self.height - radius))
+
+    def _cell_gaps(self, a: int) -> tuple[float, float]:
+        cx, cy = self._cell_of[a]
+        size: float = self._size
+        return self._gaps(a, (cx * size, cy * size), ((cx + 1) * size, (cy + 1) * size))
+
+    def _predict_wall(self, a: int) -> None:
+        """Schedule the next wall of a particle."""
+        gap: float = min(self._wall_gaps(a))
+        if gap < math.inf:
+            self._schedule(self.time + max(gap, 0.0), WALL, a)
+
+    def _predict_cell(self, a: int) -> None:
+        """Schedule the center of a particle leaving its cell."""
+        gap: float = min(self._cell_gaps(a))
+        if gap < math.inf:
+            self._schedule(self.time + max(gap, 0.0), CELL, a)
+
+    def _predict(self, a: int) -> None:
+        """Every event of a particle whose velocity has changed."""
+        self._predict_wall(a)
+        self._predict_cell(a)
+        cx, cy = self._cell_of[a]
+        for dx, dy in NEIGHBOURS:
+            for b in self._cells.get((cx + dx, cy + dy), ()):
+                if b != a:
+                    self._predict_pair(a, b)
+
+    def _start(self) -> None:
+        """Read the particles and predict all events."""
+        particles: list[Particle] = self.particle_list
+        self._x = [p.pos.x for p in particles]
+        self._y = [p.pos.y for p in particles]
+        self._t = [self.time] * len(particles)
+        self._vx = [p.vel_buffer.x for p in particles]
+        self._vy = [p.vel_buffer.y for p in particles]
+        self._radius = [p.radius for p in particles]
+        self._mass = [p.mass for p in particles]
+        self._counts = [0] * len(particles)
+
+        # colliding particles have to be in adjacent cells
+        self._size = max(self.cell_size or 0.0, 2 * max(self._radius))
+        self._cells = {}
+        self._cell_of = []
+        for a in range(len(particles)):
+            cell: tuple[int, int] = (math.floor(self._x[a] / self._size), math.floor(self._y[a] / self._size))
+            self._cells.setdefault(cell, set()).add(a)
+            self._cell_of.append(cell)
+
+        self._events = []
+        for a in range(len(particles)):
+            self._predict_wall(a)
+            self._predict_cell(a)
+            cx, cy = self._cell_of[a]
+            # every pair once
+            for dx, dy in NEIGHBOURS:
+                for b in self._cells.get((cx + dx, cy + dy), ()):
+                    if b > a:
+                        self._predict_pair(a, b)
+
+    ##########
+    # EVENTS #
+    ##########
+    def _move(self, a: int) -> None:
+        """Bring the position of a particle to the current time."""
+        elapsed: float = self.time - self._t[a]
+        self._x[a] += self._vx[a] * elapsed
+        self._y[a] += self._vy[a] * elapsed
+        self._t[a] = self.time
+
+    def _collide(self, a: int, b: int) -> None:
+        """Elastic collision of two touching particles (impulse along the line of the centers)."""
+        self._move(a)
+        self._move(b)
+        dx: float = self._x[b] - self._x[a]
+        dy: float = self._y[b] - self._y[a]
+        distance: float = math.hypot(dx, dy)
+        # concentric particles have no normal, they keep their velocities
+        if distance > 0:
+            nx, ny = dx / distance, dy / distance
+            mass_a: float = self._mass[a]
+            mass_b: float = self._mass[b]
+            impulse: float = 2 * mass_a * mass_b / (mass_a + mass_b) * (
+                (self._vx[b] - self._vx[a]) * nx + (self._vy[b] - self._vy[a]) * ny
+            )
+            self._vx[a] += impulse * nx / mass_a
+            self._vy[a] += impulse * ny / mass_a
+            self._vx[b] -= impulse * nx / mass_b
+            self._vy[b] -= impulse * ny / mass_b
+        self._counts[a] += 1
+        self._counts[b] += 1
+
+    def _bounce(self, a: int) -> None:
+        """Reflect a particle from the wall it reached (the axis of the prediction, whatever the rounding)."""
+        x_gap, y_gap = self._wall_gaps(a)
+        self._move(a)
+        if x_gap <= y_gap:
+            self._vx[a] = -self._vx[a]
+        else:
+            self._vy[a] = -self._vy[a]
+        self._counts[a] += 1
+
+    def _cross(self, a: int) -> None:
+        """Move a particle into the next cell and predict with its new neighbours."""
+        # the axis of the prediction (the position is on the border of the cell)
+        x_gap, y_gap = self._cell_gaps(a)
+        self._move(a)
+        cx, cy = self._cell_of[a]
+        if x_gap <= y_gap:
+            step: int = 1 if self._vx[a] > 0 else -1
+            cell: tuple[int, int] = (cx + step, cy)
+            entered: list[tuple[int, int]] = [(cx + 2 * step, cy + dy) for dy in (-1, 0, 1)]
+        else:
+            step = 1 if self._vy[a] > 0 else -1
+            cell = (cx, cy + step)
+            entered = [(cx + dx, cy + 2 * step) for dx in (-1, 0, 1)]
+
+        self._cells[self._cell_of[a]].discard(a)
+        self._cells.setdefault(cell, set()).add(a)
+        self._cell_of[a] = cell
+
+        # the velocity is the same, only the cells of the new row or column are new neighbours
+        self._predict_cell(a)
+        for neighbour in entered:
+            for b in self._cells.get(neighbour, ()):
+                self._predict_pair(a, b)
+
+    def update(self, dt: float) -> None:
+        """Process the events of the next dt and write the particles back."""
+        self.pairs_tested = 0
+        self.pairs_resolved = 0
+
+        # nothing to do
+        if self.is_empty:
+            return
+
+        # particles were added
+        if len(self._counts) != len(self.particle_list):
+            self._start()
+
+        end: float = self.time + dt
+        events: list[tuple[float, int, int, int, int, int, int]] = self._events
+        counts: list[int] = self._counts
+        while events and events[0][0] <= end:
+            time, _, kind, a, b, count_a, count_b = heapq.heappop(events)
+            # a velocity has changed since the prediction
+            if counts[a] != count_a or (b >= 0 and counts[b] != count_b):
+                continue
+
+            self.time = time
+            self.events_processed += 1
+            if kind == PAIR:
+                self._collide(a, b)
+                self.pairs_resolved += 1
+                if self.recorder is not None:
+                    self._collided.append((self.particle_list[a], self.particle_list[b]))
+                self._predict(a)
+                self._predict(b)
+            elif kind == WALL:
+                self._bounce(a)
+                self._predict(a)
+            else:
+                self._cross(a)
+        self.time = end
+
+        for a, p in enumerate(self.particle_list):
+            elapsed: float = end - self._t[a]
+            p.pos = Vector2(self._x[a] + self._vx[a] * elapsed, self._y[a] + self._vy[a] * elapsed)
+            p.vel = Vector2(self._vx[a], self._vy[a])
+            p.pos_buffer = p.pos
+            p.vel_buffer = p.vel
+        self._record(dt)
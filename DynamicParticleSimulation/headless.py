@@ -0,0 +1,277 @@
+#!usr/bin/python3
+"""
+Headless runs of the particle simulation (no window, no event loop).
+The particles are generated from a fixed seed and stepped with a fixed dt, so two runs
+of the same configuration are identical. A run reports the steps per second, the tested
+and resolved collision pairs per step and the drift of the kinetic energy. The bench
+command runs a matrix of particle counts, radius distributions, broad-phases and particle stores.
+Stores: objects (ParticleGroup), views (ArrayParticleGroup with per-pair resolution),
+arrays (ArrayParticleGroup with batched resolution), parallel (ParallelParticleGroup,
+one worker process per CPU, always with the spatial hash) and events (EventDrivenGroup,
+no broad-phase, the tested pairs are the predictions).
+Radius distributions: uniform (the 3:4 range of get_random_radius), log (log-uniform, the
+radii span POLYDISPERSITY) and bimodal (BIG_FRACTION of the particles are POLYDISPERSITY
+times bigger than the others).
+    python headless.py run --particles 2000 --steps 500 --broad-phase spatial_hash --store arrays
+    python headless.py bench --particles 100 1000 10000 --steps 50 --json bench.json
+    python headless.py bench --particles 1000 --distributions uniform log bimodal --stores objects
+    python headless.py render --particles 5000 --store arrays
+    python headless.py run --particles 1000 --steps 10000 --record run.traj (see trajectory.py)
+The render command times the drawing of the particles onto an off-screen surface:
+circles (ParticleGroup.draw), blits and surfarray (SpriteRenderer).
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from pygame import Vector2
+from dynamic_particles import SCREEN_WIDTH, SCREEN_HEIGHT, FPS, Particle, ParticleGroup
+
+
+#############
+# CONSTANTS #
+#############
+STORES: tuple[str, ...] = ('objects', 'views', 'arrays', 'parallel', 'events')
+DISTRIBUTIONS: tuple[str, ...] = ('uniform', 'log', 'bimodal')
+RENDERERS: tuple[str, ...] = ('circles', 'blits', 'surfarray')
+
+# ratio of the biggest and the smallest radius of the log and bimodal distributions
+POLYDISPERSITY: float = 100.0
+# part of the big particles of the bimodal distribution
+BIG_FRACTION: float = 0.01
+
+# part of the screen covered by the particles if the radii are not given
+AREA_FRACTION: float = 0.05
+
+# the energy is measured after every 10th step (outside of the timing)
+ENERGY_INTERVAL: int = 10
+
+
+def default_radius_range(count: int, distribution: str = 'uniform') -> tuple[float, float]:
+    """Radii which cover AREA_FRACTION of the screen (on average)."""
+    if distribution == 'uniform':
+        radius: float = math.sqrt(AREA_FRACTION * SCREEN_WIDTH * SCREEN_HEIGHT / (count * math.pi))
+        return 0.75 * radius, radius
+
+    # mean of the squared radii in units of the smallest radius
+    if distribution == 'log':
+        mean_square: float = (POLYDISPERSITY**2 - 1) / (2 * math.log(POLYDISPERSITY))
+    else:
+        mean_square = 1 - BIG_FRACTION + BIG_FRACTION * POLYDISPERSITY**2
+    radius = math.sqrt(AREA_FRACTION * SCREEN_WIDTH * SCREEN_HEIGHT / (count * math.pi * mean_square))
+    return radius, POLYDISPERSITY * radius
+
+
+def random_radius(rng: random.Random, radius_range: tuple[float, float], distribution: str = 'uniform') -> float:
+    min_radius, max_radius = radius_range
+    if distribution == 'uniform':
+        return rng.uniform(min_radius, max_radius)
+    elif distribution == 'log':
+        return math.exp(rng.uniform(math.log(min_radius), math.log(max_radius)))
+    elif distribution == 'bimodal':
+        return max_radius if rng.random() < BIG_FRACTION else min_radius
+    raise ValueError(f'unknown distribution: {distribution} (choose from {", ".join(DISTRIBUTIONS)})')
+
+
+def make_group(
+        count: int,
+        broad_phase: str = 'spatial_hash',
+        store: str = 'objects',
+        seed: int = 0,
+        radius_range: tuple[float, float] = None,
+        speed: float = 30,
+        distribution: str = 'uniform'
+) -> ParticleGroup:
+    """A group of count random particles, the same particles for the same seed (in every store)."""
+    if store == 'objects':
+        group: ParticleGroup = ParticleGroup(broad_phase)
+    elif store in ('views', 'arrays'):
+        # NumPy is needed only by the array stores
+        from particle_arrays import ArrayParticleGroup
+        group = ArrayParticleGroup(broad_phase, capacity=count, batched=store == 'arrays')
+    elif store == 'parallel':
+        from parallel_particles import ParallelParticleGroup
+        group = ParallelParticleGroup(capacity=count)
+    elif store == 'events':
+        from event_driven import EventDrivenGroup
+        group = EventDrivenGroup()
+    else:
+        raise ValueError(f'unknown store: {store} (choose from {", ".join(STORES)})')
+
+    rng = random.Random(seed)
+    if radius_range is None:
+        radius_range = default_radius_range(count, distribution)
+    for _ in range(count):
+        radius: float = random_radius(rng, radius_range, distribution)
+        group.add(
+            Particle(
+                pos=Vector2(rng.uniform(radius, SCREEN_WIDTH - radius), rng.uniform(radius, SCREEN_HEIGHT - radius)),
+                vel=Vector2(rng.uniform(-speed, speed), rng.uniform(-speed, speed)),
+                acc=Vector2(),
+                radius=radius
+            )
+        )
+    return group
+
+
+def run(group: ParticleGroup, steps: int, dt: float = 1 / FPS, time_limit: float = None) -> dict[str, int | float]:
+    """Step a group, only the updates are timed. A time limit may stop the run early."""
+    energy: float = group.kinetic_energy()
+    max_drift: float = 0.0
+    tested: int = 0
+    resolved: int = 0
+
+    elapsed: float = 0.0
+    done: int = 0
+    while done < steps:
+        start: float = time.perf_counter()
+        group.update(dt)
+        elapsed += time.perf_counter() - start
+
+        done += 1
+        tested += group.pairs_tested
+        resolved += group.pairs_resolved
+
+        if done % ENERGY_INTERVAL == 0 or done == steps:
+            max_drift = max(max_drift, abs(group.kinetic_energy() - energy) / energy if energy else 0.0)
+        if time_limit is not None and elapsed >= time_limit:
+            break
+
+    return {
+        'particles': len(group.particle_list),
+        'steps': done,
+        'seconds': elapsed,
+        'steps_per_second': done / elapsed if elapsed else 0.0,
+        'tested_per_step': tested / done,
+        'resolved_per_step': resolved / done,
+        'energy_drift': (group.kinetic_energy() - energy) / energy if energy else 0.0,
+        'max_energy_drift': max_drift
+    }
+
+
+def bench(counts: list[int], broad_phases: list[str], stores: list[str], steps: int, seed: int,
+          time_limit: float | None, distributions: list[str] = ('uniform',),
+          radius_range: tuple[float, float] = None) -> list[dict]:
+    """Run every combination, slow combinations are cut by the time limit."""
+    results: list[dict] = []
+    print(f"{'particles':>9} {'radii':>8} {'store':>8} {'broad-phase':>17} {'steps/s':>9} {'tested':>10} "
+          f"{'resolved':>9} {'drift':>9}")
+    for count in counts:
+        for distribution in distributions:
+            for store in stores:
+                for broad_phase in broad_phases:
+                    group: ParticleGroup = make_group(count, broad_phase, store, seed, radius_range,
+                                                      distribution=distribution)
+                    stats: dict = run(group, steps, time_limit=time_limit)
+                    if store == 'parallel':
+                        group.close()
+                    stats.update(store=store, broad_phase=broad_phase, distribution=distribution)
+                    results.append(stats)
+                    print(f"{count:>9} {distribution:>8} {store:>8} {broad_phase:>17} {stats['steps_per_second']:>9.1f} "
+                          f"{stats['tested_per_step']:>10.0f} {stats['resolved_per_step']:>9.1f} "
+                          f"{stats['energy_drift']:>+9.2e}" + ('' if stats['steps'] == steps else f" ({stats['steps']} steps)"))
+    return results
+
+
+def render(group: ParticleGroup, frames: int) -> dict[str, float]:
+    """Milliseconds of the drawing of one frame with every renderer (the same frame)."""
+    # NumPy is needed only by the sprite renderer
+    from pygame import Surface
+    from dynamic_particles import BG_COLOR
+    from sprite_renderer import SpriteRenderer
+
+    screen: Surface = Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    renderer: SpriteRenderer = SpriteRenderer()
+    draws: dict = {
+        'circles': lambda: group.draw(screen, False),
+        'blits': lambda: renderer.draw(screen, group),
+        'surfarray': lambda: renderer.draw_surfarray(screen, group)
+    }
+
+    times: dict[str, float] = {}
+    for name in RENDERERS:
+        # the sprites are made by the first frame
+        draws[name]()
+        start: float = time.perf_counter()
+        for _ in range(frames):
+            screen.fill(BG_COLOR)
+            draws[name]()
+        times[name] = 1000 * (time.perf_counter() - start) / frames
+    return times
+
+
+def main() -> None:
+    # no display is needed (and CI boxes have none)
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='step one configuration')
+    run_parser.add_argument('--particles', type=int, default=1000)
+    run_parser.add_argument('--broad-phase', choices=ParticleGroup.BROAD_PHASES, default='spatial_hash')
+    run_parser.add_argument('--store', choices=STORES, default='objects')
+    run_parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform', help='of the radii')
+    run_parser.add_argument('--record', metavar='PATH', help='record the steps into a trajectory file')
+
+    bench_parser = commands.add_parser('bench', help='run a matrix of configurations')
+    bench_parser.add_argument('--particles', type=int, nargs='+', default=[100, 1000, 10000])
+    bench_parser.add_argument('--broad-phases', nargs='+', choices=ParticleGroup.BROAD_PHASES,
+                              default=list(ParticleGroup.BROAD_PHASES))
+    bench_parser.add_argument('--stores', nargs='+', choices=STORES, default=list(STORES[:3]))
+    bench_parser.add_argument('--distributions', nargs='+', choices=DISTRIBUTIONS, default=['uniform'],
+                              help='of the radii')
+    bench_parser.add_argument('--time-limit', type=float, default=10.0, help='seconds of one configuration')
+    bench_parser.add_argument('--json', help='write the results to this file')
+
+    render_parser = commands.add_parser('render', help='time the renderers')
+    render_parser.add_argument('--particles', type=int, default=1000)
+    render_parser.add_argument('--store', choices=STORES, default='objects')
+    render_parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform', help='of the radii')
+    render_parser.add_argument('--frames', type=int, default=100)
+
+    for command_parser in (run_parser, bench_parser, render_parser):
+        command_parser.add_argument('--seed', type=int, default=0)
+        command_parser.add_argument('--radius', type=float, nargs=2, metavar=('MIN', 'MAX'), help='range of the radii')
+    for command_parser in (run_parser, bench_parser):
+        command_parser.add_argument('--steps', type=int, default=200)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        group: ParticleGroup = make_group(args.particles, args.broad_phase, args.store, args.seed, args.radius,
+                                              distribution=args.distribution)
+        if args.record:
+            # NumPy is needed only by the recorder
+            from trajectory import TrajectoryRecorder
+            group.recorder = TrajectoryRecorder(args.record)
+        stats: dict = run(group, args.steps)
+        if group.recorder is not None:
+            group.recorder.close()
+        if args.store == 'parallel':
+            group.close()
+        print(f"{stats['steps']} steps of {stats['particles']} particles in {stats['seconds']:.2f}s "
+              f"({stats['steps_per_second']:.1f} steps/s)")
+        print(f"pairs per step: {stats['tested_per_step']:.0f} tested, {stats['resolved_per_step']:.1f} resolved")
+        print(f"energy drift {stats['energy_drift']:+.3e} (max {stats['max_energy_drift']:.3e})")
+
+    elif args.command == 'bench':
+        results: list[dict] = bench(args.particles, args.broad_phases, args.stores, args.steps, args.seed,
+                                     args.time_limit, args.distributions, args.radius)
+        if args.json:
+            with open(args.json, 'w') as file:
+                json.dump(results, file, indent=2)
+
+    elif args.command == 'render':
+        group = make_group(args.particles, store=args.store, seed=args.seed, radius_range=args.radius,
+                           distribution=args.distribution)
+        for name, milliseconds in render(group, args.frames).items():
+            print(f'{name:>9}: {milliseconds:.2f} ms per frame')
+        if args.store == 'parallel':
+            group.close()
+
+
+if __name__ == '__main__':
+    main()
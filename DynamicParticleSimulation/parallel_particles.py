@@ -0,0 +1,245 @@
+#!usr/bin/python3
+"""
+Multi-process stepping of an ArrayParticleGroup.
+The particles live in shared memory. Every worker integrates a part of the particles,
+then the screen is cut into vertical slabs and every worker finds the collisions of the
+particles of its slab. The particles of the neighbouring slabs closer than the biggest
+diameter (the ghost zone) are read directly from the shared memory.
+The collisions form independent groups (connected components): the groups of only own
+particles are resolved by the worker, the groups reaching into the ghost zone are sent
+back and resolved by the main process. resolve_collisions treats the groups
+independently, so the result is exactly the one of the single process batched path.
+A worker which dies (e.g. an exception) breaks the barrier of the others, update raises
+WorkerError instead of waiting for it forever.
+"""
+import multiprocessing
+import os
+from threading import BrokenBarrierError
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from dynamic_particles import SCREEN_WIDTH, SCREEN_HEIGHT
+from particle_arrays import ArrayParticleGroup, ParticleArrays
+from batch_collisions import connected_components, grid_pairs, overlapping, resolve_collisions
+
+
+#############
+# CONSTANTS #
+#############
+# seconds between the checks of the workers while waiting for their replies
+WORKER_POLL: float = 0.5
+
+
+class WorkerError(Exception):
+    """Basic error class for the death of a worker process."""
+    pass
+
+
+def _attach(names: dict[str, str], count: int) -> tuple[list[SharedMemory], dict[str, np.ndarray]]:
+    """Arrays of FIELDS on the shared memory blocks of the names."""
+    blocks: list[SharedMemory] = []
+    buffers: dict[str, np.ndarray] = {}
+    for field, columns in ParticleArrays.FIELDS.items():
+        block = SharedMemory(name=names[field])
+        blocks.append(block)
+        shape: tuple[int, ...] = (count, columns) if columns > 1 else (count,)
+        buffers[field] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+    return blocks, buffers
+
+
+def _slab_worker(names: dict[str, str], count: int, slab: int, slabs: int, width: float, height: float,
+                 cell_size: float | None, connection, barrier) -> None:
+    """Step loop of one worker, a dt is received for every step (None stops)."""
+    blocks, buffers = _attach(names, count)
+    arrays: ParticleArrays = ParticleArrays.wrap(buffers)
+    # the particles integrated by the worker (any split gives the same result)
+    local: ParticleArrays = ParticleArrays.wrap(
+        {field: buffer[slab * count // slabs:(slab + 1) * count // slabs] for field, buffer in buffers.items()}
+    )
+    slab_width: float = width / slabs
+
+    try:
+        while (dt := connection.recv()) is not None:
+            local.update(dt)
+            local.handle_walls(width, height)
+            barrier.wait()
+
+            pos: np.ndarray = arrays.pos
+            radius: np.ndarray = arrays.radius
+            owner: np.ndarray = np.clip((pos[:, 0] // slab_width).astype(np.intp), 0, slabs - 1)
+            owned: np.ndarray = owner == slab
+
+            # own particles and the ghosts: a colliding pair is at most one diameter away in x
+            ghost: float = 2 * float(radius.max())
+            view: np.ndarray = np.nonzero(owned | (
+                (pos[:, 0] >= slab * slab_width - ghost) & (pos[:, 0] < (slab + 1) * slab_width + ghost)
+            ))[0]
+            first, second = grid_pairs(pos[view], radius[view], cell_size)
+            tested: int = len(first)
+            first, second = view[first], view[second]
+            colliding: np.ndarray = overlapping(pos, radius, first, second) & (owned[first] | owned[second])
+            first, second = first[colliding], second[colliding]
+
+            # groups with a ghost are resolved by the main process
+            particles, labels = connected_components(first, second)
+            shared: np.ndarray = np.zeros(len(particles), dtype=bool)
+            np.logical_or.at(shared, labels, ~owned[particles])
+            boundary: np.ndarray = shared[labels[np.searchsorted(particles, first)]]
+
+            # nobody writes before every worker has read the positions
+            barrier.wait()
+            resolved_pairs: list[tuple[np.ndarray, np.ndarray]] = []
+            resolved: int = resolve_collisions(arrays, first[~boundary], second[~boundary], resolved_pairs)
+            connection.send((tested, resolved, first[boundary], second[boundary], resolved_pairs))
+    except BrokenBarrierError:
+        # another worker died, the main process reports it
+        pass
+    except BaseException:
+        # the other workers and the main process do not wait for this one
+        barrier.abort()
+        raise
+    finally:
+        for block in blocks:
+            block.close()
+
+
+class ParallelParticleGroup(ArrayParticleGroup):
+    """Batched ArrayParticleGroup stepped by worker processes (one slab of the screen each)."""
+
+    def __init__(self, workers: int = None, cell_size: float = None, capacity: int = 1024,
+                 width: float = SCREEN_WIDTH, height: float = SCREEN_HEIGHT) -> None:
+        super(ParallelParticleGroup, self).__init__('spatial_hash', cell_size, capacity, batched=True)
+        self.workers: int = workers or os.cpu_count() or 1
+        self.width: float = width
+        self.height: float = height
+
+        self._blocks: list[SharedMemory] = []
+        self._processes: list[multiprocessing.Process] = []
+        self._connections: list = []
+        self._barrier = None
+        # count of the particles in the shared memory
+        self._shared_count: int = 0
+
+    def _start(self) -> None:
+        """Move the particles into shared memory and start the workers."""
+        count: int = self.arrays.count
+        names: dict[str, str] = {}
+        buffers: dict[str, np.ndarray] = {}
+        for field, columns in ParticleArrays.FIELDS.items():
+            shape: tuple[int, ...] = (count, columns) if columns > 1 else (count,)
+            block = SharedMemory(create=True, size=max(1, 8 * count * columns))
+            self._blocks.append(block)
+            names[field] = block.name
+            buffers[field] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        self.arrays.use_buffers(buffers)
+        self._shared_count = count
+
+        barrier = self._barrier = multiprocessing.Barrier(self.workers)
+        for slab in range(self.workers):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_slab_worker,
+                args=(names, count, slab, self.workers, self.width, self.height, self.cell_size, worker_connection, barrier),
+                daemon=True
+            )
+            process.start()
+            # only the worker holds its end: recv raises EOFError when the worker dies
+            worker_connection.close()
+            self._processes.append(process)
+            self._connections.append(connection)
+
+    def _stop_workers(self) -> None:
+        """Stop the workers, the dead or stuck ones too."""
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+        for process in self._processes:
+            process.join(WORKER_POLL)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        for connection in self._connections:
+            connection.close()
+        self._processes = []
+        self._connections = []
+        self._barrier = None
+
+    def _receive(self, connection):
+        """The reply of a worker, WorkerError if a worker has died."""
+        while True:
+            # a closed pipe is readable too (EOFError)
+            if connection.poll(WORKER_POLL):
+                try:
+                    return connection.recv()
+                except EOFError:
+                    break
+            if not all(process.is_alive() for process in self._processes):
+                break
+        self._fail()
+
+    def _fail(self) -> None:
+        """Stop the workers after the death of one of them and raise WorkerError."""
+        # the others may wait at the barrier for the dead one
+        self._barrier.abort()
+        codes: list = [process.exitcode for process in self._processes]
+        self._stop_workers()
+        raise WorkerError(f'a worker process died (exit codes {codes})')
+
+    def close(self) -> None:
+        """Stop the workers and take the particles back from the shared memory."""
+        self._stop_workers()
+
+        if self._blocks:
+            self.arrays.use_buffers({
+                field: np.zeros((self.arrays.count, columns) if columns > 1 else (self.arrays.count,))
+                for field, columns in ParticleArrays.FIELDS.items()
+            })
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def update(self, dt: float) -> None:
+        """Update all particle in the group."""
+        # nothing to do
+        if self.is_empty:
+            return
+
+        # particles were added since the start of the workers
+        if self.arrays.count != self._shared_count or not self._processes:
+            self.close()
+            self._start()
+
+        try:
+            for connection in self._connections:
+                connection.send(dt)
+        except OSError:
+            self._fail()
+
+        self.pairs_tested = 0
+        self.pairs_resolved = 0
+        boundary_first: list[np.ndarray] = []
+        boundary_second: list[np.ndarray] = []
+        for connection in self._connections:
+            tested, resolved, first, second, resolved_pairs = self._receive(connection)
+            self.pairs_tested += tested
+            self.pairs_resolved += resolved
+            if self.recorder is not None:
+                self._collided.extend(resolved_pairs)
+            boundary_first.append(first)
+            boundary_second.append(second)
+
+        # the groups on the slab boundaries (the neighbours report them twice)
+        self.pairs_resolved += resolve_collisions(
+            self.arrays, np.concatenate(boundary_first), np.concatenate(boundary_second),
+            self._collided if self.recorder is not None else None
+        )
+        self._record(dt)
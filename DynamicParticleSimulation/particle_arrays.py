@@ -0,0 +1,265 @@
+#!usr/bin/python3
+"""
+Structure of arrays storage of particles.
+Positions, velocities, accelerations, radii and masses of all particles live in contiguous
+float64 NumPy arrays, so integration and wall reflection are a few vectorized operations
+over the whole set instead of a Python call per particle. ParticleView is a thin
+Particle-like handle of one row of the arrays for the code written against Particle.
+"""
+import math
+import numpy as np
+from pygame import Vector2, Color, Surface
+from dynamic_particles import SCREEN_WIDTH, SCREEN_HEIGHT, Particle, ParticleGroup, PhysicsError
+from batch_collisions import pair_finder, resolve_collisions
+
+
+class ParticleArrays:
+    # the float64 arrays and the count of their columns (1 is a flat array)
+    FIELDS: dict[str, int] = {'pos': 2, 'vel': 2, 'acc': 2, 'vel_buffer': 2, 'radius': 1, 'mass': 1}
+
+    def __init__(self, capacity: int = 1024) -> None:
+        # count of the used rows
+        self.count: int = 0
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity: int) -> None:
+        """(Re)allocate the arrays with a new capacity and keep the used rows."""
+        def grow(old: np.ndarray | None, shape: tuple[int, ...]) -> np.ndarray:
+            new: np.ndarray = np.zeros(shape, dtype=np.float64)
+            if old is not None:
+                new[:self.count] = old[:self.count]
+            return new
+
+        self.capacity: int = capacity
+        self._pos: np.ndarray = grow(getattr(self, '_pos', None), (capacity, 2))
+        self._vel: np.ndarray = grow(getattr(self, '_vel', None), (capacity, 2))
+        self._acc: np.ndarray = grow(getattr(self, '_acc', None), (capacity, 2))
+        # velocity after the collisions of the last step (see Particle.vel_buffer)
+        self._vel_buffer: np.ndarray = grow(getattr(self, '_vel_buffer', None), (capacity, 2))
+        self._radius: np.ndarray = grow(getattr(self, '_radius', None), (capacity,))
+        self._mass: np.ndarray = grow(getattr(self, '_mass', None), (capacity,))
+        if not hasattr(self, 'colors'):
+            self.colors: list[Color] = []
+
+    @classmethod
+    def wrap(cls, buffers: dict[str, np.ndarray], colors: list[Color] = None):
+        """Arrays on existing buffers of FIELDS (e.g. slices of shared memory), nothing is copied."""
+        arrays = cls.__new__(cls)
+        arrays.count = arrays.capacity = len(buffers['pos'])
+        for name, buffer in buffers.items():
+            setattr(arrays, '_' + name, buffer)
+        arrays.colors = colors if colors is not None else []
+        return arrays
+
+    def use_buffers(self, buffers: dict[str, np.ndarray]) -> None:
+        """Move the particles into other buffers of FIELDS (e.g. shared memory), the views stay valid."""
+        for name, buffer in buffers.items():
+            buffer[:self.count] = getattr(self, '_' + name)[:self.count]
+            setattr(self, '_' + name, buffer)
+        self.capacity = min(len(buffer) for buffer in buffers.values())
+
+    # views of the used rows (no copies)
+    @property
+    def pos(self) -> np.ndarray:
+        return self._pos[:self.count]
+
+    @property
+    def vel(self) -> np.ndarray:
+        return self._vel[:self.count]
+
+    @property
+    def acc(self) -> np.ndarray:
+        return self._acc[:self.count]
+
+    @property
+    def vel_buffer(self) -> np.ndarray:
+        return self._vel_buffer[:self.count]
+
+    @property
+    def radius(self) -> np.ndarray:
+        return self._radius[:self.count]
+
+    @property
+    def mass(self) -> np.ndarray:
+        return self._mass[:self.count]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(
+            self,
+            pos: Vector2,
+            vel: Vector2,
+            acc: Vector2,
+            radius: float,
+            mass: float = None,
+            color: Color = None
+    ) -> int:
+        """Append a particle, return its index."""
+        if mass == 0 or radius == 0:
+            raise PhysicsError('mass and radius have to be not zero')
+
+        if self.count == self.capacity:
+            self._allocate(2 * self.capacity)
+
+        index: int = self.count
+        self._pos[index] = pos
+        self._vel[index] = vel
+        self._vel_buffer[index] = vel
+        self._acc[index] = acc
+        self._radius[index] = radius
+        self._mass[index] = mass if mass is not None else radius**2 * math.pi
+        self.colors.append(color if color is not None else Color('darkgreen'))
+
+        self.count += 1
+        return index
+
+    def update(self, dt: float) -> None:
+        """Semi-implicit Euler step of every particle (same order as Particle.update)."""
+        vel: np.ndarray = self.vel
+        # resolve buffers
+        vel[:] = self.vel_buffer
+
+        vel += self.acc * dt
+        self.pos[:] += vel * dt
+
+    def handle_walls(self, width: float = SCREEN_WIDTH, height: float = SCREEN_HEIGHT) -> None:
+        """Reflect the particles from the 4 static walls (same rules as Particle.handle_walls)."""
+        pos: np.ndarray = self.pos
+        vel: np.ndarray = self.vel
+        radius: np.ndarray = self.radius
+
+        def correct_clipping(clipped: np.ndarray, border: np.ndarray, axis: int) -> None:
+            coordinate: np.ndarray = pos[:, axis]
+            coordinate[clipped] += 2 * (border[clipped] - coordinate[clipped])
+            vel[clipped, axis] *= -1
+
+        for axis, size in ((0, width), (1, height)):
+            # the far wall, then the near wall (minimums are the radii)
+            border: np.ndarray = size - radius
+            correct_clipping(pos[:, axis] >= border, border, axis)
+            correct_clipping(pos[:, axis] <= radius, radius, axis)
+
+        # the reflections are part of the resolved velocity
+        self.vel_buffer[:] = vel
+
+    def kinetic_energy(self) -> float:
+        return float(0.5 * np.sum(self.mass * np.einsum('ij,ij->i', self.vel_buffer, self.vel_buffer)))
+
+
+class ParticleView:
+    """
+    Particle-like handle of one particle of a ParticleArrays.
+    The vector attributes are Vector2 copies, assigning them writes into the arrays.
+    """
+
+    def __init__(self, arrays: ParticleArrays, index: int) -> None:
+        self.arrays: ParticleArrays = arrays
+        self.index: int = index
+
+    @property
+    def pos(self) -> Vector2:
+        return Vector2(*self.arrays.pos[self.index])
+
+    @pos.setter
+    def pos(self, value: Vector2) -> None:
+        self.arrays.pos[self.index] = value
+
+    # the position is updated in place by the collisions
+    pos_buffer = pos
+
+    @property
+    def vel(self) -> Vector2:
+        return Vector2(*self.arrays.vel[self.index])
+
+    @vel.setter
+    def vel(self, value: Vector2) -> None:
+        self.arrays.vel[self.index] = value
+
+    @property
+    def vel_buffer(self) -> Vector2:
+        return Vector2(*self.arrays.vel_buffer[self.index])
+
+    @vel_buffer.setter
+    def vel_buffer(self, value: Vector2) -> None:
+        self.arrays.vel_buffer[self.index] = value
+
+    @property
+    def acc(self) -> Vector2:
+        return Vector2(*self.arrays.acc[self.index])
+
+    @acc.setter
+    def acc(self, value: Vector2) -> None:
+        self.arrays.acc[self.index] = value
+
+    @property
+    def radius(self) -> float:
+        return float(self.arrays.radius[self.index])
+
+    @property
+    def mass(self) -> float:
+        return float(self.arrays.mass[self.index])
+
+    @property
+    def color(self) -> Color:
+        return self.arrays.colors[self.index]
+
+    def draw(self, screen: Surface, draw_vectors: bool = False) -> None:
+        Particle.draw(self, screen, draw_vectors)
+
+    def __str__(self):
+        return Particle.__str__(self)
+
+
+class ArrayParticleGroup(ParticleGroup):
+    """
+    ParticleGroup on a ParticleArrays: integration and walls are vectorized. Batched groups
+    find and resolve the collisions on the arrays too (see batch_collisions), otherwise
+    the broad-phase and the collisions work on the views of the particles.
+    """
+
+    def __init__(self, broad_phase: str = 'sweep_and_prune', cell_size: float = None, capacity: int = 1024,
+                 batched: bool = True) -> None:
+        super(ArrayParticleGroup, self).__init__(broad_phase, cell_size)
+        self.arrays: ParticleArrays = ParticleArrays(capacity)
+        self.batched: bool = batched
+        self.find_pairs = pair_finder(broad_phase)
+
+    def add(self, p: Particle) -> None:
+        """Copy a particle into the arrays (the particle itself is not used later)."""
+        if isinstance(p, Particle):
+            index: int = self.arrays.add(p.pos, p.vel_buffer, p.acc, p.radius, p.mass, p.color)
+            self.particle_list.append(ParticleView(self.arrays, index))
+
+    def kinetic_energy(self) -> float:
+        return self.arrays.kinetic_energy()
+
+    def update(self, dt: float) -> None:
+        """Update all particle in the group."""
+        self.pairs_tested = 0
+        self.pairs_resolved = 0
+
+        self.arrays.update(dt)
+        self.arrays.handle_walls()
+
+        if self.batched:
+            first, second = self.find_pairs(self.arrays.pos, self.arrays.radius, self.cell_size)
+            self.pairs_tested = len(first)
+            self.pairs_resolved = resolve_collisions(
+                self.arrays, first, second, self._collided if self.recorder is not None else None
+            )
+        else:
+            getattr(self, self.broad_phase)()
+        self._record(dt)
+
+    def _record(self, dt: float) -> None:
+        """Hand the step to the recorder, the collided pairs are (first, second) arrays or pairs of views."""
+        if self.recorder is not None:
+            pairs: list[tuple[np.ndarray, np.ndarray]] = [
+                (np.array([pair[0].index]), np.array([pair[1].index])) if isinstance(pair[0], ParticleView) else pair
+                for pair in self._collided
+            ]
+            first: np.ndarray = np.concatenate([pair[0] for pair in pairs]) if pairs else np.empty(0, dtype=np.intp)
+            second: np.ndarray = np.concatenate([pair[1] for pair in pairs]) if pairs else np.empty(0, dtype=np.intp)
+            self.recorder.record_arrays(dt, self.arrays.pos, self.arrays.vel_buffer, first, second)
+            self._collided = []
@@ -0,0 +1,170 @@
+#!usr/bin/python3
+"""
+Real-time window with decoupled simulation and rendering.
+A worker thread advances the physics with a fixed dt, driven by an accumulator of the
+elapsed wall time (at most MAX_LAG seconds are caught up, a slower simulation runs slower
+instead of piling up steps). After its steps it publishes a snapshot of the particles,
+the last two snapshots form a double buffer. The main thread handles the events and
+draws at the display rate (pygame.time.Clock): the particles are interpolated between
+the two snapshots, so the motion is smooth at any ratio of the two rates (one physics
+step behind). A heavy simulation does not block the window, a light one sleeps between
+its steps and frames.
+    python realtime.py --particles 2000 --store arrays --radius 3 6
+Keys: a pauses the simulation, v toggles the vectors, escape quits.
+"""
+import argparse
+import sys
+import threading
+import time
+import numpy as np
+import pygame
+from pygame import Surface
+from dynamic_particles import SCREEN_WIDTH, SCREEN_HEIGHT, BG_COLOR, FPS, ParticleGroup
+from headless import STORES, DISTRIBUTIONS, make_group
+from sprite_renderer import SpriteRenderer, particle_state
+
+
+#############
+# CONSTANTS #
+#############
+DISPLAY_FPS: int = 60
+
+# seconds of the simulation caught up at once (no spiral of death)
+MAX_LAG: float = 0.25
+
+
+class Snapshot:
+    """Copy of the drawn state of the particles and the wall time it belongs to."""
+
+    def __init__(self, group: ParticleGroup, time_stamp: float) -> None:
+        self.pos, self.radius, self.colors, self.vel, self.acc = particle_state(group)
+        self.time_stamp: float = time_stamp
+
+
+class SimulationThread(threading.Thread):
+    """Fixed step simulation of a group, the render loop reads its snapshots."""
+
+    def __init__(self, group: ParticleGroup, dt: float = 1 / FPS, max_lag: float = MAX_LAG) -> None:
+        super(SimulationThread, self).__init__(daemon=True)
+        self.group: ParticleGroup = group
+        self.dt: float = dt
+        self.max_lag: float = max_lag
+
+        self.paused: bool = False
+        self.steps: int = 0
+        # simulated seconds skipped because the simulation could not keep up
+        self.dropped: float = 0.0
+
+        # the previous and the current snapshot, swapped together
+        self._lock: threading.Lock = threading.Lock()
+        snapshot: Snapshot = Snapshot(group, time.perf_counter())
+        self._snapshots: tuple[Snapshot, Snapshot] = (snapshot, snapshot)
+        self._stop_event: threading.Event = threading.Event()
+
+    def snapshots(self) -> tuple[Snapshot, Snapshot]:
+        with self._lock:
+            return self._snapshots
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def run(self) -> None:
+        accumulator: float = 0.0
+        last: float = time.perf_counter()
+        while not self._stop_event.is_set():
+            now: float = time.perf_counter()
+            accumulator += now - last
+            last = now
+
+            if self.paused:
+                accumulator = 0.0
+            elif accumulator > self.max_lag:
+                self.dropped += accumulator - self.max_lag
+                accumulator = self.max_lag
+
+            steps: int = int(accumulator // self.dt)
+            for step in range(steps):
+                self.group.update(self.dt)
+                self.steps += 1
+                accumulator -= self.dt
+                # only the last two states can be drawn
+                if step >= steps - 2:
+                    snapshot: Snapshot = Snapshot(self.group, now - accumulator)
+                    with self._lock:
+                        self._snapshots = (self._snapshots[1], snapshot)
+
+            # sleep until the next step is due
+            self._stop_event.wait(self.dt - accumulator)
+
+
+def interpolate(previous: Snapshot, current: Snapshot, alpha: float) -> np.ndarray:
+    """Positions between two snapshots (the current ones if particles were added)."""
+    if len(previous.pos) != len(current.pos):
+        return current.pos
+    return previous.pos + alpha * (current.pos - previous.pos)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--particles', type=int, default=200)
+    parser.add_argument('--broad-phase', choices=ParticleGroup.BROAD_PHASES, default='spatial_hash')
+    parser.add_argument('--store', choices=STORES, default='objects')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, default='uniform', help='of the radii')
+    parser.add_argument('--radius', type=float, nargs=2, metavar=('MIN', 'MAX'), help='range of the radii')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--physics-rate', type=int, default=FPS, help='steps per second')
+    parser.add_argument('--display-rate', type=int, default=DISPLAY_FPS, help='frames per second')
+    args = parser.parse_args()
+
+    # init pygame graphics
+    pygame.init()
+    screen: Surface = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    clock = pygame.time.Clock()
+
+    group: ParticleGroup = make_group(args.particles, args.broad_phase, args.store, args.seed, args.radius,
+                                      distribution=args.distribution)
+    simulation: SimulationThread = SimulationThread(group, 1 / args.physics_rate)
+    renderer: SpriteRenderer = SpriteRenderer()
+    simulation.start()
+
+    draw_vectors: bool = False
+    frames: int = 0
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                simulation.stop()
+                if args.store == 'parallel':
+                    group.close()
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_a:
+                    # toggle simulation
+                    simulation.paused = not simulation.paused
+                elif event.key == pygame.K_v:
+                    # toggle drawing vectors
+                    draw_vectors = not draw_vectors
+
+        # one physics step behind: between the previous and the current snapshot
+        previous, current = simulation.snapshots()
+        alpha: float = min(max((time.perf_counter() - current.time_stamp) / simulation.dt, 0.0), 1.0)
+        pos: np.ndarray = interpolate(previous, current, alpha)
+
+        screen.fill(BG_COLOR)
+        renderer.blit_particles(screen, pos, current.radius, current.colors)
+        if draw_vectors:
+            renderer.draw_vectors(screen, pos, current.vel, current.acc)
+        pygame.display.flip()
+
+        clock.tick(args.display_rate)
+        frames += 1
+        if frames % args.display_rate == 0:
+            pygame.display.set_caption(
+                f'Kinetic Gas - {clock.get_fps():.0f} fps - {simulation.steps} steps'
+                + (f' - {simulation.dropped:.1f}s behind' if simulation.dropped else '')
+            )
+
+
+if __name__ == '__main__':
+    sys.exit(main())
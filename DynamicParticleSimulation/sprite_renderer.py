@@ -0,0 +1,165 @@
+#!usr/bin/python3
+"""
+Batched drawing of a ParticleGroup.
+pygame.draw.circle truncates the center and the radius to integers, so a circle is the
+same set of pixels for every particle with the same radius and color. SpriteRenderer
+draws each of these circles once into a sprite and submits a whole frame with one
+Surface.blits call. draw_surfarray writes the pixels of the same sprites directly into
+a surfarray view of the screen with NumPy (overlapping particles may stack in another
+order than with the blits).
+"""
+from operator import attrgetter
+import numpy as np
+import pygame
+from pygame import Color, Surface
+from dynamic_particles import ParticleGroup
+
+
+def particle_state(group: ParticleGroup, vectors: bool = True) -> tuple[np.ndarray, np.ndarray, list[Color], np.ndarray | None, np.ndarray | None]:
+    """
+    Copies of the positions, radii and colors of the particles of a group (objects or
+    arrays), and of the velocities and accelerations if the vectors are needed.
+    """
+    arrays = getattr(group, 'arrays', None)
+    if arrays is not None:
+        return (
+            arrays.pos.copy(), arrays.radius.copy(), list(arrays.colors),
+            arrays.vel.copy() if vectors else None, arrays.acc.copy() if vectors else None
+        )
+
+    # fromiter and map are the fastest ways out of the Vector2s and the attributes
+    particles: list = group.particle_list
+
+    def vector_array(name: str) -> np.ndarray:
+        return np.fromiter(
+            (coordinate for vector in map(attrgetter(name), particles) for coordinate in vector),
+            dtype=np.float64, count=2 * len(particles)
+        ).reshape(-1, 2)
+
+    return (
+        vector_array('pos'),
+        np.fromiter(map(attrgetter('radius'), particles), dtype=np.float64, count=len(particles)),
+        list(map(attrgetter('color'), particles)),
+        vector_array('vel') if vectors else None,
+        vector_array('acc') if vectors else None
+    )
+
+
+class SpriteRenderer:
+    def __init__(self) -> None:
+        # circle sprites and the pixel offsets of their circles by (radius, color as RGBA integer)
+        self.sprites: dict[tuple[int, int], Surface] = {}
+        self.offsets: dict[tuple[int, int], np.ndarray] = {}
+
+    def sprite(self, radius: int, color: Color) -> Surface:
+        """The circle of pygame.draw.circle at (radius, radius), the rest is transparent (colorkey)."""
+        key: tuple[int, int] = (radius, int(color))
+        sprite: Surface | None = self.sprites.get(key)
+        if sprite is None:
+            sprite = Surface((2 * radius, 2 * radius))
+            # the inverse color is never the color of the circle
+            background: Color = Color(255 - color.r, 255 - color.g, 255 - color.b)
+            sprite.fill(background)
+            pygame.draw.circle(sprite, color, (radius, radius), radius)
+            sprite.set_colorkey(background, pygame.RLEACCEL)
+            self.sprites[key] = sprite
+        return sprite
+
+    def circle_offsets(self, radius: int, color: Color) -> np.ndarray:
+        """(x, y) offsets of the pixels of a circle from its center."""
+        key: tuple[int, int] = (radius, int(color))
+        offsets: np.ndarray | None = self.offsets.get(key)
+        if offsets is None:
+            offsets = np.argwhere(pygame.surfarray.array_colorkey(self.sprite(radius, color))) - radius
+            self.offsets[key] = offsets
+        return offsets
+
+    @staticmethod
+    def _keys(radii: np.ndarray, colors: list[Color]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """The distinct (radius, color) pairs: the index of a particle with each, and the pair of every particle."""
+        # a color is one 32 bit integer (RGBA)
+        codes: np.ndarray = np.fromiter(map(int, colors), dtype=np.int64, count=len(colors))
+        keys, first, inverse = np.unique(radii.astype(np.int64) << 32 | codes, return_index=True, return_inverse=True)
+        return keys, first, inverse
+
+    def draw(self, screen: Surface, group: ParticleGroup, draw_vectors: bool = False) -> None:
+        """Draw all particles of a group with one blits call (the vectors are drawn over them)."""
+        pos, radius, colors, vel, acc = particle_state(group, draw_vectors)
+        self.blit_particles(screen, pos, radius, colors)
+        if draw_vectors:
+            self.draw_vectors(screen, pos, vel, acc)
+
+    def draw_surfarray(self, screen: Surface, group: ParticleGroup) -> None:
+        """Write the pixels of all particles of a group into the screen with NumPy (a 32 bit screen)."""
+        pos, radius, colors, _, _ = particle_state(group, vectors=False)
+        self.write_particles(screen, pos, radius, colors)
+
+    def blit_particles(self, screen: Surface, pos: np.ndarray, radius: np.ndarray, colors: list[Color]) -> None:
+        """Draw circles with one blits call."""
+        # truncated like pygame.draw.circle
+        centers: np.ndarray = pos.astype(np.intp)
+        radii: np.ndarray = radius.astype(np.intp)
+        if not len(radii):
+            return
+
+        # the sprites are looked up once per distinct (radius, color), not per particle
+        _, first, inverse = self._keys(radii, colors)
+        sprites: np.ndarray = np.empty(len(first), dtype=object)
+        sprites[:] = [self.sprite(int(radii[index]), colors[index]) if radii[index] >= 1 else None for index in first]
+        corners: np.ndarray = centers - radii[:, np.newaxis]
+        # circles smaller than a pixel are not drawn (like pygame.draw.circle)
+        if radii.min() < 1:
+            visible: np.ndarray = radii >= 1
+            inverse, corners = inverse[visible], corners[visible]
+        screen.blits(zip(sprites[inverse].tolist(), corners.tolist()), doreturn=False)
+
+    @staticmethod
+    def draw_vectors(screen: Surface, pos: np.ndarray, vel: np.ndarray, acc: np.ndarray) -> None:
+        """The velocity and acceleration vectors of Particle.draw."""
+        width: int = 5
+        for start, velocity, acceleration in zip(pos.tolist(), vel.tolist(), acc.tolist()):
+            pygame.draw.line(screen, Color('red'), start, (start[0] + velocity[0], start[1] + velocity[1]), width)
+            pygame.draw.line(screen, Color('blue'), start, (start[0] + acceleration[0], start[1] + acceleration[1]), width)
+
+    def write_particles(self, screen: Surface, pos: np.ndarray, radius: np.ndarray, colors: list[Color]) -> None:
+        """Write the pixels of circles into the screen with NumPy (a 32 bit screen)."""
+        centers: np.ndarray = pos.astype(np.intp)
+        radii: np.ndarray = radius.astype(np.intp)
+        if not len(radii):
+            return
+
+        # the particles of a sprite are drawn together
+        keys, first, inverse = self._keys(radii, colors)
+        order: np.ndarray = np.argsort(inverse, kind='stable')
+        bounds: np.ndarray = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+
+        width, height = screen.get_size()
+        # mapped colors: one integer per pixel, the rows of the screen are contiguous (no sub-surface)
+        pixels: np.ndarray = pygame.surfarray.pixels2d(screen)
+        flat: np.ndarray | None = pixels.T.reshape(-1) if pixels.T.flags['C_CONTIGUOUS'] else None
+        for key, index in enumerate(first):
+            radius: int = int(radii[index])
+            if radius < 1:
+                continue
+            color: Color = colors[index]
+            offsets: np.ndarray = self.circle_offsets(radius, color)
+            value: int = screen.map_rgb(color)
+            group_centers: np.ndarray = centers[order[bounds[key]:bounds[key + 1]]]
+
+            # whole circles are written by their flat pixel indices
+            inside: np.ndarray = (
+                (group_centers[:, 0] >= radius) & (group_centers[:, 0] + radius <= width)
+                & (group_centers[:, 1] >= radius) & (group_centers[:, 1] + radius <= height)
+            )
+            if flat is not None:
+                starts: np.ndarray = group_centers[inside, 1] * width + group_centers[inside, 0]
+                flat[(starts[:, np.newaxis] + (offsets[:, 1] * width + offsets[:, 0])).reshape(-1)] = value
+                group_centers = group_centers[~inside]
+
+            # the circles on the edges of the screen are clipped
+            points: np.ndarray = (group_centers[:, np.newaxis, :] + offsets[np.newaxis, :, :]).reshape(-1, 2)
+            visible: np.ndarray = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+            points = points[visible]
+            pixels[points[:, 0], points[:, 1]] = value
+        # unlock the screen
+        del pixels
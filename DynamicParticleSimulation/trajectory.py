@@ -0,0 +1,333 @@
+#!usr/bin/python3
+"""
+Recording of the steps of a ParticleGroup into a chunked, compressed binary file.
+Set the recorder of a group (group.recorder = TrajectoryRecorder(path)): after every
+update the positions, the velocities and the resolved collision pairs are copied and
+queued, a background thread gathers them into chunks of steps, compresses the columns
+(zlib releases the GIL) and appends the chunks to the file. close() writes the rest.
+A failure of the writer (e.g. a full disk) closes the file, the next record and close()
+raise it as a TrajectoryError.
+File: header '<4sB' (magic, version), then the chunks until the end of the file:
+    '<4sIIQ' (magic, steps, particles, collisions), then 6 columns, each a '<Q' length
+    and the zlib compressed, byte-shuffled bytes of a little-endian array (all first
+    bytes of the values, then all second bytes...: the exponents and signs of the floats
+    come together and compress well):
+    dt float64[steps], pos float64[steps, particles, 2], vel float64[steps, particles, 2],
+    collisions per step int64[steps], first int64[collisions], second int64[collisions]
+A chunk ends early when the count of the particles changes. The particles are numbered
+by their first appearance, a cut file (e.g. the writer was killed) is read up to its
+last whole chunk. TrajectoryReader memory-maps the file and decompresses the chunks on
+demand.
+    python trajectory.py info run.traj
+    python trajectory.py speeds run.traj --bins 30 --start 1000
+"""
+import argparse
+import mmap
+import queue
+import struct
+import threading
+import zlib
+from operator import attrgetter
+import numpy as np
+
+
+#############
+# CONSTANTS #
+#############
+FILE_HEADER: struct.Struct = struct.Struct('<4sB')
+CHUNK_HEADER: struct.Struct = struct.Struct('<4sIIQ')
+COLUMN_LENGTH: struct.Struct = struct.Struct('<Q')
+MAGIC: bytes = b'PTRJ'
+CHUNK_MAGIC: bytes = b'CHNK'
+VERSION: int = 1
+
+# the columns of a chunk in the file order (and the int64 ones, the others are float64)
+COLUMNS: tuple[str, ...] = ('dt', 'pos', 'vel', 'collision_counts', 'first', 'second')
+INTEGERS: tuple[str, ...] = ('collision_counts', 'first', 'second')
+
+
+def shuffle(column: np.ndarray) -> bytes:
+    """Little-endian bytes of an array, the i-th bytes of all values together."""
+    values: np.ndarray = np.ascontiguousarray(column, dtype=column.dtype.newbyteorder('<')).reshape(-1)
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, values.itemsize).T).tobytes()
+
+
+def unshuffle(data: bytes, dtype: str) -> np.ndarray:
+    itemsize: int = np.dtype(dtype).itemsize
+    return np.ascontiguousarray(np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T).view(dtype).reshape(-1)
+
+
+class TrajectoryError(Exception):
+    """Basic error class for unreadable trajectory files."""
+    pass
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, chunk_steps: int = 256, level: int = 1, queued_chunks: int = 4) -> None:
+        self.path: str = path
+        self.chunk_steps: int = chunk_steps
+        # zlib compression level
+        self.level: int = level
+        self.steps: int = 0
+        self.chunks: int = 0
+
+        # numbering of the particle objects (the order of the particle list may change, e.g. sweep_and_prune)
+        self._particles: list = []
+        self._numbers: dict[int, int] = {}
+
+        self._file = open(path, 'wb')
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        # the step loop waits only if the writer is more than queued_chunks behind
+        self._queue: queue.Queue = queue.Queue(maxsize=queued_chunks * chunk_steps)
+        # an exception of the writer thread, raised again by record_arrays and close
+        self._error: BaseException | None = None
+        self._writer: threading.Thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    ##########
+    # RECORD #
+    ##########
+    def record_arrays(self, dt: float, pos: np.ndarray, vel: np.ndarray, first: np.ndarray, second: np.ndarray) -> None:
+        """Queue a copy of one step (particle arrays and the indices of the collided pairs)."""
+        step: tuple = (
+            dt, np.array(pos, dtype=np.float64), np.array(vel, dtype=np.float64),
+            np.array(first, dtype=np.int64), np.array(second, dtype=np.int64)
+        )
+        self._put(step)
+        self.steps += 1
+
+    def record_objects(self, dt: float, particles: list, collided: list[tuple]) -> None:
+        """Queue one step of particle objects (and the collided pairs of objects)."""
+        # new particles get the next numbers
+        if len(particles) != len(self._particles):
+            for particle in particles:
+                if id(particle) not in self._numbers:
+                    self._numbers[id(particle)] = len(self._particles)
+                    self._particles.append(particle)
+
+        def vectors(name: str) -> np.ndarray:
+            return np.fromiter(
+                (coordinate for vector in map(attrgetter(name), self._particles) for coordinate in vector),
+                dtype=np.float64, count=2 * len(self._particles)
+            ).reshape(-1, 2)
+
+        numbers: dict[int, int] = self._numbers
+        self.record_arrays(
+            dt, vectors('pos'), vectors('vel_buffer'),
+            np.fromiter((numbers[id(a)] for a, _ in collided), dtype=np.int64, count=len(collided)),
+            np.fromiter((numbers[id(b)] for _, b in collided), dtype=np.int64, count=len(collided))
+        )
+
+    def close(self) -> None:
+        """Write the queued steps and close the file (the writer thread closes it)."""
+        if self._writer.is_alive():
+            self._put(None)
+            self._writer.join()
+        self._raise_error()
+
+    def _put(self, item: tuple | None) -> None:
+        """Queue an item for the writer, the queue of a dead writer never empties: wait only while it lives."""
+        while True:
+            self._raise_error()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise TrajectoryError(f'writing {self.path} failed') from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    ##########
+    # WRITER #
+    ##########
+    def _write_chunk(self, steps: list[tuple]) -> None:
+        dts, positions, velocities, firsts, seconds = zip(*steps)
+        columns: list[np.ndarray] = [
+            np.array(dts, dtype=np.float64),
+            np.stack(positions),
+            np.stack(velocities),
+            np.array([len(first) for first in firsts], dtype=np.int64),
+            np.concatenate(firsts),
+            np.concatenate(seconds)
+        ]
+        particles: int = len(positions[0])
+        collisions: int = len(columns[4])
+
+        parts: list[bytes] = [CHUNK_HEADER.pack(CHUNK_MAGIC, len(steps), particles, collisions)]
+        for column in columns:
+            data: bytes = zlib.compress(shuffle(column), self.level)
+            parts.append(COLUMN_LENGTH.pack(len(data)))
+            parts.append(data)
+        self._file.write(b''.join(parts))
+        self.chunks += 1
+
+    def _write_loop(self) -> None:
+        steps: list[tuple] = []
+        error: BaseException | None = None
+        try:
+            while (step := self._queue.get()) is not None:
+                # particles were added: a new chunk
+                if steps and len(step[1]) != len(steps[0][1]):
+                    self._write_chunk(steps)
+                    steps = []
+                steps.append(step)
+                if len(steps) == self.chunk_steps:
+                    self._write_chunk(steps)
+                    steps = []
+            if steps:
+                self._write_chunk(steps)
+        except BaseException as exception:
+            error = exception
+        finally:
+            # closed before the error is published (a flush may fail too)
+            try:
+                self._file.close()
+            except OSError as exception:
+                error = error or exception
+            self._error = error
+
+
+class TrajectoryReader:
+    """Memory-mapped trajectory file, the chunks are decompressed when they are needed."""
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        try:
+            self._map: mmap.mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise TrajectoryError(f'empty trajectory file: {path}')
+        if len(self._map) < FILE_HEADER.size:
+            raise TrajectoryError(f'not a trajectory file: {path}')
+        magic, version = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise TrajectoryError(f'not a trajectory file (version {VERSION}): {path}')
+
+        # (steps, particles, collisions, [(offset, length) of the columns]) of the whole chunks
+        self.chunks: list[tuple[int, int, int, list[tuple[int, int]]]] = []
+        offset: int = FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= len(self._map):
+            magic, steps, particles, collisions = CHUNK_HEADER.unpack_from(self._map, offset)
+            if magic != CHUNK_MAGIC:
+                raise TrajectoryError(f'broken chunk at byte {offset}: {path}')
+            offset += CHUNK_HEADER.size
+            columns: list[tuple[int, int]] = []
+            for _ in COLUMNS:
+                if offset + COLUMN_LENGTH.size > len(self._map):
+                    break
+                length: int = COLUMN_LENGTH.unpack_from(self._map, offset)[0]
+                offset += COLUMN_LENGTH.size
+                columns.append((offset, length))
+                offset += length
+            # the end of a cut file
+            if len(columns) != len(COLUMNS) or offset > len(self._map):
+                break
+            self.chunks.append((steps, particles, collisions, columns))
+
+        # first step of every chunk (and the count of the steps at the end)
+        self.starts: np.ndarray = np.concatenate(([0], np.cumsum([chunk[0] for chunk in self.chunks]))).astype(np.int64)
+        # the last decompressed chunk
+        self._cached: tuple[int, dict[str, np.ndarray]] | None = None
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def _column(self, chunk: int, name: str) -> np.ndarray:
+        steps, particles, collisions, columns = self.chunks[chunk]
+        offset, length = columns[COLUMNS.index(name)]
+        column: np.ndarray = unshuffle(zlib.decompress(self._map[offset:offset + length]), '<i8' if name in INTEGERS else '<f8')
+        if name in ('pos', 'vel'):
+            return column.reshape(steps, particles, 2)
+        return column
+
+    def chunk(self, index: int) -> dict[str, np.ndarray]:
+        """All columns of a chunk."""
+        if self._cached is None or self._cached[0] != index:
+            self._cached = (index, {name: self._column(index, name) for name in COLUMNS})
+        return self._cached[1]
+
+    def _locate(self, step: int) -> tuple[dict[str, np.ndarray], int]:
+        if not -len(self) <= step < len(self):
+            raise IndexError(f'step {step} of {len(self)} steps')
+        step %= len(self)
+        index: int = int(np.searchsorted(self.starts, step, side='right')) - 1
+        return self.chunk(index), step - int(self.starts[index])
+
+    def positions(self, step: int) -> np.ndarray:
+        chunk, row = self._locate(step)
+        return chunk['pos'][row]
+
+    def velocities(self, step: int) -> np.ndarray:
+        chunk, row = self._locate(step)
+        return chunk['vel'][row]
+
+    def collisions(self, step: int) -> tuple[np.ndarray, np.ndarray]:
+        """The collided pairs of a step."""
+        chunk, row = self._locate(step)
+        ends: np.ndarray = np.cumsum(chunk['collision_counts'])
+        start: int = int(ends[row - 1]) if row else 0
+        return chunk['first'][start:ends[row]], chunk['second'][start:ends[row]]
+
+    def times(self) -> np.ndarray:
+        """Simulated time after every step (only the dt columns are decompressed)."""
+        return np.cumsum(np.concatenate([self._column(index, 'dt') for index in range(len(self.chunks))] or [np.empty(0)]))
+
+    def speeds(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Speeds of all particles of the steps [start, stop), chunk by chunk."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        parts: list[np.ndarray] = []
+        for index in range(len(self.chunks)):
+            first_step, end_step = int(self.starts[index]), int(self.starts[index + 1])
+            if end_step <= start or first_step >= stop:
+                continue
+            vel: np.ndarray = self._column(index, 'vel')[max(start - first_step, 0):stop - first_step]
+            parts.append(np.hypot(vel[..., 0], vel[..., 1]).ravel())
+        return np.concatenate(parts) if parts else np.empty(0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    info_parser = commands.add_parser('info', help='steps, chunks and collisions of a file')
+    info_parser.add_argument('path')
+    speeds_parser = commands.add_parser('speeds', help='histogram of the speeds (e.g. against Maxwell-Boltzmann)')
+    speeds_parser.add_argument('path')
+    speeds_parser.add_argument('--bins', type=int, default=20)
+    speeds_parser.add_argument('--start', type=int, default=0, help='first step (skip the start of the run)')
+    args = parser.parse_args()
+
+    with TrajectoryReader(args.path) as reader:
+        if args.command == 'info':
+            collisions: int = sum(chunk[2] for chunk in reader.chunks)
+            particles: list[int] = [chunk[1] for chunk in reader.chunks]
+            times: np.ndarray = reader.times()
+            print(f'{len(reader)} steps in {len(reader.chunks)} chunks, {times[-1] if len(times) else 0:.3f}s simulated')
+            print(f'particles: {min(particles, default=0)}-{max(particles, default=0)}, collisions: {collisions}')
+
+        elif args.command == 'speeds':
+            speeds: np.ndarray = reader.speeds(args.start)
+            counts, edges = np.histogram(speeds, bins=args.bins)
+            width: int = 50
+            for count, low, high in zip(counts, edges[:-1], edges[1:]):
+                print(f'{low:>9.2f} - {high:>9.2f} {count:>9} ' + '#' * int(width * count / max(counts.max(), 1)))
+
+
+if __name__ == '__main__':
+    main()